@@ -0,0 +1,250 @@
+#-*- coding:utf-8 -*-
+""" :mod:`reliure.aio`
+====================
+
+Play components, blocks and engines from :mod:`asyncio` coroutines (python 3
+only).
+
+Components may be coroutine functions (`async def`), they are then awaited,
+other components are run in the event loop default executor so that they do
+not block the loop:
+
+>>> import asyncio
+>>> from reliure.engine import Engine
+>>> async def fetch(url):
+...     await asyncio.sleep(0.01)   # a request to a remote API for ex.
+...     return "content of %s" % url
+>>> engine = Engine("fetch", "count")
+>>> engine.fetch.setup(in_name="url", out_name="page")
+>>> engine.fetch.set(fetch)
+>>> engine.count.setup(in_name="page", out_name="size")
+>>> engine.count.set(len)
+>>> async def main():
+...     plays = [engine.play_async(url="http://%d" % num) for num in range(3)]
+...     return await asyncio.gather(*plays)
+>>> [res["size"] for res in asyncio.run(main())]
+[19, 19, 19]
+
+.. note:: blocks and engines :attr:`meta` is setted when the play coroutine
+    returns, so it should be read right after the `await`.
+"""
+import time
+import asyncio
+import inspect
+import traceback
+import functools
+from collections import OrderedDict
+
+from reliure.pipeline import Optionable, OptionableSequence
+from reliure.pipeline import Pipeline, Map, MapSeq, MapReduce
+from reliure.engine import BasicPlayMeta, PlayMeta
+
+__all__ = ["is_async", "call", "play_block", "play_engine"]
+
+
+def _is_coroutine_function(func):
+    func = getattr(func, "_no_check", func)     # checked methods
+    return inspect.iscoroutinefunction(inspect.unwrap(func))
+
+def is_async(comp):
+    """ Whether a component should be awaited: coroutine functions,
+    components build on coroutine functions or with a coroutine `__call__`,
+    and sequences of components with at least one of them.
+
+    >>> from reliure import Composable
+    >>> async def double(x):
+    ...     return x * 2
+    >>> is_async(Composable(double))
+    True
+    >>> is_async(Composable(double) | Composable(lambda x: x + 1))
+    True
+    >>> is_async(Composable(lambda x: x + 1))
+    False
+    """
+    if isinstance(comp, OptionableSequence):
+        return any(is_async(item) for item in comp.items)
+    if _is_coroutine_function(comp):
+        return True
+    call_fct = getattr(type(comp), "__call__", None)
+    return call_fct is not None and _is_coroutine_function(call_fct)
+
+
+async def call(comp, *args, **kwargs):
+    """ Call a component from a coroutine.
+
+    >>> from reliure import Composable
+    >>> async def double(x):
+    ...     return x * 2
+    >>> pipeline = Composable(double) | Composable(lambda x: x + 1)
+    >>> asyncio.run(call(pipeline, 4))
+    9
+
+    Coroutine components are awaited, the other ones are run in the event
+    loop default executor. Items of :class:`.Pipeline`, :class:`.MapSeq`,
+    :class:`.MapReduce` and :class:`.Map` that are coroutine are also awaited
+    (items of maps are run concurrently).
+    """
+    if isinstance(comp, OptionableSequence) and is_async(comp):
+        return await _call_sequence(comp, args, kwargs)
+    if is_async(comp):
+        return await comp(*args, **kwargs)
+    loop = asyncio.get_event_loop()
+    result = await loop.run_in_executor(None, functools.partial(comp, *args, **kwargs))
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+async def _call_item(sequence, item, args, kwargs):
+    """ Async equivalent of :func:`.OptionableSequence.call_item`
+    """
+    item_kwargs = {}
+    if isinstance(item, Optionable):
+        item_kwargs = item.resolve_options_values(kwargs)
+    sequence.logger.debug("calling %s '%s' with %s", item, item.name, item_kwargs)
+    try:
+        return await call(item, *args, **item_kwargs)
+    except Exception:
+        sequence.logger.error("error in component '%s'" % (item.name))
+        raise
+
+async def _call_sequence(sequence, args, kwargs):
+    """ Call a sequence of components that contains coroutines
+    """
+    kwargs = sequence.resolve_options_values(kwargs, strict=True, hidden=True)
+    if isinstance(sequence, Pipeline):
+        for item in sequence.items:
+            args = [await _call_item(sequence, item, args, kwargs)]
+        return args[0]
+    elif isinstance(sequence, MapSeq):
+        array = list(await asyncio.gather(*[_call_item(sequence, item, args, kwargs)
+                                            for item in sequence.items]))
+        if isinstance(sequence, MapReduce):
+            return sequence.reduce(array, *args, **kwargs)
+        return array
+    elif isinstance(sequence, Map):
+        inputs, = args
+        return list(await asyncio.gather(*[call(sequence.comp, value, **kwargs)
+                                           for value in inputs]))
+    raise NotImplementedError("%s can't be called asynchronously" % sequence.__class__.__name__)
+
+
+async def play_block(block, *inputs, **named_inputs):
+    """ Coroutine version of :func:`.Block.play`, same arguments.
+
+    >>> from reliure.engine import Block
+    >>> async def double(x):
+    ...     return x * 2
+    >>> block = Block("double")
+    >>> block.set(double)
+    >>> asyncio.run(play_block(block, 21))
+    {'double': 42}
+
+    .. note:: the block cache (if any) is not used
+    """
+    outputs, block.meta, error = await _play_block(block, inputs, named_inputs)
+    if error is not None:
+        raise error
+    return outputs
+
+async def _play_block(block, inputs, named_inputs):
+    """ Play a block and returns its outputs, its meta and the error (if any)
+    """
+    config = block.play_config(named_inputs.pop("config", None))
+    outputs = named_inputs.pop("outputs", None)
+    block.validate(config)
+    start = time.time()
+    meta = PlayMeta(block.name)
+    inputs = block._inputs(inputs, named_inputs)
+    results = {}
+    if outputs is not None and block.out_name not in outputs:
+        return results, meta, None
+    for comp_name, options in config.items():
+        comp = block[comp_name]
+        comp_meta_res = BasicPlayMeta(comp)
+        meta.append(comp_meta_res)
+        comp_meta_res.run_with(inputs, options)
+        block._logger.debug("'%s' playing (async): %s" % (block.name, comp.name))
+        try:
+            results[block.out_name] = await call(comp, *inputs, **options)
+        except Exception as err:
+            comp_meta_res.add_error(err)
+            block._logger.error("error in component '%s': %s\n%s" % (comp.name, str(err), traceback.format_exc()))
+            return None, meta, err
+        finally:
+            now = time.time()
+            comp_meta_res.time = now - start
+            start = now
+    return results, meta, None
+
+
+async def play_engine(engine, *inputs, **named_inputs):
+    """ Coroutine version of :func:`.Engine.play`, same arguments.
+
+    The blocks are run as soon as the blocks they depend on are done (see
+    :func:`.Engine.dependencies`), so independent blocks are run
+    concurrently:
+
+    >>> from reliure.engine import Engine
+    >>> async def slow(x):
+    ...     await asyncio.sleep(0.05)
+    ...     return x
+    >>> engine = Engine("op1", "op2", "op3")
+    >>> engine.op1.setup(in_name="in", out_name="left")
+    >>> engine.op2.setup(in_name="in", out_name="right")
+    >>> engine.op3.setup(in_name=["left", "right"], out_name="out")
+    >>> engine.op1.set(slow)
+    >>> engine.op2.set(slow)
+    >>> engine.op3.set(lambda x, y: x + y)
+    >>> start = time.time()
+    >>> asyncio.run(play_engine(engine, 2))["out"]
+    4
+    >>> time.time() - start < 0.1
+    True
+
+    Results and play meta data are the same than with :func:`.Engine.play`.
+    """
+    config = engine.play_config(named_inputs.pop("config", None))
+    outputs = named_inputs.pop("outputs", None)
+    meta = PlayMeta("engine")
+    results = engine._play_inputs(inputs, named_inputs)
+    engine.validate(results.keys(), config)
+    needed_blocks = None
+    if outputs is not None:
+        needed_blocks = set(engine.needed_blocks(outputs, config))
+    graph = engine._play_graph(config, needed_blocks)
+    data = dict(results)    # available data
+    block_outputs = {}      # block name -> block outputs
+    metas = {}              # block name -> block meta
+    errors = {}             # block name -> error
+    tasks = OrderedDict()   # block name -> task
+
+    async def play(name, in_names, deps):
+        if deps:
+            await asyncio.wait([tasks[dep] for dep in deps])
+        if not deps.issubset(block_outputs):
+            return  # a dependency failed
+        block_inputs = [data[in_name] for in_name in in_names]
+        outputs, metas[name], error = await _play_block(engine[name], block_inputs,
+                                                        {"config": config[name]})
+        if error is not None:
+            errors[name] = error
+        else:
+            block_outputs[name] = outputs
+            data.update(outputs)
+
+    # note: dependencies are before in the graph
+    for name, (in_names, deps) in graph.items():
+        tasks[name] = asyncio.ensure_future(play(name, in_names, deps))
+    await asyncio.gather(*tasks.values())
+    # store results and metadata in the blocks order
+    for name in graph:
+        if name in block_outputs:
+            results.update(block_outputs[name])
+        if name in metas:
+            engine[name].meta = metas[name]
+            meta.append(metas[name])
+    engine.meta = meta
+    for name in graph:
+        if name in errors:
+            raise errors[name]
+    return results
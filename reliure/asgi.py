@@ -0,0 +1,408 @@
+#-*- coding:utf-8 -*-
+""" :mod:`reliure.asgi`
+=====================
+
+ASGI version of :class:`.ReliureAPI` (python 3 only): the same routes and the
+same JSON contract, served by any ASGI server (uvicorn, hypercorn, ...)
+without a WSGI worker by request.
+
+>>> from reliure.engine import Engine
+>>> from reliure.types import Numeric
+>>> from reliure.web import EngineView
+>>> engine = Engine("process")
+>>> engine.process.setup(in_name="in", out_name="out")
+>>> engine.process.set(lambda x: x**2)
+>>> egn_view = EngineView(engine)
+>>> egn_view.set_input_type(Numeric())
+>>> egn_view.add_output("out")
+>>> app = ReliureASGI("api")
+>>> app.register_view(egn_view, url_prefix="egn")
+
+The app is then served with an ASGI server (`uvicorn mymodule:app` for ex.).
+
+Plays of engines whose components are coroutines (see :mod:`reliure.aio`)
+are awaited, so a single process may hold many concurrent slow requests.
+Other plays (and plays through a :class:`.BatchScheduler`) are run in a
+bounded thread pool, the requests beyond `max_workers` wait without holding a
+thread.
+"""
+import re
+import json
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from six.moves.urllib.parse import parse_qs
+
+from reliure.exceptions import ReliurePlayError, ValidationError
+from reliure.engine import Engine
+from reliure.aio import is_async
+from reliure.web import STREAM_TYPES, STREAM_HEADERS
+from reliure.serializers import JsonSerializer
+
+__all__ = ["ReliureASGI"]
+
+_JSON = JsonSerializer()
+
+
+#: regexp of the Flask route converters
+_CONVERTERS = {
+    "string": (r"[^/]+", str),
+    "int": (r"\d+", int),
+    "float": (r"\d+\.\d+", float),
+    "path": (r".+", str),
+}
+
+def compile_route(route):
+    """ Returns the regexp and the converters of a route in Flask syntax
+
+    >>> regexp, converters = compile_route("/api/egn/n/<int:num>")
+    >>> match = regexp.match("/api/egn/n/33")
+    >>> converters["num"](match.group("num"))
+    33
+    """
+    pattern = []
+    converters = {}
+    pos = 0
+    for match in re.finditer(r"<(?:(\w+):)?(\w+)>", route):
+        conv, name = match.group(1) or "string", match.group(2)
+        if conv not in _CONVERTERS:
+            raise ValueError("Unknown route converter '%s'" % conv)
+        regexp, converters[name] = _CONVERTERS[conv]
+        pattern.append(re.escape(route[pos:match.start()]))
+        pattern.append("(?P<%s>%s)" % (name, regexp))
+        pos = match.end()
+    pattern.append(re.escape(route[pos:]))
+    return re.compile("^%s$" % "".join(pattern)), converters
+
+
+class HTTPError(Exception):
+    """ Error returned as a JSON response
+    """
+    def __init__(self, status, message):
+        super(HTTPError, self).__init__(message)
+        self.status = status
+
+
+class Response(object):
+    """ Serialized response
+    """
+    def __init__(self, body, content_type):
+        self.body = body
+        self.content_type = content_type
+
+
+class StreamingResponse(object):
+    """ Response whose body is sent chunk by chunk
+    """
+    def __init__(self, content_type, chunks, headers=None):
+        """
+        :param content_type: content type of the response
+        :param chunks: async iterator of the chunks (bytes)
+        :param headers: other headers
+        """
+        self.content_type = content_type
+        self.chunks = chunks
+        self.headers = headers or {}
+
+
+class ReliureASGI(object):
+    """ ASGI json API over some :class:`.EngineView` (see :class:`.ReliureAPI`)
+
+    Routes are the same than with :class:`.ReliureAPI`:
+
+    - [GET] /api/: returns a json that describe the api routes
+    - [GET] /api/egn and /api/egn/options: returns a json that describe the
+      engine
+    - [POST] /api/egn and /api/egn/play: run the engine
+    - [POST] /api/egn/play_batch: run the engine over a list of inputs
+    - [POST] /api/egn/play_stream: run the engine and stream its outputs
+    - [GET] short play routes (see :func:`.EngineView.play_route`)
+    """
+    def __init__(self, name="api", url_prefix=None, expose_route=True, max_workers=32):
+        """
+        :param name: the name of this api (used as url prefix by default)
+        :param url_prefix: url prefix of the api routes
+        :param expose_route: wether / returns all api routes default True
+        :param max_workers: number of threads that play the synchronous
+            engines
+        """
+        self._logger = logging.getLogger("reliure.%s" % self.__class__.__name__)
+        if url_prefix is None:
+            url_prefix = "/%s" % name
+        self.name = name
+        self.url_prefix = url_prefix.rstrip("/")
+        self.expose_route = expose_route
+        self.max_workers = max_workers
+        self._executor = None
+        self._routes = []   # (path, endpoint, methods, regexp, converters, handler)
+        self._async_views = {}
+        if expose_route:
+            self._add_route("/", "routes", ["GET"], self._routes_handler)
+
+    def __repr__(self):
+        return self.name
+
+    @property
+    def executor(self):
+        """ Thread pool that plays the synchronous engines
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.max_workers)
+        return self._executor
+
+    def close(self):
+        """ Shutdown the thread pool (called at the server shutdown)
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _add_route(self, path, endpoint, methods, handler):
+        path = re.sub("/+", "/", "%s/%s" % (self.url_prefix, path))
+        regexp, converters = compile_route(path)
+        self._routes.append((path, endpoint, methods, regexp, converters, handler))
+
+    def register_view(self, view, url_prefix=None):
+        """ Associate a :class:`.EngineView` to this api
+        """
+        if url_prefix is None:
+            if view.name is None:
+                raise ValueError("EngineView has no name and path is not specified")
+            url_prefix = view.name
+        options = lambda request, **kwargs: self._options(view)
+        play = lambda request, **kwargs: self._play(view, request)
+        short_play = lambda request, **kwargs: self._short_play(view, request, kwargs)
+        self._add_route("/%s" % url_prefix, "%s_options" % url_prefix, ["GET"], options)
+        self._add_route("/%s" % url_prefix, url_prefix, ["POST"], play)
+        self._add_route("/%s/options" % url_prefix, "%s_options_OLD" % url_prefix, ["GET"], options)
+        self._add_route("/%s/play" % url_prefix, "%s_OLD" % url_prefix, ["POST"], play)
+        self._add_route("/%s/play_batch" % url_prefix, "%s_play_batch" % url_prefix, ["POST"],
+                        lambda request, **kwargs: self._play_batch(view, request))
+        self._add_route("/%s/play_stream" % url_prefix, "%s_play_stream" % url_prefix, ["POST"],
+                        lambda request, **kwargs: self._play_stream(view, request))
+        for route in view._short_routes:
+            self._add_route("/%s/%s" % (url_prefix, route), "%s_short_play" % url_prefix,
+                            ["GET"], short_play)
+
+    def is_async(self, view):
+        """ Whether the plays of a view are awaited (else they are run in the
+        thread pool)
+        """
+        if view.scheduler is not None:
+            return False
+        if view not in self._async_views:
+            engine = view.engine
+            blocks = list(engine) if isinstance(engine, Engine) else [engine]
+            self._async_views[view] = any(is_async(comp) for block in blocks for comp in block)
+        return self._async_views[view]
+
+    ### handlers
+
+    async def _routes_handler(self, request):
+        scheme = request["scope"].get("scheme", "http")
+        host = request["headers"].get("host", "localhost")
+        routes = [{"path": path, "name": "%s.%s" % (self.name, endpoint), "methods": methods}
+                  for path, endpoint, methods, _, _, _ in self._routes]
+        return {
+            "api": self.name,
+            "url_root": "%s://%s%s/" % (scheme, host, request["scope"].get("root_path", "")),
+            "routes": routes
+        }
+
+    async def _options(self, view):
+        return view.options_dict()
+
+    async def _play(self, view, request):
+        data, options = self._parse_play(view, request)
+        serializer = view.serializer(request["headers"].get("accept"))
+        return Response(await self.play(view, data, options, serializer), serializer.content_type)
+
+    def _parse_play(self, view, request):
+        """ Returns the inputs data and the options of a play request (see
+        :func:`.EngineView.parse_request`)
+        """
+        content_type = request["headers"].get("content-type", "")
+        if content_type.startswith("application/json"):
+            try:
+                data = json.loads(request["body"].decode("utf8"))
+            except ValueError:
+                raise HTTPError(400, "Invalid JSON data")
+            if not isinstance(data, dict):
+                raise HTTPError(400, "JSON data should be an object")
+            options = data.pop("options", {})
+        else:
+            data = {}
+            if content_type.startswith("application/x-www-form-urlencoded"):
+                data.update(self._parse_qs(request["body"].decode("utf8")))
+            data.update(request["args"])
+            options = view._config_from_url(request["args"])
+        return data, options
+
+    async def _play_stream(self, view, request):
+        data, options = self._parse_play(view, request)
+        fmt = view.stream_format(request["headers"].get("accept", ""))
+        loop = asyncio.get_event_loop()
+        if not self.is_async(view):
+            chunks = await loop.run_in_executor(self.executor, view.stream, data, options, fmt)
+        else:
+            config, inputs = view.prepare_play(data, options)
+            raw_res = None
+            try:
+                raw_res = await view.engine.play_async(config=config, outputs=list(view._outputs), **inputs)
+            except ReliurePlayError:
+                pass
+            chunks = view.stream_outputs(raw_res, view.engine.meta, fmt)
+        return StreamingResponse(STREAM_TYPES[fmt], self._iterate(chunks), STREAM_HEADERS)
+
+    async def _iterate(self, chunks):
+        """ Async iterator over a (blocking) iterator, the items are produced
+        in the thread pool
+        """
+        loop = asyncio.get_event_loop()
+        done = object()
+        while True:
+            chunk = await loop.run_in_executor(self.executor, next, chunks, done)
+            if chunk is done:
+                break
+            yield chunk
+
+    async def _play_batch(self, view, request):
+        try:
+            data = json.loads(request["body"].decode("utf8"))
+        except ValueError:
+            raise HTTPError(400, "Invalid JSON data")
+        inputs_list, options = view.parse_batch(data)
+        # note: batches are played in the thread pool (there is no async batch play)
+        loop = asyncio.get_event_loop()
+        outputs = await loop.run_in_executor(self.executor, view.run_batch, inputs_list, options)
+        serializer = view.serializer(request["headers"].get("accept"))
+        return Response(serializer.dumps(outputs), serializer.content_type)
+
+    async def _short_play(self, view, request, kwargs):
+        options = view._config_from_url(request["args"])
+        serializer = view.serializer(request["headers"].get("accept"))
+        return Response(await self.play(view, kwargs, options, serializer), serializer.content_type)
+
+    async def run(self, view, inputs_data, options):
+        """ Coroutine version of :func:`.EngineView.run`
+        """
+        if not self.is_async(view):
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(self.executor, view.run, inputs_data, options)
+        config, inputs = view.prepare_play(inputs_data, options)
+        return await self._run_async(view, config, inputs)
+
+    async def _run_async(self, view, config, inputs):
+        raw_res = None
+        try:
+            raw_res = await view.engine.play_async(config=config, outputs=list(view._outputs), **inputs)
+        except ReliurePlayError:
+            pass
+        # note: the meta is setted when the play returns
+        return view.format_outputs(raw_res, view.engine.meta)
+
+    async def play(self, view, inputs_data, options, serializer=None):
+        """ Returns the serialized response of a play (see :func:`run`), from
+        the view cache if any (see :func:`.EngineView.play_cached`)
+        """
+        serializer = serializer or view.serializers[0]
+        if not self.is_async(view):
+            if view.cache is not None:
+                loop = asyncio.get_event_loop()
+                return await loop.run_in_executor(self.executor, view.play_cached,
+                                                  inputs_data, options, serializer)
+            return serializer.dumps(await self.run(view, inputs_data, options))
+        config, inputs = view.prepare_play(inputs_data, options)
+        key, response = view.cache_lookup(config, inputs, serializer)
+        if response is None:
+            response = view.cache_store(key, await self._run_async(view, config, inputs), serializer)
+        return response
+
+    ### ASGI
+
+    @staticmethod
+    def _parse_qs(query):
+        return dict((key, values[0]) for key, values in parse_qs(query).items())
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self._http(scope, receive, send)
+        else:
+            raise ValueError("Unsupported ASGI scope type '%s'" % scope["type"])
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _http(self, scope, receive, send):
+        body = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            body.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        request = {
+            "scope": scope,
+            "headers": dict((key.decode("latin1").lower(), value.decode("latin1"))
+                            for key, value in scope.get("headers", [])),
+            "args": self._parse_qs(scope.get("query_string", b"").decode("utf8")),
+            "body": b"".join(body),
+        }
+        try:
+            handler, kwargs = self._match(scope["method"], scope["path"])
+            status, data = 200, await handler(request, **kwargs)
+        except HTTPError as err:
+            status, data = err.status, {"error": str(err)}
+        except (ValueError, ValidationError) as err:
+            status, data = 400, {"error": str(err)}
+        except Exception as err:
+            self._logger.exception("error in %s %s", scope["method"], scope["path"])
+            status, data = 500, {"error": str(err)}
+        if isinstance(data, StreamingResponse):
+            await self._send_stream(send, data)
+            return
+        if not isinstance(data, Response):
+            data = Response(_JSON.dumps(data), _JSON.content_type)
+        body = data.body
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", data.content_type.encode("latin1")),
+                        (b"content-length", str(len(body)).encode("latin1"))],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def _send_stream(self, send, response):
+        headers = [(b"content-type", response.content_type.encode("latin1"))]
+        headers.extend((key.lower().encode("latin1"), value.encode("latin1"))
+                       for key, value in response.headers.items())
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        async for chunk in response.chunks:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    def _match(self, method, path):
+        """ Returns the handler of a request and its arguments
+        """
+        allowed = False
+        for _, _, methods, regexp, converters, handler in self._routes:
+            match = regexp.match(path)
+            if match is None:
+                continue
+            if method not in methods:
+                allowed = True
+                continue
+            kwargs = dict((name, converters[name](value))
+                          for name, value in match.groupdict().items())
+            return handler, kwargs
+        if allowed:
+            raise HTTPError(405, "Method Not Allowed")
+        raise HTTPError(404, "Not Found")
@@ -5,16 +5,23 @@
 see :ref:`reliure-engine` for documentation
 """
 
+import copy
 import time
 import logging
+import threading
 import warnings
 import traceback
 import itertools
 import six
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Executor
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from six.moves import collections_abc
 
 from reliure.exceptions import ReliureError
 from reliure.pipeline import Pipeline, Optionable, Composable
+from reliure.utils.cache import make_key
 
 
 class BasicPlayMeta(object):
@@ -50,6 +57,9 @@ class BasicPlayMeta(object):
     {'errors': [], 'name': 'TheComp', 'time': 9.2e-05, 'warnings': []}
 
     """
+    _cache_hit = None   # None if no cache is used, else whether the output was in cache
+    _cache_time = 0.    # time spend to look in the cache
+
     def __init__(self, component):
         self._name = component.name
         self._obj = repr(component)
@@ -88,6 +98,28 @@ class BasicPlayMeta(object):
     def warnings(self):
         return self._warnings
 
+    @property
+    def cache_hit(self):
+        """ None if the component is not cached, else whether the output was
+        found in cache
+        """
+        return self._cache_hit
+
+    def cache_lookup(self, hit, time):
+        """ Register a cache lookup (see :func:`Block.setup`)
+
+        >>> comp = Composable(name="TheComp", func=lambda x: x)
+        >>> meta = BasicPlayMeta(comp)
+        >>> meta.cache_lookup(True, 2e-06)
+        >>> meta.as_dict()["cache"]
+        {'hit': True, 'time': 2e-06}
+
+        :param hit: whether the output was in cache
+        :param time: time spend to look in the cache
+        """
+        self._cache_hit = hit
+        self._cache_time = time
+
     def run_with(self, inputs, options):
         """ Store the run parameters (inputs and options)
         """
@@ -116,12 +148,12 @@ class BasicPlayMeta(object):
     @property
     def has_error(self):
         """ wether any error happened """
-        return len(self._errors) > 0
+        return len(self.errors) > 0
 
     @property
     def has_warning(self):
         """ wether there where a warning during play """
-        return len(self._warnings) > 0
+        return len(self.warnings) > 0
 
     def as_dict(self):
         """ Pre-serialisation of the meta data """
@@ -132,6 +164,8 @@ class BasicPlayMeta(object):
         drepr["errors"] = [str(err) for err in self.errors]
         # warning  pre-serialisation
         drepr["warnings"] = [str(warn) for warn in self.warnings]
+        if self._cache_hit is not None:
+            drepr["cache"] = {"hit": self._cache_hit, "time": self._cache_time}
         return drepr
 
 
@@ -238,6 +272,37 @@ class PlayMeta(BasicPlayMeta):
         return drepr
 
 
+class PlayConfig(OrderedDict):
+    """ Configuration of a :class:`Block` or of an :class:`Engine` for one play.
+
+    For a block it maps the names of the selected components to their options
+    values, for an engine it maps the names of the blocks to the blocks
+    :class:`PlayConfig`.
+
+    It is built by :func:`Block.play_config` or :func:`Engine.play_config`
+    without modifying the blocks nor the components, so one engine can be
+    played concurrently with different configurations:
+
+    >>> engine = Engine("op")
+    >>> engine.op.set(Composable(name="plus", func=lambda x: x + 1),
+    ...               Composable(name="minus", func=lambda x: x - 1))
+    >>> config = engine.play_config({"op": {"name": "minus"}})
+    >>> list(config["op"].items())
+    [('minus', {})]
+    >>> engine.play(10, config=config)["op"]
+    9
+    >>> engine.play(10)["op"]   # the engine itself is not configured
+    11
+    """
+
+
+def _is_checked(component):
+    """ Whether the component `__call__` is decorated by :func:`Optionable.check`
+    (that already force the hidden values)
+    """
+    return hasattr(component.__call__, '_checked') and component.__call__._checked
+
+
 class Block(object):
     """ A block is a processing step realised by one component.
 
@@ -261,6 +326,7 @@ class Block(object):
         :type name: str
         """
         self._logger = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+        self._local = threading.local()     # per thread data (play meta)
         # declare attributs
         self._name = None 
         self._selected = []
@@ -278,6 +344,7 @@ class Block(object):
         self.hidden = False
         self.multiple = False
         self._defaults = []
+        self.cache = None   # components outputs cache
         #handle results meta
         self.meta = None #note: this argument is (re)setted in play
 
@@ -285,6 +352,25 @@ class Block(object):
         # Attrs used to build a result object
         self.has_run = False
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    @property
+    def meta(self):
+        """ :class:`PlayMeta` of the last play (made in the current thread)
+        """
+        return getattr(self._local, "meta", None)
+
+    @meta.setter
+    def meta(self, meta):
+        self._local.meta = meta
+
     @property
     def name(self):
         """Name of the optionable component"""
@@ -325,7 +411,7 @@ class Block(object):
         """
         return list(self._components.keys())
 
-    def needed_inputs(self):
+    def needed_inputs(self, config=None):
         """ Return a list of (needed) inputs names
         """
         return self.in_name
@@ -420,12 +506,34 @@ class Block(object):
                 component.clear_options_values()
 
     def setup(self, in_name=None, out_name=None, required=None, hidden=None,
-                multiple=None, defaults=None):
+                multiple=None, defaults=None, cache=None):
         """ Set the options of the block.
         Only the not None given options are set
 
         .. note:: a block may have multiple inputs but have only one output
 
+        With a `cache` the components are not called again for inputs and
+        options values already seen:
+
+        >>> from reliure.utils.cache import LRU
+        >>> block = Block("count")
+        >>> block.set(lambda text: text.count("a"))
+        >>> block.setup(cache=LRU(maxsize=1000, ttl=60))
+        >>> block.play("abracadabra")
+        {'count': 5}
+        >>> block.play("abracadabra")
+        {'count': 5}
+        >>> [meta.cache_hit for meta in block.meta]
+        [True]
+        >>> block.cache.stats()["hits"]
+        1
+
+        Only hashable inputs (or lists, dicts and sets of hashable values) are
+        cached, and iterators outputs are never cached. The outputs are copied
+        when they are stored and when they are found (so that the next
+        components may modify them), outputs that can't be copied are not
+        cached.
+
         :param in_name: name(s) of the block input data
         :type in_name: str or list of str
         :param out_name: name of the block output data
@@ -438,6 +546,8 @@ class Block(object):
         :type multiple: bool
         :param defaults: names of the selected components
         :type defaults: list of str, or str
+        :param cache: cache for components outputs (False to remove it)
+        :type cache: :class:`.LRU`
         """
         if in_name is not None:
             self.in_name = in_name if isinstance(in_name, list) else [in_name]
@@ -452,6 +562,8 @@ class Block(object):
         if defaults is not None:
             #if default is just a 'str' it is managed in setter
             self.defaults = defaults
+        if cache is not None:
+            self.cache = None if cache is False else cache
 
     def set(self, *components):
         """ Set the possible components of the block
@@ -566,6 +678,19 @@ class Block(object):
 
         """
         self._logger.info("configure block <%s>" % self.name)
+        config = self._check_config(config)
+        # remove selection and reset to default options
+        self.clear_selections()
+
+        # configure the block
+        # select and set options
+        for req_comp in config:
+            self.select(req_comp['name'], req_comp.get("options", {}))
+
+    def _check_config(self, config):
+        """ Check a block configuration (see :func:`configure`) and returns it
+        as a list
+        """
         # normalise input format
         if isinstance(config, dict):
             if len(config) == 0:
@@ -587,19 +712,61 @@ class Block(object):
             if req_comp['name'] not in self:
                 raise ValueError("Invalid component (%s) for block '%s' "
                     % (req_comp['name'], self.name))
+        return config
 
-        # remove selection and reset to default options
-        self.clear_selections()
+    def play_config(self, config=None):
+        """ Build the :class:`PlayConfig` of the block: the selected components
+        and their options values.
 
-        # configure the block
-        # select and set options
-        for req_comp in config:
-            self.select(req_comp['name'], req_comp.get("options", {}))
+        It doesn't change the block nor the components, the result can be
+        given to :func:`play`.
 
-    def validate(self):
+        :param config: block configuration (same format than for
+            :func:`configure`), if None the current selection and options
+            values are used.
+        """
+        if isinstance(config, PlayConfig):
+            return config
+        if config is None:
+            return self._play_config([(comp_name, None) for comp_name in self.selected()])
+        config = self._check_config(config)
+        return self._play_config([(req_comp['name'], req_comp.get("options", {})) for req_comp in config])
+
+    def _play_config(self, selection):
+        """ Build the :class:`PlayConfig` from a list of `(comp_name, options)`,
+        if `options` is None the options values stored in the component are
+        used, else the options are parsed and completed with the default values.
+        """
+        if not len(selection) and self.required:
+            selection = [(comp_name, {}) for comp_name in self.defaults]
+        play_config = PlayConfig()
+        for comp_name, options in selection:
+            if comp_name not in self._components:
+                raise ValueError("'%s' has no component '%s' (components are: %s)"\
+                      % (self._name, comp_name, ", ".join(self.component_names())))
+            component = self._components[comp_name]
+            if not isinstance(component, Optionable):
+                if options:
+                    raise ValueError("the component %s is not optionable you can't provide options..." % comp_name)
+                play_config[comp_name] = {}
+                continue
+            # note: we force the hidden values only if the call is not
+            # decorated by a "check" (that already force the hidden values)
+            force_hidden = not _is_checked(component)
+            if options is None:
+                play_config[comp_name] = component.get_options_values(hidden=force_hidden)
+            else:
+                play_config[comp_name] = component.resolve_options_values(options,
+                        parse=True, strict=True, hidden=force_hidden, clear=True)
+        return play_config
+
+    def validate(self, config=None):
         """ check that the block can be run
+
+        :param config: the :class:`PlayConfig` to check (current selection if None)
         """
-        if self.required and len(self.selected()) == 0:
+        selected = self.selected() if config is None else self.play_config(config)
+        if self.required and len(selected) == 0:
             raise ReliureError("No component selected for block '%s'" % self.name)
 
     def play(self, *inputs, **named_inputs):
@@ -609,37 +776,29 @@ class Block(object):
         .. warning:: Defaut 'multiple' behavior is a **pipeline** !
 
         :param *inputs: arguments (i.e. inputs) to give to the components
+        :param config: (named argument) configuration to use for this play
+            (see :func:`play_config`), by default the block current selection
+            and components options are used.
+        :param outputs: (named argument) names of the wanted outputs, if the
+            block output is not in it nothing is run.
         """
+        config = self.play_config(named_inputs.pop("config", None))
+        outputs = named_inputs.pop("outputs", None)
         # TODO: multi mode option(False, pipeline, map)
-        self.validate() # TODO what if validate fails ?
+        self.validate(config) # TODO what if validate fails ?
         # intialise run meta data
         start = time.time()
         self.meta = PlayMeta(self.name)
-            ### manage inputs
-        if len(inputs) and len(named_inputs):
-            raise ValueError("Either `inputs` or `named_inputs` should be provided, not both !")
-        # default input name (so also the default last_output_name)
-        if len(named_inputs):
-            if self.in_name is None:
-                raise ValueError("named inputs given, but the block input's names are unknow")
-            if set(self.in_name) != set(named_inputs.keys()):
-                raise ValueError("Inputs names are not matching with block input's names")
-            inputs = [named_inputs[in_name] for in_name in self.in_name]
+        inputs = self._inputs(inputs, named_inputs)
 
         _break_on_error = True
         results = {}
+        if outputs is not None and self.out_name not in outputs:
+            return results
         # run
-        for comp_name in self.selected():
+        for comp_name, options in six.iteritems(config):
             # get the component
             comp = self._components[comp_name]
-            # get the options
-            if isinstance(comp, Optionable):
-                # note: we force the hidden values only if the call is not
-                # decorated by a "check" (that already force the hidden values)
-                force_hidden = not (hasattr(comp.__call__, '_checked') and comp.__call__._checked)
-                options = comp.get_options_values(hidden=force_hidden)
-            else:
-                options = {}
             # prepare the Play meta data
             comp_meta_res = BasicPlayMeta(comp)
             # it is register right now to be sur to have the data if there is an exception
@@ -661,7 +820,10 @@ class Block(object):
                 # actually same arg if given several times 
                 # but may be transformed during the process
                 # then finally returned
-                results[self.out_name] = comp(*inputs, **options)
+                if self.cache is not None:
+                    results[self.out_name] = self._play_cached(comp, inputs, options, comp_meta_res)
+                else:
+                    results[self.out_name] = comp(*inputs, **options)
                 #TODO: add validation on inputs name !
 
                 # TODO implements different mode for multiple 
@@ -692,6 +854,137 @@ class Block(object):
         #TODO: may return more than one value with multi=map 
         return results
 
+    def play_async(self, *inputs, **named_inputs):
+        """ Coroutine version of :func:`play` (python 3 only), coroutine
+        components are awaited and other ones are run in the event loop
+        default executor.
+
+        See :func:`reliure.aio.play_block`.
+        """
+        from reliure.aio import play_block
+        return play_block(self, *inputs, **named_inputs)
+
+    def _inputs(self, inputs, named_inputs):
+        """ Returns the list of the inputs from inputs given either by position
+        or by name
+        """
+        if len(inputs) and len(named_inputs):
+            raise ValueError("Either `inputs` or `named_inputs` should be provided, not both !")
+        # default input name (so also the default last_output_name)
+        if len(named_inputs):
+            if self.in_name is None:
+                raise ValueError("named inputs given, but the block input's names are unknow")
+            if set(self.in_name) != set(named_inputs.keys()):
+                raise ValueError("Inputs names are not matching with block input's names")
+            inputs = [named_inputs[in_name] for in_name in self.in_name]
+        return inputs
+
+    def play_batch(self, *inputs, **named_inputs):
+        """ Run the selected components of the block over a batch of inputs.
+
+        Each input is a list with one value for each element of the batch, and
+        the output is also a list.
+
+        Components that have a `batch_call` method get the whole batch at once:
+        `batch_call` is called with the inputs lists and all the options
+        values (hidden ones included) and should return the list of outputs.
+        Other components are called for each element.
+
+        >>> class Square(Composable):
+        ...     def __call__(self, value):
+        ...         return value ** 2
+        ...     def batch_call(self, values):
+        ...         return [value ** 2 for value in values] # (or vectorized version)
+        >>> block = Block("square")
+        >>> block.set(Square())
+        >>> block.play_batch([1, 2, 3])
+        {'square': [1, 4, 9]}
+
+        .. note:: the block cache (if any) is not used for batches
+
+        :param config: (named argument) see :func:`play`
+        :param outputs: (named argument) see :func:`play`
+        """
+        config = self.play_config(named_inputs.pop("config", None))
+        outputs = named_inputs.pop("outputs", None)
+        self.validate(config)
+        start = time.time()
+        self.meta = PlayMeta(self.name)
+        inputs = self._inputs(inputs, named_inputs)
+        size = len(inputs[0]) if len(inputs) else 0
+        results = {}
+        if outputs is not None and self.out_name not in outputs:
+            return results
+        for comp_name, options in six.iteritems(config):
+            comp = self._components[comp_name]
+            comp_meta_res = BasicPlayMeta(comp)
+            self.meta.append(comp_meta_res)
+            comp_meta_res.run_with(inputs, options)
+            self._logger.debug("'%s' playing a batch of %d elements with %s" % (self._name, size, comp.name))
+            try:
+                if hasattr(comp, "batch_call"):
+                    batch_options = options
+                    if isinstance(comp, Optionable):
+                        # batch_call is not checked, hidden values are needed
+                        batch_options = comp.get_options_values(hidden=True)
+                        batch_options.update(options)
+                    batch_outputs = list(comp.batch_call(*inputs, **batch_options))
+                    if len(batch_outputs) != size:
+                        raise ReliureError("'%s' returns %d outputs for a batch of %d elements"
+                                           % (comp.name, len(batch_outputs), size))
+                else:
+                    batch_outputs = [comp(*args, **options) for args in zip(*inputs)]
+                results[self.out_name] = batch_outputs
+            except Exception as err:
+                comp_meta_res.add_error(err)
+                self._logger.error("error in component '%s': %s\n%s" % (comp.name, str(err), traceback.format_exc()))
+                raise
+            finally:
+                now = time.time()
+                comp_meta_res.time = now - start
+                start = now
+        return results
+
+    def _play_cached(self, comp, inputs, options, meta):
+        """ Run a component, or get the output from the cache
+        """
+        start = time.time()
+        key = None
+        try:
+            key_options = options
+            if isinstance(comp, Optionable):
+                # effective values: (hidden values may not be in options)
+                key_options = comp.get_options_values(hidden=True)
+                key_options.update(options)
+            key = make_key(comp.name, key_options, inputs)
+            output = self.cache[key]
+            meta.cache_lookup(True, time.time() - start)
+            # a copy, so that the cached output is not modified by the next components
+            return copy.deepcopy(output)
+        except (TypeError, KeyError):
+            # not hashable or not in cache
+            meta.cache_lookup(False, time.time() - start)
+        output = comp(*inputs, **options)
+        if key is not None and not isinstance(output, collections_abc.Iterator):
+            try:
+                self.cache[key] = copy.deepcopy(output)
+            except (TypeError, copy.Error):
+                pass    # outputs that can't be copied are not cached
+        return output
+
+
+def _play_block(block, inputs, config):
+    """ Play a block and returns its outputs, its meta and the error (if any).
+
+    It is used by :func:`Engine.play` to run a block in an executor (the block
+    may then be a copy living in an other process).
+    """
+    try:
+        outputs = block.play(*inputs, config=config)
+    except Exception as error:
+        return None, block.meta, error
+    return outputs, block.meta, None
+
 
 class Engine(object):
     """ The Reliure engine.
@@ -705,11 +998,26 @@ class Engine(object):
         :param names: names of the engine blocks
         """
         self._logger = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
+        self._local = threading.local()     # per thread data (play meta)
         self._blocks = OrderedDict()
+        self._executor = None       # executor used to run blocks concurrently
+        self._own_executor = False  # whether the executor was created by the engine
         self._logger.info("\n\n\t\t\t ** ============= Init engine ============= ** \n")
         if len(names):
             self.requires(*names)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_local"]
+        # executors can't be pickled: a copy runs its blocks sequentially
+        state["_executor"] = None
+        state["_own_executor"] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
     def requires(self, *names):
         """ Declare what block will be used in this engine.
 
@@ -746,6 +1054,59 @@ class Engine(object):
         self[name].set(*components)
         self[name].setup(**parameters)
 
+    def set_executor(self, executor=None, workers=None):
+        """ Choose how :func:`play` runs the blocks.
+
+        By default (`executor` is None) the blocks are run sequentially in the
+        declaration order. Else the dependencies between blocks are computed
+        from their `in_name` and `out_name` and independent blocks are run
+        concurrently:
+
+        >>> engine = Engine("op1", "op2", "op3")
+        >>> engine.op1.setup(in_name="in", out_name="left")
+        >>> engine.op2.setup(in_name="in", out_name="right")
+        >>> engine.op3.setup(in_name=["left", "right"], out_name="out")
+        >>> engine.op1.set(lambda x: x * 2)
+        >>> engine.op2.set(lambda x: x + 2)
+        >>> engine.op3.set(lambda x, y: x - y)
+        >>> engine.set_executor("thread", workers=2)
+        >>> # op1 and op2 are run in the same time
+        >>> engine.play(10)["out"]
+        8
+
+        Results and play meta data are the same than with a sequential run.
+
+        .. note:: with a "process" executor the blocks (and so the
+            components) are pickled, they should then be defined at module level.
+
+        :param executor: None, "thread", "process" or a
+            :class:`concurrent.futures.Executor`
+        :param workers: max number of workers (only if `executor` is a str)
+        :type workers: int
+        """
+        if self._own_executor:
+            self._executor.shutdown(wait=False)
+        self._own_executor = False
+        if executor == "thread":
+            executor = ThreadPoolExecutor(max_workers=workers or len(self) or 1)
+            self._own_executor = True
+        elif executor == "process":
+            executor = ProcessPoolExecutor(max_workers=workers)
+            self._own_executor = True
+        elif executor is not None and not isinstance(executor, Executor):
+            raise ValueError("Invalid executor '%s' (should be None, 'thread', 'process' or an Executor)" % executor)
+        self._executor = executor
+
+    @property
+    def meta(self):
+        """ :class:`PlayMeta` of the last play (made in the current thread)
+        """
+        return getattr(self._local, "meta", None)
+
+    @meta.setter
+    def meta(self, meta):
+        self._local.meta = meta
+
     def __contains__(self, name):
         """ Whether a block of the given name exists
         """
@@ -816,10 +1177,25 @@ class Engine(object):
         """
         ##TODO use block configuration
         self._logger.info("\n\n\t\t\t ** ============= configure engine ============= ** \n")
+        config = self._check_config(config)
+        # clear the current selection and option
+        for block in self:
+            # remove selection and reset to default options
+            block.clear_selections()
+        # configure the blocks
+        for block_name, request_comps in config.items():
+            block = self[block_name]
+            # select and set options
+            for req_comp in request_comps:
+                block.select(req_comp['name'], req_comp.get("options", {}))
+
+    def _check_config(self, config):
+        """ Check an engine configuration (see :func:`configure`) and returns
+        it normalised (a list of components for each block)
+        """
         # normalise input format
-        for block_name in config.keys():
-            if isinstance(config[block_name], dict):
-                config[block_name] = [config[block_name]]
+        config = dict((block_name, [request_comps] if isinstance(request_comps, dict) else request_comps)
+                      for block_name, request_comps in config.items())
         # check errors
         for block_name, request_comps in config.items():
             if block_name not in self:
@@ -839,31 +1215,59 @@ class Engine(object):
                 if req_comp['name'] not in block:
                     raise ValueError("Invalid component (%s) for block '%s' "
                         % (req_comp['name'], block.name))
+        return config
 
-        # clear the current selection and option
-        for block in self:
-            # remove selection and reset to default options
-            block.clear_selections()
-        # configure the blocks
-        for block_name, request_comps in config.items():
-            block = self[block_name]
-            # select and set options
-            for req_comp in request_comps:
-                block.select(req_comp['name'], req_comp.get("options", {}))
+    def play_config(self, config=None):
+        """ Build the :class:`PlayConfig` of the engine: the selected
+        components of each block and their options values.
+
+        It doesn't change the blocks nor the components, the result can be
+        given to :func:`play` (see :class:`PlayConfig`).
 
-    def validate(self, inputs=None):
+        :param config: engine configuration (same format than for
+            :func:`configure`), if None the current blocks selection and
+            options values are used.
+        """
+        if isinstance(config, PlayConfig):
+            return config
+        play_config = PlayConfig()
+        if config is None:
+            for block in self:
+                play_config[block.name] = block.play_config()
+        else:
+            config = self._check_config(config)
+            for block in self:
+                play_config[block.name] = block._play_config([
+                    (req_comp['name'], req_comp.get("options", {}))
+                    for req_comp in config.get(block.name, [])
+                ])
+        return play_config
+
+    def _selected(self, block, config):
+        """ Names of the selected components of a block in a :class:`PlayConfig`
+        (or the current selection if `config` is None)
+        """
+        if config is None:
+            return block.selected()
+        return list(config[block.name])
+
+    def validate(self, inputs=None, config=None):
         """ Check that the blocks configuration is ok
         
         :param inputs: the names of the play inputs
         :type inputs: list of str
+        :param config: the :class:`PlayConfig` to check (current configuration
+            if None)
         """
+        if config is not None:
+            config = self.play_config(config)
         # if no blocks...
         if not len(self._blocks):
             #TODO: find better error than ReliureError ?
             raise ReliureError("There is no block in this engine")
         # it block should be ok with it-self
         for block in self:
-            block.validate()
+            block.validate(None if config is None else config[block.name])
         # check the inputs and outputs
         # note: fornow only the first block can have user given input
         available = set()       # set of available data
@@ -880,7 +1284,7 @@ class Engine(object):
             else:
                 # default input name if nothing specified
                 available.add(Engine.DEFAULT_IN_NAME)
-        needed = self.needed_inputs()
+        needed = self.needed_inputs(config)
         miss = needed.difference(available)
         if len(miss):
             raise ReliureError("The following inputs are needed and not given: %s" % (",".join("'%s'" % in_name for in_name in miss)))
@@ -889,8 +1293,9 @@ class Engine(object):
             raise ReliureError("The following inputs are given but not needed: %s" % (",".join("'%s'" % in_name for in_name in no_need)))
         return
 
-    def needed_inputs(self):
-        """ List all the needed inputs of a configured engine
+    def needed_inputs(self, config=None):
+        """ List all the needed inputs of a configured engine (or for a given
+        :class:`PlayConfig`)
 
         >>> engine = Engine("op1", "op2")
         >>> engine.op1.setup(in_name="in", out_name="middle", required=False)
@@ -925,10 +1330,12 @@ class Engine(object):
         >>> list(engine.needed_inputs())
         ['input']
         """
+        if config is not None:
+            config = self.play_config(config)
         needed = set()
         available = set()       # set of available data
         for bnum, block in enumerate(self):
-            if not block.selected():    # if the block will not be used
+            if not self._selected(block, config):    # if the block will not be used
                 continue
             if block.in_name is not None:
                 for in_name in block.in_name:
@@ -974,6 +1381,84 @@ class Engine(object):
             outputs.update(block.all_outputs())
         return outputs
 
+    def dependencies(self, config=None):
+        """ Returns the dependencies between the selected blocks of a
+        configured engine (or for a given :class:`PlayConfig`).
+
+        The result is an ordered dictionary `{block_name: (in_names, deps)}`
+        where `in_names` are the names of the block inputs and `deps` the names
+        of the blocks that have to be run before. Note that a block also
+        depends on the blocks that read a data it overwrites.
+
+        >>> engine = Engine("op1", "op2", "op3")
+        >>> engine.op1.setup(in_name="in", out_name="left")
+        >>> engine.op2.setup(in_name="in", out_name="right")
+        >>> engine.op3.setup(in_name=["left", "right"], out_name="out")
+        >>> for block in engine: block.append(lambda *args: 0)
+        >>> for name, (in_names, deps) in engine.dependencies().items():
+        ...     print(name, in_names, sorted(deps))
+        op1 ['in'] []
+        op2 ['in'] []
+        op3 ['left', 'right'] ['op1', 'op2']
+        """
+        if config is not None:
+            config = self.play_config(config)
+        graph = OrderedDict()
+        producer = {}   # data name -> name of the last block that produce it
+        readers = {}    # data name -> names of the blocks that read it
+        last_output_name = Engine.DEFAULT_IN_NAME
+        for block in self:
+            if not self._selected(block, config):
+                continue
+            in_names = block.in_name or [last_output_name]
+            deps = set(producer[in_name] for in_name in in_names if in_name in producer)
+            # a data can't be overwriten before it is produced and read
+            if block.out_name in producer:
+                deps.add(producer[block.out_name])
+            deps.update(readers.get(block.out_name, ()))
+            deps.discard(block.name)
+            for in_name in in_names:
+                readers.setdefault(in_name, set()).add(block.name)
+            producer[block.out_name] = block.name
+            readers[block.out_name] = set()
+            graph[block.name] = (in_names, deps)
+            last_output_name = block.out_name
+        return graph
+
+    def needed_blocks(self, outputs, config=None):
+        """ Returns the names of the selected blocks that have to be run to
+        compute the given outputs.
+
+        >>> engine = Engine("op1", "op2", "op3")
+        >>> engine.op1.setup(in_name="in", out_name="middle")
+        >>> engine.op2.setup(in_name="middle", out_name="out")
+        >>> engine.op3.setup(in_name="in", out_name="other")
+        >>> for block in engine: block.append(lambda x: x)
+        >>> engine.needed_blocks(["middle"])
+        ['op1']
+        >>> engine.needed_blocks(["out", "other"])
+        ['op1', 'op2', 'op3']
+
+        :param outputs: names of the wanted data (see :func:`all_outputs`)
+        :param config: the :class:`PlayConfig` to consider (current
+            configuration if None)
+        """
+        all_outputs = self.all_outputs()
+        for out_name in outputs:
+            if out_name not in all_outputs:
+                raise ValueError("'%s' is not generated by the engine %s" % (out_name, all_outputs))
+        graph = self.dependencies(config)
+        needed = set()
+        needed_data = set(outputs)
+        # walk backward, the last block producing a needed data is needed
+        for name in reversed(list(graph)):
+            out_name = self[name].out_name
+            if out_name in needed_data:
+                needed.add(name)
+                needed_data.discard(out_name)
+                needed_data.update(graph[name][0])
+        return [name for name in graph if name in needed]
+
     def play(self, *inputs, **named_inputs):
         """ Run the engine (that should have been configured first)
         
@@ -986,13 +1471,58 @@ class Engine(object):
         :param inputs: the data to give as input to the first block
         :param named_inputs: named input data should match with
             :func:`needed_inputs` result.
+        :param config: (named argument) configuration to use for this play
+            (see :func:`play_config`), by default the current blocks
+            configuration is used. Note that as it does not modify the blocks
+            nor the components, an engine may be played concurrently with
+            different configurations.
+        :param outputs: (named argument) names of the wanted outputs, only the
+            blocks needed to compute them are run (see :func:`needed_blocks`).
+            By default all the selected blocks are run.
         """
         self._logger.info("\n\n\t\t\t ** ============= play engine ============= ** \n")
+        config = self.play_config(named_inputs.pop("config", None))
+        outputs = named_inputs.pop("outputs", None)
         #
         # create data structure for results and metaresults
-        results = OrderedDict()
         self.meta = PlayMeta("engine")
-        ### manage inputs
+        results = self._play_inputs(inputs, named_inputs)
+        #
+        ## validate
+        self.validate(results.keys(), config)
+        #
+        needed_blocks = None
+        if outputs is not None:
+            needed_blocks = set(self.needed_blocks(outputs, config))
+        if self._executor is not None:
+            return self._play_concurrent(results, config, needed_blocks)
+        ### run the blocks
+        last_output_name = Engine.DEFAULT_IN_NAME
+        for block in self:
+            # continue if block is not selected (note: if require the validate should have faild before)
+            if not len(config[block.name]):
+                continue
+            # prepare block ipouts
+            in_names = block.in_name or [last_output_name]
+            # ^ note: if the block has no named input then the last block output is used
+            last_output_name = block.out_name
+            # continue if the block output is not needed
+            if needed_blocks is not None and block.name not in needed_blocks:
+                continue
+            inputs = [results[name] for name in in_names]
+            # run the block
+            try:
+                results.update(block.play(*inputs, config=config[block.name]))
+                # ^ note: le validate par rapport au type est fait dans le run du block
+            finally:
+                # store metadata
+                self.meta.append(block.meta)
+        return results
+
+    def _play_inputs(self, inputs, named_inputs):
+        """ Returns the results dict initialised with the inputs of a play
+        """
+        results = OrderedDict()
         if len(inputs) and len(named_inputs):
             raise ValueError("Either `inputs` or `named_inputs` should be provided, not both !")
         # default input name (so also the default last_output_name)
@@ -1006,30 +1536,149 @@ class Engine(object):
                 results[in_name] = inputs[input_num]
         else:
             results.update(named_inputs)
-        #
+        return results
+
+    def play_async(self, *inputs, **named_inputs):
+        """ Coroutine version of :func:`play` (python 3 only): coroutine
+        components are awaited, other ones are run in the event loop default
+        executor, and independent blocks are run concurrently.
+
+        See :func:`reliure.aio.play_engine`.
+        """
+        from reliure.aio import play_engine
+        return play_engine(self, *inputs, **named_inputs)
+
+    def play_batch(self, inputs_list, **kwargs):
+        """ Run the engine over a batch of inputs.
+
+        The configuration and the validation are made only once, and each
+        block is played over the whole batch (see :func:`Block.play_batch`):
+        components that have a `batch_call` method are called only once.
+
+        >>> engine = Engine("op1", "op2")
+        >>> engine.op1.setup(in_name="in", out_name="middle")
+        >>> engine.op2.setup(in_name=["middle", "in"], out_name="out")
+        >>> engine.op1.set(lambda x: x * 2)
+        >>> engine.op2.set(lambda x, y: x + y)
+        >>> [res["out"] for res in engine.play_batch([1, 2, 3])]
+        [3, 6, 9]
+        >>> [res["out"] for res in engine.play_batch([{"in": 4}, {"in": 5}])]
+        [12, 15]
+
+        The play meta data (:attr:`meta`) are aggregated for the whole batch.
+
+        :param inputs_list: list of inputs, each one is either a dict of named
+            inputs or the input(s) of the first block (a list or a tuple if the
+            first block has more than one input).
+        :param config: (named argument) see :func:`play`
+        :param outputs: (named argument) see :func:`play`
+        :returns: a list with the results of each element of the batch
+        """
+        config = self.play_config(kwargs.pop("config", None))
+        outputs = kwargs.pop("outputs", None)
+        if len(kwargs):
+            raise ValueError("Unexpected arguments: %s" % ", ".join(kwargs))
+        self.meta = PlayMeta("engine")
+        ### manage inputs (stored as columns)
+        first_in_names = self.in_name or [Engine.DEFAULT_IN_NAME]
+        columns = None
+        size = 0
+        for inputs in inputs_list:
+            if not isinstance(inputs, dict):
+                if len(first_in_names) == 1:
+                    inputs = [inputs]
+                elif len(inputs) != len(first_in_names):
+                    raise ValueError("%d inputs are needed for first block, but %d given" % (len(first_in_names), len(inputs)))
+                inputs = dict(zip(first_in_names, inputs))
+            if columns is None:
+                columns = OrderedDict((in_name, []) for in_name in inputs)
+            elif set(inputs.keys()) != set(columns.keys()):
+                raise ValueError("All the elements of a batch should have the same inputs")
+            for in_name, value in six.iteritems(inputs):
+                columns[in_name].append(value)
+            size += 1
+        if columns is None:
+            return []
         ## validate
-        self.validate(results.keys())
-        #
+        self.validate(columns.keys(), config)
+        needed_blocks = None
+        if outputs is not None:
+            needed_blocks = set(self.needed_blocks(outputs, config))
         ### run the blocks
         last_output_name = Engine.DEFAULT_IN_NAME
         for block in self:
-            # continue if block is not selected (note: if require the validate should have faild before)
-            if not len(block.selected()):
+            if not len(config[block.name]):
                 continue
-            # prepare block ipouts
             in_names = block.in_name or [last_output_name]
-            # ^ note: if the block has no named input then the last block output is used
-            inputs = [results[name] for name in in_names]
-            # run the block
+            last_output_name = block.out_name
+            if needed_blocks is not None and block.name not in needed_blocks:
+                continue
             try:
-                results.update(block.play(*inputs))
-                # ^ note: le validate par rapport au type est fait dans le run du block
+                columns.update(block.play_batch(*[columns[name] for name in in_names],
+                                                config=config[block.name]))
             finally:
-                # store metadata
                 self.meta.append(block.meta)
-            last_output_name = block.out_name
+        return [OrderedDict((name, column[num]) for name, column in six.iteritems(columns))
+                for num in range(size)]
+
+    def _play_concurrent(self, results, config, needed_blocks=None):
+        """ Run the blocks in the engine executor according to their
+        dependencies, see :func:`set_executor`.
+        """
+        graph = self._play_graph(config, needed_blocks)
+        pending = OrderedDict(graph)
+        data = dict(results)    # available data
+        outputs = {}            # block name -> block outputs
+        metas = {}              # block name -> block meta
+        errors = {}             # block name -> error
+        running = {}            # future -> block name
+        while pending or running:
+            # submit the blocks that are ready
+            if not errors:
+                for name, (in_names, deps) in list(pending.items()):
+                    if deps.issubset(outputs):
+                        del pending[name]
+                        block_inputs = [data[in_name] for in_name in in_names]
+                        running[self._executor.submit(_play_block, self[name], block_inputs, config[name])] = name
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                block = self[name]
+                try:
+                    block_outputs, block.meta, error = future.result()
+                    metas[name] = block.meta
+                except Exception as error_:
+                    # the block may not have been run (pickling error for ex.)
+                    block_outputs, error = None, error_
+                if error is not None:
+                    errors[name] = error
+                else:
+                    outputs[name] = block_outputs
+                    data.update(block_outputs)
+        # store results and metadata in the blocks order
+        for name in graph:
+            if name in outputs:
+                results.update(outputs[name])
+            if name in metas:
+                self.meta.append(metas[name])
+        for name in graph:
+            if name in errors:
+                raise errors[name]
         return results
 
+    def _play_graph(self, config, needed_blocks=None):
+        """ Returns the dependencies of the blocks to run (see
+        :func:`dependencies`)
+        """
+        graph = self.dependencies(config)
+        if needed_blocks is not None:
+            graph = OrderedDict((name, (in_names, deps & needed_blocks))
+                                for name, (in_names, deps) in six.iteritems(graph)
+                                if name in needed_blocks)
+        return graph
+
     def as_dict(self):
         """ dict repr of the components """
         drepr = {
@@ -0,0 +1,138 @@
+#-*- coding:utf-8 -*-
+""" :mod:`reliure.manifest`
+=========================
+
+Progress manifests of offline runs (see :func:`.offline.run_parallel`): the
+keys of the processed inputs are recorded, so that a run that is started
+again skips them (to resume a run that died, or to process only the new or
+modified inputs).
+
+>>> import os, tempfile
+>>> path = os.path.join(tempfile.mkdtemp(), "progress.txt")
+>>> manifest = FileManifest(path)
+>>> manifest.add(["doc1", "doc2"])
+>>> manifest.close()
+>>> manifest = FileManifest(path)
+>>> "doc1" in manifest, "doc3" in manifest
+(True, False)
+>>> len(manifest)
+2
+"""
+import io
+import json
+import sqlite3
+import hashlib
+import threading
+
+import six
+
+
+def content_key(item):
+    """ Key of an input computed from its content (a hash of its JSON
+    serialisation): a modified input has a new key, so it is processed again.
+
+    >>> content_key({"id": 1, "text": "hello"})
+    '1fea16bc17ca509097d2213df3cb81a0ad945610'
+    """
+    data = json.dumps(item, sort_keys=True, default=repr)
+    return hashlib.sha1(data.encode("utf8")).hexdigest()
+
+
+class Manifest(object):
+    """ Base class of the manifests: a (persistent) set of keys
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __contains__(self, key):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def add(self, keys):
+        """ Record some keys
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class FileManifest(Manifest):
+    """ Manifest stored in an append-only text file, one key by line (keys
+    are converted to strings, they should not contain line breaks). All the
+    keys are loaded in memory.
+    """
+    def __init__(self, path):
+        """
+        :param path: path of the file (created if it does not exist)
+        """
+        self.path = path
+        self._keys = set()
+        try:
+            with io.open(path, "r", encoding="utf8") as mfile:
+                for line in mfile:
+                    # note: an unfinished last line (if writing was interrupted) is ignored
+                    if line.endswith(u"\n"):
+                        self._keys.add(line[:-1])
+        except IOError:
+            pass    # new manifest
+        self._file = io.open(path, "a", encoding="utf8")
+
+    def __contains__(self, key):
+        return six.text_type(key) in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, keys):
+        keys = [six.text_type(key) for key in keys]
+        if not keys:
+            return
+        self._file.write(u"".join(u"%s\n" % key for key in keys))
+        self._file.flush()
+        self._keys.update(keys)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class SqliteManifest(Manifest):
+    """ Manifest stored in a sqlite database (the keys are not loaded in
+    memory), it may be used from many threads.
+    """
+    def __init__(self, path, table="manifest"):
+        """
+        :param path: path of the database (created if it does not exist)
+        :param table: name of the table of the keys
+        """
+        self.path = path
+        self.table = table
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS %s (key TEXT PRIMARY KEY)" % table)
+        self._db.commit()
+
+    def __contains__(self, key):
+        with self._lock:
+            cursor = self._db.execute("SELECT 1 FROM %s WHERE key = ?" % self.table, (six.text_type(key),))
+            return cursor.fetchone() is not None
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM %s" % self.table).fetchone()[0]
+
+    def add(self, keys):
+        with self._lock:
+            self._db.executemany("INSERT OR IGNORE INTO %s (key) VALUES (?)" % self.table,
+                                 [(six.text_type(key),) for key in keys])
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -3,12 +3,36 @@
 ======================
 """
 
+import io
+import os
+import sys
+import copy
+import json
+import pickle
+import random
 import logging
+import itertools
+import threading
+import traceback
 import multiprocessing as mp
 from time import time
 from itertools import islice
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-def run(pipeline, input_gen, options={}):
+import six
+from six.moves import queue
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:     # python < 3.8
+    shared_memory = None
+
+from reliure.exceptions import ReliureError
+from reliure.sources import FileSource, FileSplit
+from reliure.manifest import content_key
+
+def run(pipeline, input_gen, options={}, sink=None):
     """ Run a pipeline over a input generator
 
     >>> # if we have a simple component
@@ -37,32 +61,777 @@ def run(pipeline, input_gen, options={}):
     C
     D
     E
+
+    With a `sink` (see :mod:`reliure.sinks`) the outputs are written as they
+    are produced (not kept in memory), and only the number of outputs and
+    the run time are returned:
+
+    >>> import os, tempfile
+    >>> from reliure.sinks import JsonLinesSink
+    >>> sink = JsonLinesSink(os.path.join(tempfile.mkdtemp(), "out.jsonl"))
+    >>> stats = run(pipeline, input, sink=sink)
+    A
+    B
+    C
+    D
+    E
+    >>> stats["outputs"]
+    5
     """
     logger = logging.getLogger("reliure.run")
     t0 = time()
-    res = [output for output in pipeline(input_gen, **options)]
+    if sink is None:
+        res = [output for output in pipeline(input_gen, **options)]
+        logger.info("Pipeline executed in %1.3f sec" % (time() - t0))
+        return res
+    sink.open()
+    try:
+        count = sink.write(pipeline(input_gen, **options))
+    finally:
+        sink.close()
     logger.info("Pipeline executed in %1.3f sec" % (time() - t0))
-    return res
+    return {"outputs": count, "time": time() - t0}
+
+#: minimal size (in bytes) of a bytes like result to be send in shared memory
+SHARED_MIN_SIZE = 2**16
+
+def _out_of_band(obj):
+    """ Wraps the big bytes like objects (in lists, tuples and dicts) in
+    :class:`pickle.PickleBuffer` so they are pickled out-of-band (the pickler
+    can't be overriden for bytes)
+    """
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return pickle.PickleBuffer(obj) if _nbytes(obj) >= SHARED_MIN_SIZE else obj
+    elif type(obj) is list:
+        return [_out_of_band(val) for val in obj]
+    elif type(obj) is tuple:
+        return tuple(_out_of_band(val) for val in obj)
+    elif type(obj) is dict:
+        return dict((key, _out_of_band(val)) for key, val in obj.items())
+    return obj
+
+def _nbytes(obj):
+    return obj.nbytes if isinstance(obj, memoryview) else len(obj)
+
+
+class _SharedResult(object):
+    """ Results of a chunk whose buffers are in a shared memory block (see
+    `transport` argument of :func:`run_parallel`)
+    """
+    def __init__(self, results):
+        """ Pickle the results, the out-of-band buffers (bytes like objects,
+        numpy arrays...) are copied in a new shared memory block
+        """
+        buffers = []
+        stream = io.BytesIO()
+        pickle.Pickler(stream, protocol=5, buffer_callback=buffers.append).dump(_out_of_band(results))
+        self.data = stream.getvalue()
+        self.name = None
+        self.sizes = []
+        if not buffers:
+            return
+        raws = [buf.raw() for buf in buffers]
+        self.sizes = [raw.nbytes for raw in raws]
+        shm = shared_memory.SharedMemory(create=True, size=max(sum(self.sizes), 1))
+        offset = 0
+        for raw in raws:
+            shm.buf[offset:offset + raw.nbytes] = raw
+            offset += raw.nbytes
+        self.name = shm.name
+        shm.close()
+
+    def load(self):
+        """ Returns the results, and frees the shared memory block
+        """
+        if self.name is None:
+            return pickle.loads(self.data)
+        shm = shared_memory.SharedMemory(name=self.name)
+        shm.unlink()
+        try:
+            # the buffers are copied: the block can't be closed while views
+            # on it are alive
+            buffers = []
+            offset = 0
+            for size in self.sizes:
+                buffers.append(bytearray(shm.buf[offset:offset + size]))
+                offset += size
+        finally:
+            shm.close()
+        return pickle.loads(self.data, buffers=buffers)
+
+    def discard(self):
+        """ Frees the shared memory without loading the results
+        """
+        if self.name is not None:
+            shm = shared_memory.SharedMemory(name=self.name)
+            shm.unlink()
+            shm.close()
 
-def _reliure_worker(wnum, Qin, Qout, pipeline, options={}):
-    """ a worker used by :func:`run_parallel`
+
+class _ResultQueue(object):
+    """ Queue of the messages of the :class:`ReliurePool` workers (a pipe
+    shared by the workers): `put` is synchronous, so that a message is not
+    lost if its worker crashes just after, and the reader can wait for a
+    message with a timeout.
+    """
+    def __init__(self):
+        self._reader, self._writer = mp.Pipe(duplex=False)
+        self._wlock = mp.Lock()
+
+    def put(self, message):
+        with self._wlock:
+            self._writer.send(message)
+
+    def poll(self, timeout):
+        """ Whether a message is available (waits at most `timeout` seconds)
+        """
+        return self._reader.poll(timeout)
+
+    def get(self):
+        return self._reader.recv()
+
+
+def _reliure_worker(wnum, Qin, Qout, pipeline, pipeline_factory=None, factory_args=(),
+                    transport="queue", maxtasks=None, current_run=None, current_tasks=None):
+    """ a worker used by :class:`ReliurePool`
+
+    It first builds its pipeline (if a `pipeline_factory` is given) and puts
+    `("started", wnum, error, startup_time)` in `Qout`. Then it gets
+    `(run_id, task_id, chunk, options, sink)` tasks from `Qin` (until a `None`
+    sentinel) and puts `("chunk", run_id, task_id, results, error,
+    (chunk_size, processing_time, nb_outputs))` in `Qout`. If the task has a
+    (sharded) sink, the results are written in the worker shard and not sent.
+
+    The tasks of an other run than `current_run` are skipped, and the worker
+    stops after `maxtasks` tasks. The id of the last task taken is stored in
+    `current_tasks[wnum]` (so the parent knows it if the worker crashes).
     """
-    #pipeline = get_pipeline()
-    logger = logging.getLogger("reliure.run_parallel.worker#%s" % wnum)
+    logger = logging.getLogger("reliure.ReliurePool.worker#%s" % wnum)
     logger.debug("worker created")
-    if options is None:
-        options = {}
+    t0 = time()
+    if pipeline_factory is not None:
+        try:
+            pipeline = pipeline_factory(*factory_args)
+        except Exception as err:
+            logger.error("error while building the pipeline: %s" % err)
+            Qout.put(("started", wnum, ReliureError("error in worker #%s pipeline factory: %r\n%s" % (wnum, err, traceback.format_exc())), time() - t0))
+            sys.exit(1)
+    Qout.put(("started", wnum, None, time() - t0))
+    ntasks = 0
+    while maxtasks is None or ntasks < maxtasks:
+        task = Qin.get() # get an element (and wait for it if needed)
+        if task is None:
+            logger.debug("stop worker")
+            break
+        run_id, task_id, chunk, options, sink = task
+        if current_run is not None and run_id != current_run.value:
+            continue    # the run has been stopped
+        if current_tasks is not None:
+            current_tasks[wnum] = task_id
+        ntasks += 1
+        t0 = time()
+        try:
+            if isinstance(chunk, FileSplit):
+                chunk = chunk.read()
+            logger.debug("Get %s elements to process" % len(chunk))
+            res = [output for output in pipeline(chunk, **options)]
+            noutputs = len(res)
+            logger.debug("processing done, results len = %s" % noutputs)
+            if sink is not None:
+                sink.write_shard(wnum, res)
+                res = []
+            elif transport == "shm":
+                res = _SharedResult(res)
+        except Exception as err:
+            logger.error("error while processing task %s: %s" % (task_id, err))
+            Qout.put(("chunk", run_id, task_id, None, ReliureError("error in worker #%s: %r\n%s" % (wnum, err, traceback.format_exc())), (0, time() - t0, 0)))
+            continue
+        Qout.put(("chunk", run_id, task_id, res, None, (len(chunk), time() - t0, noutputs)))
+
+
+_POLL_TIME = 0.1
+
+def _put(Q, item, stop):
+    """ Put an item in a bounded queue, unless `stop` is set before there is
+    a free slot. Returns whether the item has been put.
+    """
+    while not stop.is_set():
+        try:
+            Q.put(item, timeout=_POLL_TIME)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+class _ChunkSizer(object):
+    """ Size of the chunks of :func:`ReliurePool.run`.
+
+    If adaptive, the size is adapted for the processing of a chunk to take
+    about `target_time` seconds (from the mean processing time of an input),
+    and at the end of the inputs the chunks are smaller so that the workers
+    finish together.
+
+    >>> sizer = _ChunkSizer(10, adaptive=True, target_time=1.)
+    >>> sizer.update(10, 0.2)   # 20ms per input, it may be doubled at most
+    >>> sizer.size
+    20
+    >>> sizer.update(20, 0.4)
+    >>> sizer.size
+    40
+    >>> sizer.update(40, 8.)    # some inputs are heavier
+    >>> sizer.size
+    13
+    """
+    def __init__(self, chunksize, adaptive=False, target_time=1.):
+        self.size = chunksize
+        self.adaptive = adaptive
+        self.target_time = target_time
+        self.item_time = None   # (moving) mean processing time of an input
+
+    def update(self, nitems, duration):
+        """ Update the size from the processing time of a chunk
+        """
+        if not self.adaptive or not nitems:
+            return
+        item_time = duration / nitems
+        if self.item_time is None:
+            self.item_time = item_time
+        else:
+            self.item_time = 0.7 * self.item_time + 0.3 * item_time
+        size = int(self.target_time / max(self.item_time, 1e-9))
+        # the size may decrease quickly, but increase slowly
+        self.size = max(1, min(size, 2 * self.size))
+
+    def tail_size(self, remaining, ncpu):
+        """ Size of a chunk when only `remaining` inputs are left
+        """
+        return max(1, min(self.size, -(-remaining // (2 * ncpu))))
+
+
+def _chunks(input_gen, sizer, ncpu):
+    """ Cut the inputs in chunks
+    """
+    lookahead = deque()
+    exhausted = False
     while True:
-        chunk = Qin.get() # get an element (and wait for it if needed)
-        logger.debug("Get %s elements to process" % len(chunk))
-        res = [output for output in pipeline(chunk, **options)]
-        logger.debug("processing done, results len = %s" % len(res))
-        Qout.put(res)
-        Qin.task_done()
-
-def run_parallel(pipeline, input_gen, options={}, ncpu=4, chunksize=200):
+        if sizer.adaptive:
+            # read some inputs ahead to detect the end of the inputs
+            if not exhausted:
+                wanted = sizer.size * ncpu
+                lookahead.extend(islice(input_gen, max(wanted - len(lookahead), 0)))
+                exhausted = len(lookahead) < wanted
+            size = sizer.tail_size(len(lookahead), ncpu) if exhausted else sizer.size
+            chunk = tuple(lookahead.popleft() for _ in range(min(size, len(lookahead))))
+        else:
+            # consume chunksize elements from input_gen
+            chunk = tuple(islice(input_gen, sizer.size))
+        if not len(chunk):
+            return
+        yield chunk
+
+def _keyed_chunks(input_gen, run, ncpu):
+    """ Yields the chunks of inputs with the keys of their inputs (None if
+    the run has no manifest), the inputs in the manifest are skipped. The
+    chunks of a :class:`.FileSource` are its byte ranges (read by the
+    workers), their keys are the ranges keys.
+    """
+    manifest = run.manifest
+    if isinstance(input_gen, FileSource):
+        for split in input_gen.splits():
+            if manifest is None:
+                yield split, None
+            elif split.key in manifest:
+                run.skipped += 1
+            else:
+                yield split, [split.key]
+    elif manifest is None:
+        # ensure input_gen is realy an itertor not a list
+        for chunk in _chunks(iter(input_gen), run.sizer, ncpu):
+            yield chunk, None
+    else:
+        def unprocessed():
+            for item in input_gen:
+                key = run.key(item)
+                if key in manifest:
+                    run.skipped += 1
+                else:
+                    yield key, item
+        for pairs in _chunks(unprocessed(), run.sizer, ncpu):
+            keys, chunk = zip(*pairs)
+            yield chunk, keys
+
+def _feed(input_gen, run, task_ids, ncpu, Qdata, inflight, stop):
+    """ Send the chunks of inputs to the workers (run in a thread by
+    :func:`ReliurePool.run`)
+    """
+    try:
+        for seq, (chunk, keys) in enumerate(_keyed_chunks(input_gen, run, ncpu)):
+            # wait for a free slot (bounds the memory used by the run)
+            if not _put(inflight, seq, stop):
+                return
+            if keys is not None:
+                run.keys[seq] = keys
+            task_id = next(task_ids)
+            run.add_task(task_id, seq, (), chunk, 0)
+            if not _put(Qdata, (run.id, task_id, chunk, run.options, run.sink), stop):
+                return
+            run.sent = seq + 1
+    except Exception as err:
+        run.error = err
+    finally:
+        run.done = True
+
+
+def _start_resource_tracker():
+    """ Start the resource tracker before the workers, so they share it with
+    the parent (shared memory blocks are then correctly tracked, and freed
+    even if the parent does not get them)
+    """
+    try:
+        from multiprocessing import resource_tracker
+    except ImportError:     # not on windows
+        return
+    resource_tracker.ensure_running()
+
+
+class _QuarantineFile(object):
+    """ Quarantine that appends the items (with the error) in a JSON lines
+    file (see :func:`ReliurePool.run`)
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, item, error):
+        with io.open(self.path, "a", encoding="utf8") as qfile:
+            qfile.write(u"%s\n" % json.dumps({"item": item, "error": error}, default=repr))
+
+
+class _Run(object):
+    """ State of a :func:`ReliurePool.run`
+
+    The chunks (numbered by `seq`) are processed by tasks, a chunk may be
+    split (bisected) in many tasks if it fails, each part of the chunk is
+    identified by a `path` (tuple of 0 and 1).
+    """
+    def __init__(self, run_id, options, sizer, retries, quarantine, manifest=None, key=None):
+        self.id = run_id
+        self.options = options
+        self.sizer = sizer
+        self.retries = retries
+        self.quarantine = quarantine
+        self.sink = None    # sink written by the workers
+        self.manifest = manifest
+        self.key = key or content_key
+        self.keys = {}      # seq -> keys of the inputs of the chunk (if manifest)
+        self.tasks = {}     # task_id -> (seq, path, items, attempts)
+        self.parts = {}     # seq -> {path: results, or None if not yet processed}
+        self.resubmit = deque()     # tasks to send again
+        self.sent = 0       # number of chunks sent
+        self.done = False   # whether all the chunks are sent
+        self.error = None   # error while reading the inputs
+        self.inputs = 0     # number of inputs processed
+        self.outputs = 0    # number of outputs
+        self.quarantined = 0    # number of inputs put in quarantine
+        self.skipped = 0    # number of inputs skipped (in the manifest)
+
+    def add_task(self, task_id, seq, path, items, attempts):
+        self.tasks[task_id] = (seq, path, items, attempts)
+        self.parts.setdefault(seq, {})[path] = None
+
+    def completed(self, seq):
+        """ Returns the results of a chunk if all its parts are processed
+        (else None)
+        """
+        parts = self.parts[seq]
+        if any(res is None for res in parts.values()):
+            return None
+        del self.parts[seq]
+        results = []
+        for path in sorted(parts):
+            results.extend(parts[path])
+        return results
+
+
+class ReliurePool(object):
+    """ Pool of worker processes running a pipeline, that can be used for
+    many runs: the workers (and so their pipeline) are created only once.
+
+    >>> from reliure.pipeline import Composable
+    >>> pipeline = Composable(lambda letters: (l.upper() for l in letters))
+    >>> with ReliurePool(pipeline, ncpu=2) as pool:
+    ...     print(pool.map("abc", chunksize=2))
+    ...     print(pool.map("def", chunksize=2))
+    ['A', 'B', 'C']
+    ['D', 'E', 'F']
+
+    With `maxtasksperchild` the workers are replaced by new ones after they
+    have processed that many chunks (to free the memory of leaky
+    components for ex.). The workers that crash (segfault, killed...) are
+    also replaced.
+
+    .. note:: runs of a pool are made one after the other, not concurrently.
+    """
+    def __init__(self, pipeline=None, ncpu=4, pipeline_factory=None, factory_args=(),
+                 transport="queue", maxtasksperchild=None):
+        """
+        :param pipeline: the component to run on each chunk of inputs
+        :param ncpu: number of worker processes
+        :param pipeline_factory: function that builds the pipeline in each
+            worker (`pipeline` should then be None)
+        :param factory_args: arguments given to `pipeline_factory`
+        :param transport: "queue" or "shm" (see :func:`run_parallel`)
+        :param maxtasksperchild: number of chunks processed by a worker before
+            it is replaced (no limit if None)
+        """
+        if (pipeline is None) == (pipeline_factory is None):
+            raise ValueError("Either `pipeline` or `pipeline_factory` should be provided")
+        if transport not in ("queue", "shm"):
+            raise ValueError("Invalid transport '%s' (should be 'queue' or 'shm')" % transport)
+        if transport == "shm":
+            if shared_memory is None:
+                raise ValueError("'shm' transport needs python >= 3.8")
+            _start_resource_tracker()
+        if maxtasksperchild is not None and maxtasksperchild < 1:
+            raise ValueError("maxtasksperchild should be a positive integer")
+        self._logger = logging.getLogger("reliure.ReliurePool")
+        self.ncpu = ncpu
+        self.maxtasksperchild = maxtasksperchild
+        self._worker_args = (pipeline, pipeline_factory, factory_args, transport, maxtasksperchild)
+        #: startup time of the workers (by worker number)
+        self.startup_times = {}
+        self._Qdata = mp.Queue(ncpu * 2)    # input queue
+        # result queue (bounded by `inflight` of a run)
+        self._Qresult = _ResultQueue()
+        self._current_run = mp.Value("i", 0, lock=False)
+        self._current_tasks = mp.Array("q", ncpu, lock=False)  # last task taken by each worker
+        self._run_id = 0
+        self._task_ids = itertools.count(1)
+        self._last_check = time()
+        self._running = threading.Lock()
+        self._closed = False
+        self._workers = []
+        try:
+            for wnum in range(ncpu):
+                self._workers.append(self._start_worker(wnum))
+            # wait for the workers to be ready
+            while len(self.startup_times) < ncpu:
+                self._poll(None)
+        except:
+            self.terminate()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
+
+    def _start_worker(self, wnum):
+        self._logger.debug("create worker #%s" % wnum)
+        worker = mp.Process(target=_reliure_worker, args=(wnum, self._Qdata, self._Qresult) + self._worker_args
+                                                         + (self._current_run, self._current_tasks))
+        worker.daemon = True
+        worker.start()
+        return worker
+
+    def _check_workers(self):
+        """ Replace the workers that are stopped, returns the tasks (id and
+        error) that were processed by the workers that crashed.
+        """
+        crashed = []
+        for wnum, worker in enumerate(self._workers):
+            if worker.is_alive():
+                continue
+            worker.join()
+            task_id = self._current_tasks[wnum]
+            self._current_tasks[wnum] = 0
+            self.startup_times.pop(wnum, None)
+            self._workers[wnum] = self._start_worker(wnum)
+            if worker.exitcode != 0:
+                self._logger.error("worker #%s died unexpectedly (exit code %s)" % (wnum, worker.exitcode))
+                crashed.append((task_id, ReliureError("worker #%s died unexpectedly (exit code %s)"
+                                                      % (wnum, worker.exitcode))))
+            else:
+                self._logger.debug("worker #%s replaced" % wnum)
+        return crashed
+
+    def _poll(self, run):
+        """ Process the next message of the workers (or wait `_POLL_TIME`)
+        and check the workers. Returns the seq of the chunks that may be
+        completed.
+        """
+        touched = []
+        if time() - self._last_check > _POLL_TIME:
+            self._last_check = time()
+            for task_id, error in self._check_workers():
+                if run is None:
+                    raise error
+                touched.append(self._task_failed(run, task_id, error))
+        if run is not None:
+            # send again the failed tasks (without blocking)
+            while run.resubmit:
+                try:
+                    self._Qdata.put_nowait(run.resubmit[0])
+                except queue.Full:
+                    break
+                run.resubmit.popleft()
+        if not self._Qresult.poll(_POLL_TIME):
+            self._last_check = 0
+            return touched
+        message = self._Qresult.get()
+        if message[0] == "started":
+            _, wnum, error, startup = message
+            if error is not None:
+                raise error
+            self._logger.info("worker #%s started in %1.3f sec" % (wnum, startup))
+            self.startup_times[wnum] = startup
+            return touched
+        _, run_id, task_id, res, error, stats = message
+        if run is None or run_id != run.id or task_id not in run.tasks:
+            # a result of a previous (stopped) run, or of a retried task
+            if isinstance(res, _SharedResult):
+                res.discard()
+            return touched
+        if error is not None:
+            touched.append(self._task_failed(run, task_id, error))
+            return touched
+        seq, path, _, _ = run.tasks.pop(task_id)
+        nitems, duration, noutputs = stats
+        run.sizer.update(nitems, duration)
+        run.inputs += nitems
+        run.outputs += noutputs
+        if isinstance(res, _SharedResult):
+            res = res.load()
+        run.parts[seq][path] = res
+        touched.append(seq)
+        return touched
+
+    def _submit(self, run, seq, path, items, attempts):
+        """ Send again (a part of) a chunk
+        """
+        task_id = next(self._task_ids)
+        run.add_task(task_id, seq, path, items, attempts)
+        run.resubmit.append((run.id, task_id, items, run.options, run.sink))
+
+    def _task_failed(self, run, task_id, error):
+        """ Retry a failed task, or bisect it, or put its item in
+        quarantine. Returns the seq of its chunk.
+        """
+        if task_id not in run.tasks:
+            return None
+        seq, path, items, attempts = run.tasks.pop(task_id)
+        if attempts < run.retries:
+            self._logger.warning("retry a chunk (attempt %d)" % (attempts + 1))
+            self._submit(run, seq, path, items, attempts + 1)
+            return seq
+        elif run.quarantine is None:
+            raise error
+        if isinstance(items, FileSplit):
+            items = items.read()
+        if len(items) > 1:
+            # bisect the chunk to isolate the bad item(s)
+            self._logger.warning("bisect a failing chunk of %d items" % len(items))
+            del run.parts[seq][path]
+            half = len(items) // 2
+            self._submit(run, seq, path + (0,), items[:half], run.retries)
+            self._submit(run, seq, path + (1,), items[half:], run.retries)
+        else:
+            self._logger.error("put an item in quarantine: %s" % error)
+            run.quarantine(items[0], str(error))
+            run.quarantined += 1
+            run.parts[seq][path] = []
+        return seq
+
+    def run(self, input_gen, options=None, chunksize=200, ordered=True, inflight=None,
+            adaptive=False, target_time=1., retries=0, quarantine=None, manifest=None, key=None):
+        """ Run the pipeline over an input generator, see :func:`run_parallel`
+        for the arguments. The results are yielded as soon as they are
+        available.
+        """
+        run = self._new_run(options, chunksize, adaptive, target_time, retries, quarantine,
+                            manifest, key)
+        for results in self._run_chunks(run, input_gen, ordered, inflight):
+            for output in results:
+                yield output
+
+    def write(self, input_gen, sink, options=None, chunksize=200, ordered=True, inflight=None,
+              adaptive=False, target_time=1., retries=0, quarantine=None, manifest=None, key=None):
+        """ Run the pipeline over an input generator and write the results in
+        a sink (see :mod:`reliure.sinks`), the results are not kept in memory.
+        The results are sent to the parent process and written (in the inputs
+        order if `ordered`), unless the sink is sharded: each worker then
+        writes its results in its own shard.
+
+        >>> import os, tempfile
+        >>> from reliure.pipeline import Composable
+        >>> from reliure.sinks import ShardedSink
+        >>> pipeline = Composable(lambda letters: (l.upper() for l in letters))
+        >>> sink = ShardedSink(os.path.join(tempfile.mkdtemp(), "out-{shard}.jsonl"))
+        >>> with ReliurePool(pipeline, ncpu=2) as pool:
+        ...     stats = pool.write("abcde", sink, chunksize=2)
+        >>> stats["inputs"], stats["outputs"], stats["chunks"]
+        (5, 5, 3)
+        >>> sorted(line.strip() for path in sink.paths for line in open(path))
+        ['"A"', '"B"', '"C"', '"D"', '"E"']
+
+        With a `manifest`, the outputs of a chunk are flushed before its
+        inputs are recorded in the manifest.
+
+        :returns: a dict with the number of `inputs` processed, `outputs`
+            written, `chunks` sent, inputs `quarantined` and `skipped` (in
+            the manifest), and the run `time`
+        """
+        t0 = time()
+        run = self._new_run(options, chunksize, adaptive, target_time, retries, quarantine,
+                            manifest, key)
+        if sink.sharded:
+            run.sink = sink
+        sink.open(nshards=self.ncpu)
+        try:
+            for results in self._run_chunks(run, input_gen, ordered, inflight):
+                sink.write(results)
+                if manifest is not None:
+                    sink.flush()
+        finally:
+            sink.close()
+        return {
+            "inputs": run.inputs,
+            "outputs": run.outputs,
+            "chunks": run.sent,
+            "quarantined": run.quarantined,
+            "skipped": run.skipped,
+            "time": time() - t0,
+        }
+
+    def _new_run(self, options, chunksize, adaptive, target_time, retries, quarantine,
+                 manifest, key):
+        if isinstance(quarantine, six.string_types):
+            quarantine = _QuarantineFile(quarantine)
+        return _Run(None, options or {}, _ChunkSizer(chunksize, adaptive, target_time),
+                    retries, quarantine, manifest, key)
+
+    def _run_chunks(self, run, input_gen, ordered, inflight):
+        """ Run the pipeline, yields the results of each chunk
+        """
+        if self._closed:
+            raise ReliureError("The pool is closed")
+        if not self._running.acquire(False):
+            raise ReliureError("The pool is already running")
+        t0 = time()
+        self._run_id += 1
+        run.id = self._run_id
+        self._current_run.value = self._run_id
+        inflight = queue.Queue(inflight or 4 * self.ncpu)  # a slot by chunk in flight
+        stop = threading.Event()
+        feeder = threading.Thread(target=_feed, args=(input_gen, run, self._task_ids,
+                                                      self.ncpu, self._Qdata, inflight, stop))
+        feeder.daemon = True
+        feeder.start()
+        received = 0
+        pending = {}    # seq -> results, waiting for the previous chunks
+        next_seq = 0
+        try:
+            while not run.done or received < run.sent:
+                if run.error is not None:
+                    raise run.error
+                for seq in self._poll(run):
+                    if seq is None or seq not in run.parts:
+                        continue
+                    res = run.completed(seq)
+                    if res is None:
+                        continue
+                    received += 1
+                    if not ordered:
+                        inflight.get_nowait()
+                        yield res
+                        self._done(run, seq)
+                        continue
+                    pending[seq] = res
+                    while next_seq in pending:
+                        inflight.get_nowait()
+                        yield pending.pop(next_seq)
+                        self._done(run, next_seq)
+                        next_seq += 1
+            if run.error is not None:
+                raise run.error
+            self._logger.info("all data has been processed")
+        finally:
+            # the remaining tasks (if the run is stopped) are skipped
+            self._current_run.value = 0
+            stop.set()
+            feeder.join()
+            self._running.release()
+        if run.sizer.adaptive:
+            self._logger.info("last chunk size: %s" % run.sizer.size)
+        self._logger.info("Pipeline executed in %1.3f sec" % (time() - t0))
+
+    def _done(self, run, seq):
+        """ A chunk has been consumed, record its inputs in the manifest
+        """
+        if run.manifest is not None:
+            run.manifest.add(run.keys.pop(seq))
+
+    def map(self, input_gen, **kwargs):
+        """ Same as :func:`run` but returns the list of the results
+        """
+        return list(self.run(input_gen, **kwargs))
+
+    def close(self, timeout=None):
+        """ Stop the workers (once they have finished their current task)
+
+        The results that the workers still send (if a run has been stopped
+        before its end) are discarded.
+
+        :param timeout: the workers that are not stopped after `timeout`
+            seconds are terminated (no limit if None)
+        """
+        if self._closed:
+            return
+        self._closed = True
+        deadline = None if timeout is None else time() + timeout
+        sentinels = len(self._workers)
+        while any(worker.is_alive() for worker in self._workers):
+            if deadline is not None and time() > deadline:
+                self._logger.warning("workers not stopped after %s sec, terminate them" % timeout)
+                self.terminate()
+                return
+            # the input queue may be full of the tasks of a stopped run
+            while sentinels:
+                try:
+                    self._Qdata.put_nowait(None)
+                except queue.Full:
+                    break
+                sentinels -= 1
+            # the workers are blocked until their results are read
+            if self._Qresult.poll(_POLL_TIME):
+                message = self._Qresult.get()
+                if message[0] == "chunk" and isinstance(message[3], _SharedResult):
+                    message[3].discard()
+        for worker in self._workers:
+            worker.join()
+
+    def terminate(self):
+        """ Stop the workers immediately
+        """
+        self._closed = True
+        for worker in self._workers:
+            if worker.is_alive():
+                worker.terminate()
+        for worker in self._workers:
+            worker.join()
+
+
+def run_parallel(pipeline, input_gen, options={}, ncpu=4, chunksize=200, ordered=True, inflight=None,
+                 pipeline_factory=None, factory_args=(), transport="queue",
+                 adaptive=False, target_time=1., retries=0, quarantine=None, sink=None,
+                 manifest=None, key=None):
     """ Run a pipeline in parallel over a input generator cutting it into small
-    chunks.
+    chunks. The results are yielded as soon as they are available (or written
+    in a `sink`).
 
     >>> # if we have a simple component
     >>> from reliure.pipeline import Composable
@@ -70,50 +839,431 @@ def run_parallel(pipeline, input_gen, options={}, ncpu=4, chunksize=200):
     >>> input = "abcde"
     >>> import string
     >>> pipeline = Composable(lambda letters: (l.upper() for l in letters))
-    >>> res = run_parallel(pipeline, input, ncpu=2, chunksize=2)
-    >>> #Note: res should be equals to [['C', 'D'], ['A', 'B'], ['E']]
-    >>> #but it seems that there is a bug with py.test and mp...
+    >>> list(run_parallel(pipeline, input, ncpu=2, chunksize=2))
+    ['A', 'B', 'C', 'D', 'E']
+
+    The inputs are read lazily, and at most `inflight` chunks are being
+    processed or waiting to be consumed: the memory used does not depend on
+    the size of the input.
+
+    Instead of a pipeline, one can give a `pipeline_factory` that is called
+    (with `factory_args`) once in each worker when it starts. Heavy
+    components (big resources to load for ex.) are then not pickled nor
+    shared with the parent process:
+
+    >>> def build_pipeline(suffix):
+    ...     return Composable(lambda letters: (l + suffix for l in letters))
+    >>> list(run_parallel(None, "abc", ncpu=2, pipeline_factory=build_pipeline, factory_args=("!",)))
+    ['a!', 'b!', 'c!']
+
+    The startup time of each worker is logged (at info level).
+
+    By default the results are pickled and copied through a queue. With
+    `transport="shm"` (python >= 3.8) the big buffers in the results are
+    not pickled: they are copied in shared memory by the workers, and from it
+    by the parent. It concerns the numpy arrays (and any object supporting
+    pickle protocol 5 out-of-band buffers), and the bytes, bytearray and
+    memoryview of at least :data:`SHARED_MIN_SIZE` bytes that are in lists,
+    tuples or dicts (they are then given as :class:`memoryview`).
+
+    When the inputs are the lines of a big file, reading them in the parent
+    process may be the bottleneck. Give a :class:`.FileSource` as `input_gen`:
+    the chunks are then byte ranges of the file (of about
+    `FileSource.split_size` bytes, `chunksize` and `adaptive` are not used)
+    that are read by the workers.
+
+    When the processing time of the inputs is skewed, use `adaptive=True`:
+    the size of the chunks is then adapted from the measured processing
+    times for a chunk to take about `target_time` seconds (`chunksize` is
+    just the initial size), and the last inputs are sent in smaller chunks
+    so that the workers finish together.
+
+    A worker that crashes (segfault, out of memory kill...) is replaced, and
+    the chunk it was processing fails with a :class:`.ReliureError`. A chunk
+    that fails is sent again up to `retries` times. Then, if a `quarantine`
+    is given, the chunk is bisected until the failing inputs are isolated:
+    they are given (with the error message) to `quarantine` and the run goes
+    on without their results. Else the error is raised.
+
+    >>> def check(letters):
+    ...     for letter in letters:
+    ...         if letter == "c":
+    ...             raise ValueError("bad letter")
+    ...         yield letter.upper()
+    >>> bad = []
+    >>> list(run_parallel(Composable(check), "abcde", ncpu=2, chunksize=3,
+    ...                   quarantine=lambda item, error: bad.append((item, error))))
+    ['A', 'B', 'D', 'E']
+    >>> [item for item, error in bad]
+    ['c']
+
+    When the outputs do not fit in memory, give a `sink` (see
+    :mod:`reliure.sinks`): the outputs are then written as they are produced,
+    and only some counts and the run time are returned (see
+    :func:`ReliurePool.write`). With a :class:`.ShardedSink` each worker
+    writes its outputs itself.
+
+    To resume a run that died, or to process only the new or modified inputs,
+    give a `manifest` (see :mod:`reliure.manifest`): the keys of the inputs
+    (computed by `key`, by default a hash of their content) are recorded
+    once the results of their chunk are consumed (or written in the sink),
+    and the inputs already recorded are skipped. The chunks of a
+    :class:`.FileSource` are recorded as a whole (if its `split_size` does
+    not change). Note that the inputs put in quarantine are also recorded.
+
+    >>> import os, tempfile
+    >>> from reliure.manifest import FileManifest
+    >>> manifest = FileManifest(os.path.join(tempfile.mkdtemp(), "done.txt"))
+    >>> list(run_parallel(pipeline, "abc", ncpu=2, manifest=manifest, key=lambda letter: letter))
+    ['A', 'B', 'C']
+    >>> list(run_parallel(pipeline, "abcde", ncpu=2, manifest=manifest, key=lambda letter: letter))
+    ['D', 'E']
+
+    To make many runs with the same pipeline, use a :class:`ReliurePool`.
+
+    :param pipeline: the component to run on each chunk of inputs
+    :param input_gen: the inputs (an iterable)
+    :param options: options values given to the pipeline
+    :param ncpu: number of worker processes
+    :param chunksize: number of inputs sent to a worker at once
+    :param ordered: whether the results are yielded in the inputs order (else
+        the results of a chunk are yielded as soon as it is processed)
+    :param inflight: max number of chunks in flight (default `4 * ncpu`)
+    :param pipeline_factory: function that builds the pipeline in each worker
+        (`pipeline` should then be None)
+    :param factory_args: arguments given to `pipeline_factory`
+    :param transport: "queue" or "shm"
+    :param adaptive: whether the chunks size is adaptive
+    :param target_time: processing time of a chunk (in seconds) targeted by
+        the adaptive chunk size
+    :param retries: number of times a failing chunk is sent again
+    :param quarantine: callable called with each input that fails and the
+        error message, or path of a file where they are appended (one JSON
+        object by line)
+    :param sink: a :class:`.Sink` where the outputs are written
+    :param manifest: a :class:`.Manifest` of the processed inputs
+    :param key: function that returns the key of an input (for the
+        manifest), default is :func:`.content_key`
+    """
+    pool_kwargs = dict(ncpu=ncpu, pipeline_factory=pipeline_factory,
+                       factory_args=factory_args, transport=transport)
+    run_kwargs = dict(options=options, chunksize=chunksize, ordered=ordered, inflight=inflight,
+                      adaptive=adaptive, target_time=target_time, retries=retries,
+                      quarantine=quarantine, manifest=manifest, key=key)
+    if sink is not None:
+        with ReliurePool(pipeline, **pool_kwargs) as pool:
+            return pool.write(input_gen, sink, **run_kwargs)
+    return _run_parallel(pipeline, input_gen, pool_kwargs, run_kwargs)
+
+def _run_parallel(pipeline, input_gen, pool_kwargs, run_kwargs):
+    with ReliurePool(pipeline, **pool_kwargs) as pool:
+        for output in pool.run(input_gen, **run_kwargs):
+            yield output
+
+
+class _ThreadPipelines(object):
+    """ Gives its pipeline to each thread of :func:`run_threaded`: a thread
+    safe pipeline is shared, else each thread builds its own pipeline (with
+    the factory or as a deep copy of the pipeline).
+    """
+    def __init__(self, pipeline, pipeline_factory, factory_args):
+        self.pipeline = pipeline
+        self.pipeline_factory = pipeline_factory
+        self.factory_args = factory_args
+        self.shared = pipeline is not None and getattr(pipeline, "thread_safe", False)
+        self._local = threading.local()
+
+    def get(self):
+        if self.shared:
+            return self.pipeline
+        pipeline = getattr(self._local, "pipeline", None)
+        if pipeline is None:
+            if self.pipeline_factory is not None:
+                pipeline = self.pipeline_factory(*self.factory_args)
+            else:
+                try:
+                    pipeline = copy.deepcopy(self.pipeline)
+                except (TypeError, copy.Error, pickle.PicklingError) as err:
+                    # locks, sockets, clients sessions... can't be copied
+                    raise ReliureError("The pipeline %r can't be copied for each thread (%s): "
+                                       "set its `thread_safe` attribute if it may be shared by "
+                                       "the threads, or give a `pipeline_factory`"
+                                       % (self.pipeline, err))
+            self._local.pipeline = pipeline
+        return pipeline
+
+    def process(self, chunk, options):
+        return [output for output in self.get()(chunk, **options)]
+
+
+def run_threaded(pipeline, input_gen, options={}, nthreads=8, chunksize=200, ordered=True,
+                 inflight=None, pipeline_factory=None, factory_args=(), ncpu=None):
+    """ Run a pipeline over a input generator in a pool of threads, cutting
+    it into small chunks. The results are yielded as soon as they are
+    available.
+
+    It works as :func:`run_parallel` but without the cost of processes
+    (start, pickling of the inputs and results): it fits the pipelines that
+    mostly wait (for remote APIs, disks...), or CPU bound pipelines on a
+    free-threaded python build. Only the `options`, `chunksize`, `ordered`,
+    `inflight`, `pipeline_factory` and `factory_args` arguments of
+    :func:`run_parallel` are supported (`ncpu` is an alias of `nthreads`),
+    not the transports, adaptive chunks, retries, quarantine, sinks nor
+    manifests.
+
+    >>> from reliure.pipeline import Composable
+    >>> pipeline = Composable(lambda letters: (l.upper() for l in letters))
+    >>> list(run_threaded(pipeline, "abcde", nthreads=2, chunksize=2))
+    ['A', 'B', 'C', 'D', 'E']
+
+    A pipeline is shared by the threads only if it declares itself thread
+    safe (see :attr:`.Composable.thread_safe`), else each thread uses its own
+    deep copy of the pipeline (or calls `pipeline_factory`):
+
+    >>> pipeline.thread_safe = True
+    >>> list(run_threaded(pipeline, "abc", ordered=False, inflight=2))
+    ['A', 'B', 'C']
+
+    .. note:: the components that hold a lock, a socket or a client session
+        usually can't be copied: a :class:`.ReliureError` is then raised,
+        they should be declared thread safe or built by a `pipeline_factory`.
+
+    :param pipeline: the component to run on each chunk of inputs
+    :param input_gen: the inputs (an iterable)
+    :param options: options values given to the pipeline
+    :param nthreads: number of threads
+    :param chunksize: number of inputs given to a thread at once
+    :param ordered: whether the results are yielded in the inputs order (else
+        the results of a chunk are yielded as soon as it is processed)
+    :param inflight: max number of chunks in flight (default `4 * nthreads`)
+    :param pipeline_factory: function that builds the pipeline of each thread
+        (`pipeline` should then be None)
+    :param factory_args: arguments given to `pipeline_factory`
+    :param ncpu: alias of `nthreads` (as in :func:`run_parallel`)
     """
+    if (pipeline is None) == (pipeline_factory is None):
+        raise ValueError("Either `pipeline` or `pipeline_factory` should be provided")
+    if ncpu is not None:
+        nthreads = ncpu
+    logger = logging.getLogger("reliure.run_threaded")
     t0 = time()
-    #FIXME: there is a know issue when pipeline results are "big" object, the merge is bloking... to be investigate
-    #TODO: add get_pipeline args to prodvide a fct to build the pipeline (in each worker)
-    logger = logging.getLogger("reliure.run_parallel")
-    jobs = []
-    results = []
-    Qdata = mp.JoinableQueue(ncpu*2)  # input queue
-    Qresult = mp.Queue()              # result queue
-    # ensure input_gen is realy an itertor not a list
-    if hasattr(input_gen, "__len__"):
-        input_gen = iter(input_gen)
-    for wnum in range(ncpu):
-        logger.debug("create worker #%s" % wnum)
-        worker = mp.Process(target=_reliure_worker, args=(wnum, Qdata, Qresult, pipeline, options))
-        worker.start()
-        jobs.append(worker)
-    while True:
-        # consume chunksize elements from input_gen
-        chunk = tuple(islice(input_gen, chunksize))
-        if not len(chunk):
-            break
-        logger.info("send a chunk of %s elemets to a worker" % len(chunk))
-        Qdata.put(chunk)
-    logger.info("all data has beed send to workers")
-    # wait until all task are done
-    Qdata.join()
-    logger.debug("wait for workers...")
-    for worker in jobs:
-        worker.terminate()
-    logger.debug("merge results")
+    pipelines = _ThreadPipelines(pipeline, pipeline_factory, factory_args)
+    inflight = inflight or 4 * nthreads
+    input_gen = iter(input_gen)
+    pending = deque() if ordered else set()
+    executor = ThreadPoolExecutor(max_workers=nthreads)
     try:
-        while not Qresult.empty():
-            logger.debug("result queue still have %d elements" % Qresult.qsize())
-            res = Qresult.get_nowait()
-            results.append(res)
-    except mp.Queue.Empty:
-        logger.debug("result queue is empty")
-        pass
+        while True:
+            chunk = list(islice(input_gen, chunksize))
+            if chunk:
+                future = executor.submit(pipelines.process, chunk, options)
+                if ordered:
+                    pending.append(future)
+                else:
+                    pending.add(future)
+            # wait for some results if too many chunks are submitted (or if
+            # all chunks are)
+            while pending and (not chunk or len(pending) >= inflight):
+                if ordered:
+                    done = [pending.popleft()]
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    pending.difference_update(done)
+                for future in done:
+                    for output in future.result():
+                        yield output
+            if not chunk:
+                break
+    finally:
+        # the generator is closed or an error occurs
+        for future in pending:
+            future.cancel()
+        executor.shutdown()
     logger.info("Pipeline executed in %1.3f sec" % (time() - t0))
-    return results
+
+
+class PlayStats(object):
+    """ Aggregated meta data of many plays of an :class:`.Engine` (see
+    :func:`run_engine`): number of plays and errors, and for each block
+    (named as its :class:`.PlayMeta`) the total, mean, min, max and
+    percentiles of its play time.
+
+    >>> from reliure.engine import PlayMeta, BasicPlayMeta
+    >>> from reliure.pipeline import Composable
+    >>> stats = PlayStats()
+    >>> for duration in (0.1, 0.2, 0.3, 0.4):
+    ...     comp_meta = BasicPlayMeta(Composable(name="comp"))
+    ...     comp_meta.time = duration
+    ...     block_meta = PlayMeta("block")
+    ...     block_meta.append(comp_meta)
+    ...     meta = PlayMeta("engine")
+    ...     meta.append(block_meta)
+    ...     stats.add(meta)
+    >>> block = stats.as_dict()["blocks"]["block:[comp]"]
+    >>> block["count"], round(block["total"], 3), round(block["mean"], 3), block["p50"]
+    (4, 1.0, 0.25, 0.2)
+
+    The percentiles are computed over a random sample of `sample_size` play
+    times by block (so the memory used does not depend on the number of
+    plays).
+    """
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, sample_size=10000):
+        self.sample_size = sample_size
+        self.plays = 0
+        self.errors = 0
+        self._blocks = OrderedDict()   # name -> [count, errors, cache hits, total, min, max, sample]
+        self._random = random.Random(42)
+
+    @staticmethod
+    def summary(meta):
+        """ Returns a (small, picklable) summary of the meta data of a play:
+        the list of `(block name, time, has error, cache hit)`
+        """
+        return [(block_meta.name, block_meta.time, block_meta.has_error,
+                 any(comp_meta.cache_hit for comp_meta in block_meta))
+                for block_meta in meta]
+
+    def add(self, meta):
+        """ Add the meta data of a play (the :class:`.PlayMeta` of an engine)
+        """
+        self.add_summary(self.summary(meta))
+
+    def add_summary(self, summary):
+        """ Add the summary of the meta data of a play (see :func:`summary`)
+        """
+        self.plays += 1
+        if any(has_error for _, _, has_error, _ in summary):
+            self.errors += 1
+        for name, duration, has_error, cache_hit in summary:
+            block = self._blocks.get(name)
+            if block is None:
+                block = self._blocks[name] = [0, 0, 0, 0., duration, duration, []]
+            block[0] += 1
+            block[1] += has_error
+            block[2] += cache_hit
+            block[3] += duration
+            block[4] = min(block[4], duration)
+            block[5] = max(block[5], duration)
+            # reservoir sampling of the times
+            sample = block[6]
+            if len(sample) < self.sample_size:
+                sample.append(duration)
+            else:
+                pos = self._random.randint(0, block[0] - 1)
+                if pos < self.sample_size:
+                    sample[pos] = duration
+
+    def as_dict(self):
+        """ Returns the aggregated stats
+        """
+        blocks = OrderedDict()
+        for name, (count, errors, cache_hits, total, tmin, tmax, sample) in six.iteritems(self._blocks):
+            sample = sorted(sample)
+            stats = {
+                "count": count,
+                "errors": errors,
+                "cache_hits": cache_hits,
+                "total": total,
+                "mean": total / count,
+                "min": tmin,
+                "max": tmax,
+                # plays by second of the block
+                "throughput": count / total if total > 0 else None,
+            }
+            for percent in self.PERCENTILES:
+                # nearest rank percentile
+                rank = max(int(-(-percent * len(sample) // 100)), 1)
+                stats["p%d" % percent] = sample[rank - 1]
+            blocks[name] = stats
+        return {"plays": self.plays, "errors": self.errors, "blocks": blocks}
+
+
+def _play_engine(engine, inputs, config, outputs):
+    """ Play an engine with one input (a dict of named inputs, a tuple of
+    inputs or the only input of the first block)
+    """
+    if isinstance(inputs, dict):
+        return engine.play(config=config, outputs=outputs, **inputs)
+    if not isinstance(inputs, tuple):
+        inputs = (inputs,)
+    return engine.play(*inputs, config=config, outputs=outputs)
+
+
+class _EnginePlayer(object):
+    """ Component used by :func:`run_engine` to play an engine in the workers,
+    it yields the results with the summary of the meta data of each play
+    """
+    def __init__(self, engine, config, outputs):
+        self.engine = engine
+        self.config = config
+        self.outputs = outputs
+
+    def __call__(self, inputs_list):
+        for inputs in inputs_list:
+            results = _play_engine(self.engine, inputs, self.config, self.outputs)
+            yield dict(results), PlayStats.summary(self.engine.meta)
+
+
+def run_engine(engine, input_gen, config=None, outputs=None, stats=None, ncpu=None, **kwargs):
+    """ Play an :class:`.Engine` over a stream of inputs, and yields the
+    results of each play.
+
+    >>> from reliure.engine import Engine
+    >>> engine = Engine("double", "inc")
+    >>> engine.double.setup(in_name="in", out_name="doubled")
+    >>> engine.double.set(lambda x: x * 2)
+    >>> engine.inc.setup(in_name="doubled", out_name="out")
+    >>> engine.inc.set(lambda x: x + 1)
+    >>> stats = PlayStats()
+    >>> [res["out"] for res in run_engine(engine, range(4), stats=stats)]
+    [1, 3, 5, 7]
+    >>> stats.plays, list(stats.as_dict()["blocks"])
+    (4, ['double:[<lambda>]', 'inc:[<lambda>]'])
+
+    With `ncpu` the engine is played in worker processes by
+    :func:`run_parallel` (that gets the other arguments), the results are
+    then plain dicts:
+
+    >>> res = run_engine(engine, ({"in": num} for num in range(4)), outputs=["out"], ncpu=2)
+    >>> [out["out"] for out in res]
+    [1, 3, 5, 7]
+
+    :param engine: the engine to play
+    :param input_gen: the inputs of each play: dicts of named inputs, or
+        tuples of inputs of the first block, or the input of the first block
+    :param config: the engine configuration (see :func:`.Engine.play`)
+    :param outputs: the wanted outputs (see :func:`.Engine.play`)
+    :param stats: a :class:`PlayStats` in which the meta data of the plays are
+        aggregated
+    :param ncpu: number of worker processes (the engine is played in the
+        current process if None)
+
+    .. note:: the results are always yielded, `sink` is not supported.
+    """
+    if "sink" in kwargs:
+        raise ValueError("run_engine does not support sinks, write the yielded results instead")
+    logger = logging.getLogger("reliure.run_engine")
+    t0 = time()
+    if stats is None:
+        stats = PlayStats()
+    if ncpu is None:
+        for inputs in input_gen:
+            # the meta is not setted if the play fails before running the blocks
+            engine.meta = None
+            try:
+                results = _play_engine(engine, inputs, config, outputs)
+            finally:
+                if engine.meta is not None:
+                    stats.add(engine.meta)
+            yield results
+    else:
+        player = _EnginePlayer(engine, config, outputs)
+        for results, summary in run_parallel(player, input_gen, ncpu=ncpu, **kwargs):
+            stats.add_summary(summary)
+            yield results
+    logger.info("%d plays in %1.3f sec" % (stats.plays, time() - t0))
 
 
 def main():
@@ -137,8 +1287,8 @@ def main():
 
     pipeline = doc_analyse | print_ulrs
 
-    documents = ("doc_%s" % d for d in xrange(20))
-    res = run_parallel(pipeline, documents, ncpu=2, chunksize=5)
+    documents = ("doc_%s" % d for d in range(20))
+    res = list(run_parallel(pipeline, documents, ncpu=2, chunksize=5))
     print(res)
 
 if __name__ == '__main__':
@@ -11,8 +11,12 @@ Class
 -----
 """
 import logging
-from collections import OrderedDict
+import itertools
+import multiprocessing
+from collections import OrderedDict, deque
 from functools import wraps, update_wrapper
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Executor
+from concurrent.futures import wait, FIRST_COMPLETED
 
 from reliure.options import ValueOption
 
@@ -49,6 +53,9 @@ class Composable(object):
     [4, 12]
 
     """
+    #: whether the component may be called from many threads at once (see
+    #: :func:`.offline.run_threaded`), it may be setted on an instance
+    thread_safe = False
 
     def __init__(self, func=None, name=None):
         """ You can create a :class:`Composable` from a simple function:
@@ -273,17 +280,23 @@ class Optionable(Composable):
         :type strict: bool
         """
         if strict:
-            for opt_name in options.keys():
-                if not self.has_option(opt_name):
-                    raise ValueError("'%s' is not a option of the component" % opt_name)
-                elif self.option_is_hidden(opt_name):
-                    raise ValueError("'%s' is hidden, you can't set it" % opt_name)
+            self._check_options(options)
         for opt_name, opt in self._options.items():
             if opt.hidden:
                 continue
             if opt_name in options:
                 opt.set(options[opt_name], parse=parse)
 
+    def _check_options(self, options):
+        """ Raises ValueError if one of the given options does not exist or is
+        hidden
+        """
+        for opt_name in options.keys():
+            if not self.has_option(opt_name):
+                raise ValueError("'%s' is not a option of the component" % opt_name)
+            elif self.option_is_hidden(opt_name):
+                raise ValueError("'%s' is hidden, you can't set it" % opt_name)
+
     def get_options_values(self, hidden=False):
         """ return a dictionary of options values
         
@@ -298,6 +311,52 @@ class Optionable(Composable):
                 values[opt_name] = opt.value
         return values
 
+    def resolve_options_values(self, options, parse=False, strict=False, hidden=False, clear=False):
+        """ Returns the options values that the component would have after a
+        call to :func:`set_options_values` (and to :func:`clear_options_values`
+        if `clear`) **without** changing the stored values.
+
+        >>> from reliure.types import Numeric
+        >>> comp = Optionable("comp")
+        >>> comp.add_option("alpha", Numeric(default=4))
+        >>> comp.add_option("beta", Numeric(default=1))
+        >>> comp.set_option_value("beta", 2)
+        >>> sorted(comp.resolve_options_values({"alpha": "3"}, parse=True).items())
+        [('alpha', 3), ('beta', 2)]
+        >>> sorted(comp.resolve_options_values({"alpha": "3"}, parse=True, clear=True).items())
+        [('alpha', 3), ('beta', 1)]
+        >>> comp.get_option_value("alpha")
+        4
+
+        :param options: the values of some options (in format `{"opt_name": "new_value"}`)
+        :type options: dict
+        :param parse: whether to parse the given value
+        :type parse: bool
+        :param strict: if True the given `options` dict should only contains
+         existing and not hidden options
+        :type strict: bool
+        :param hidden: whether to return hidden options
+        :type hidden: bool
+        :param clear: if True the stored values are ignored (defaults are used)
+        :type clear: bool
+        :returns: dictionary of all option values
+        :rtype: dict
+        """
+        if strict:
+            self._check_options(options)
+        values = {}
+        for opt_name, opt in self._options.items():
+            if opt.hidden and not hidden:
+                continue
+            if opt_name in options and not opt.hidden:
+                value = options[opt_name]
+                if parse:
+                    value = opt.parse(value)
+                values[opt_name] = opt.validate(value)
+            else:
+                values[opt_name] = opt.default if clear else opt.value
+        return values
+
     def parse_options(self, option_values):
         """ Set the options (with parsing) and returns a dict of all options values
         """
@@ -329,10 +388,11 @@ class Optionable(Composable):
         It check the given option values
         """
         # wrap the method
+        # note: the given values are not stored in the component, so it can be
+        # called concurrently with different options
         @wraps(call_fct)
         def checked_call(self, *args, **kwargs):
-            self.set_options_values(kwargs, parse=False, strict=True)
-            options_values = self.get_options_values(hidden=True)
+            options_values = self.resolve_options_values(kwargs, strict=True, hidden=True)
             return call_fct(self, *args, **options_values)
         # add a flag on the new method to indicate that it is 'checked'
         checked_call._checked = True
@@ -357,6 +417,7 @@ class OptionableSequence(Optionable):
         self.shared_option = kwargs.get("shared_option", False)
         super(OptionableSequence, self).__init__()
         self._options = None    # to detect better methods that are not overriden
+        self._thread_safe = None    # explicit value of `thread_safe`
         self.items = []
         for rank, comp in enumerate(composants):
             if not isinstance(comp, Composable):
@@ -385,6 +446,33 @@ class OptionableSequence(Optionable):
     def __call__(self, *args, **kwargs):
         raise NotImplementedError
 
+    @property
+    def thread_safe(self):
+        """ A sequence is thread safe if all its components are, unless it is
+        setted explicitly
+
+        >>> safe = Composable(lambda x: x + 1)
+        >>> safe.thread_safe = True
+        >>> pipeline = safe | Composable(lambda x: x * 2)
+        >>> pipeline.thread_safe
+        False
+        >>> (safe | safe).thread_safe
+        True
+        >>> pipeline.thread_safe = True
+        >>> pipeline.thread_safe
+        True
+        >>> pipeline.thread_safe = None     # back to the components values
+        >>> pipeline.thread_safe
+        False
+        """
+        if self._thread_safe is not None:
+            return self._thread_safe
+        return all(getattr(item, "thread_safe", False) for item in self.items)
+
+    @thread_safe.setter
+    def thread_safe(self, value):
+        self._thread_safe = value
+
     @property
     def options(self):
         _options = OrderedDict()
@@ -482,13 +570,21 @@ class OptionableSequence(Optionable):
             values.update(item.get_options_values(hidden=hidden))
         return values
 
+    def resolve_options_values(self, options, parse=False, strict=False, hidden=False, clear=False):
+        if strict:
+            self._check_options(options)
+        values = {}
+        for item in self.opt_items:
+            values.update(item.resolve_options_values(options, parse=parse,
+                                                      hidden=hidden, clear=clear))
+        return values
+
     def call_item(self, item, *args, **kwargs):
         item_kwargs = {}
         # if Optionable, build kargs
         item_name = item.name if hasattr(item, 'name') else ""
         if isinstance(item, Optionable):
-            item.set_options_values(kwargs, strict=False, parse=False)
-            item_kwargs = item.get_options_values()
+            item_kwargs = item.resolve_options_values(kwargs)
         self.logger.debug("calling %s '%s' with %s", item, item_name, item_kwargs)
         try:
             res = item(*args, **item_kwargs)
@@ -534,6 +630,38 @@ class Pipeline(OptionableSequence):
             args = [self.call_item(item, *args, **kwargs)]
         return args[0] # expect only one output XXX
 
+    def compile(self):
+        """ Returns a frozen version of the pipeline, faster to call (see
+        :class:`CompiledSequence`).
+
+        >>> step1 = Composable(lambda x: x**2)
+        >>> processing = (step1 | (lambda x: x-1)).compile()
+        >>> processing(4)
+        15
+        """
+        return CompiledPipeline(self)
+
+    def batch_call(self, *columns, **kwargs):
+        """ Run the pipeline over a batch of inputs (one list per argument),
+        items that have a `batch_call` method get the whole batch at once (see
+        :func:`.Block.play_batch`).
+
+        >>> processing = Pipeline(lambda x: x**2, lambda x: x-1)
+        >>> processing.batch_call([1, 2, 3])
+        [0, 3, 8]
+        """
+        # note: hidden options values may be given (as for any batch_call)
+        kwargs = self.resolve_options_values(kwargs, hidden=True)
+        for item in self.items:
+            if hasattr(item, "batch_call"):
+                item_kwargs = {}
+                if isinstance(item, Optionable):
+                    item_kwargs = item.resolve_options_values(kwargs, hidden=True)
+                columns = [list(item.batch_call(*columns, **item_kwargs))]
+            else:
+                columns = [[self.call_item(item, *args, **kwargs) for args in zip(*columns)]]
+        return columns[0]
+
 
 class Map(OptionableSequence):
     """ Apply a composable to each element of an generator like input.
@@ -545,12 +673,67 @@ class Map(OptionableSequence):
     >>> [e for e in flux_process(inputs)]
     [0, 0, 4, 5, 6]
 
+    The elements may also be processed in parallel, by chunks, in a pool of
+    threads or of processes:
+
+    >>> flux_process = Map(item_process, executor="thread", workers=4, chunksize=2)
+    >>> [e for e in flux_process(range(5))]
+    [0, 0, 4, 5, 6]
+    >>> flux_process.close()
+
+    The results are still produced lazily: only a bounded number of chunks
+    (`inflight`) are submitted ahead, so an infinite generator may be given.
+    With `ordered=False` the results of the chunks are yield as soon as they
+    are done (not in the inputs order).
+
+    .. note:: with a "process" executor the composable is pickled for each
+        chunk, it should then be defined at module level.
     """
-    def __init__(self, comp, as_list=False):
+    def __init__(self, comp, as_list=False, executor=None, workers=None,
+                 chunksize=1, ordered=True, inflight=None):
+        """
+        :param comp: the composable to apply to each element
+        :param as_list: whether to return a list (else a generator)
+        :param executor: None (sequential), "thread", "process" or a
+            :class:`concurrent.futures.Executor`
+        :param workers: number of workers (default to the cpu count)
+        :type workers: int
+        :param chunksize: number of elements processed by a task
+        :type chunksize: int
+        :param ordered: whether the results are in the inputs order
+        :type ordered: bool
+        :param inflight: max number of chunks submitted but not yet consumed
+            (default to twice the number of workers)
+        :type inflight: int
+        """
         super(Map, self).__init__(comp)
         self.comp = comp
         self.as_list = as_list
         #TODO: add ce qu'il faut pour cloner les options de comp
+        if executor not in (None, "thread", "process") and not isinstance(executor, Executor):
+            raise ValueError("Invalid executor '%s' (should be None, 'thread', 'process' or an Executor)" % executor)
+        if chunksize < 1:
+            raise ValueError("chunksize should be a positive integer")
+        self.executor = executor
+        self.workers = workers or multiprocessing.cpu_count()
+        self.chunksize = chunksize
+        self.ordered = ordered
+        self.inflight = inflight or 2 * self.workers
+        self._executor = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_executor"] = None   # a pool can't be pickled
+        return state
+
+    def close(self):
+        """ Shutdown the pool (if created by the Map) and close the nested
+        component
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        super(Map, self).close()
 
     @Optionable.check
     def __call__(self, inputs, **kwargs):
@@ -560,9 +743,60 @@ class Map(OptionableSequence):
             return self._apply(inputs, **kwargs)
 
     def _apply(self, inputs,  **kwargs):
+        if self.executor is not None:
+            for val in self._apply_parallel(inputs, **kwargs):
+                yield val
+            return
         for val in inputs:
            yield self.comp(val, **kwargs)
 
+    def _get_executor(self):
+        if isinstance(self.executor, Executor):
+            return self.executor
+        if self._executor is None:
+            if self.executor == "thread":
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def _apply_parallel(self, inputs, **kwargs):
+        executor = self._get_executor()
+        inputs = iter(inputs)
+        pending = deque() if self.ordered else set()
+        try:
+            while True:
+                chunk = list(itertools.islice(inputs, self.chunksize))
+                if chunk:
+                    future = executor.submit(_map_chunk, self.comp, chunk, kwargs)
+                    if self.ordered:
+                        pending.append(future)
+                    else:
+                        pending.add(future)
+                # wait for some results if too many chunks are submitted (or
+                # if all chunks are)
+                while pending and (not chunk or len(pending) >= self.inflight):
+                    if self.ordered:
+                        done = [pending.popleft()]
+                    else:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        pending.difference_update(done)
+                    for future in done:
+                        for val in future.result():
+                            yield val
+                if not chunk:
+                    break
+        finally:
+            # the generator is closed or an error occurs
+            for future in pending:
+                future.cancel()
+
+
+def _map_chunk(comp, chunk, kwargs):
+    """ Apply a composable to a chunk of elements (see :class:`Map`)
+    """
+    return [comp(val, **kwargs) for val in chunk]
+
 
 class MapSeq(OptionableSequence):
     """ Map implentation for components
@@ -580,6 +814,12 @@ class MapSeq(OptionableSequence):
     def map(self, *args, **kwargs):
         return [self.call_item(item, *args, **kwargs) for item in self.items]
 
+    def compile(self):
+        """ Returns a frozen version of the sequence, faster to call (see
+        :class:`CompiledSequence`).
+        """
+        return CompiledMapSeq(self)
+
 
 class MapReduce(MapSeq):
     """ MapReduce implentation for components
@@ -616,4 +856,152 @@ class MapReduce(MapSeq):
     def reduce(self, array, *args,  **kwargs):
         return NotImplementedError
 
+    def compile(self):
+        """ Returns a frozen version of the map reduce, faster to call (see
+        :class:`CompiledSequence`).
+
+        >>> mapseq = MapReduce(sum, lambda x: x+1, lambda x: x+2).compile()
+        >>> mapseq(10)
+        23
+        """
+        return CompiledMapReduce(self)
+
+
+class CompiledSequence(object):
+    """ Frozen callable version of an :class:`OptionableSequence`.
+
+    The routing of the options to the items is computed once, and the items
+    options values are the ones of the sequence when it is compiled: the
+    components are never modified, nor read, when the compiled sequence is
+    called. The call of each item is then just one function call (checked
+    :class:`Optionable` are called without their check, as the given options
+    values are checked once for the whole sequence).
+
+    >>> from reliure.types import Numeric
+    >>> class Mult(Optionable):
+    ...     def __init__(self):
+    ...         super(Mult, self).__init__("mult")
+    ...         self.add_option("factor", Numeric(default=2))
+    ...     @Optionable.check
+    ...     def __call__(self, value, factor=None):
+    ...         return value * factor
+    >>> pipeline = Composable(lambda x: x + 1) | Mult()
+    >>> compiled = pipeline.compile()
+    >>> compiled(3), compiled(3, factor=10)
+    (8, 40)
+    >>> compiled(3, alpha=10)
+    Traceback (most recent call last):
+    ...
+    ValueError: 'alpha' is not a option of the component
+
+    Changes made on the components after the compilation are not seen:
+
+    >>> pipeline.set_option_value("factor", 3)
+    >>> pipeline(3), compiled(3)
+    (12, 8)
+
+    It is then thread safe (as long as the items are).
+    """
+    def __init__(self, sequence):
+        """
+        :param sequence: the :class:`OptionableSequence` to compile
+        """
+        self.name = sequence.name
+        # option name -> options to validate the given values
+        self._options = {}
+        self._hidden = set()
+        for item in sequence.opt_items:
+            for opt_name, opt in item.options.items():
+                if opt.hidden:
+                    self._hidden.add(opt_name)
+                else:
+                    self._options.setdefault(opt_name, []).append(opt)
+        # all the options values (given to reduce for ex.)
+        self._values = sequence.get_options_values(hidden=True)
+        # (function, options values, option names)
+        self._stages = tuple(self._compile_item(item) for item in sequence.items)
+
+    @staticmethod
+    def _compile_item(item):
+        """ Returns the function to call for an item, the (frozen) options
+        values to give to it, and the names of the options it can get
+        """
+        if not isinstance(item, Optionable):
+            return getattr(item, "_func", item), {}, ()
+        names = tuple(opt_name for opt_name, opt in item.options.items() if not opt.hidden)
+        if hasattr(item, "compile"):
+            compiled = item.compile()
+            return compiled._run, {}, names
+        no_check = getattr(type(item).__call__, "_no_check", None)
+        if no_check is not None and not isinstance(item, OptionableSequence):
+            return no_check.__get__(item, type(item)), item.get_options_values(hidden=True), names
+        return item, item.get_options_values(), names
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, self.name)
+
+    def __call__(self, *args, **kwargs):
+        if kwargs:
+            kwargs = self._check(kwargs)
+        return self._run(*args, **kwargs)
+
+    def _check(self, kwargs):
+        """ Check and validate the given options values
+        """
+        values = {}
+        for opt_name, value in kwargs.items():
+            if opt_name not in self._options:
+                if opt_name in self._hidden:
+                    raise ValueError("'%s' is hidden, you can't set it" % opt_name)
+                raise ValueError("'%s' is not a option of the component" % opt_name)
+            for opt in self._options[opt_name]:
+                value = opt.validate(value)
+            values[opt_name] = value
+        return values
+
+    @staticmethod
+    def _call_stage(stage, args, kwargs):
+        fct, values, names = stage
+        if kwargs and names:
+            values = dict(values)
+            values.update((name, kwargs[name]) for name in names if name in kwargs)
+        return fct(*args, **values)
+
+    def _run(self, *args, **kwargs):
+        """ Call the sequence with already checked options values
+        """
+        raise NotImplementedError
+
+
+class CompiledPipeline(CompiledSequence):
+    """ Compiled :class:`Pipeline` (see :func:`Pipeline.compile`)
+    """
+    def _run(self, *args, **kwargs):
+        for stage in self._stages:
+            args = (self._call_stage(stage, args, kwargs),)
+        return args[0]
+
+
+class CompiledMapSeq(CompiledSequence):
+    """ Compiled :class:`MapSeq` (see :func:`MapSeq.compile`)
+    """
+    def _run(self, *args, **kwargs):
+        return [self._call_stage(stage, args, kwargs) for stage in self._stages]
+
+
+class CompiledMapReduce(CompiledMapSeq):
+    """ Compiled :class:`MapReduce` (see :func:`MapReduce.compile`)
+    """
+    def __init__(self, sequence):
+        super(CompiledMapReduce, self).__init__(sequence)
+        self._reduce = sequence.reduce
+
+    def _run(self, *args, **kwargs):
+        array = super(CompiledMapReduce, self)._run(*args, **kwargs)
+        values = self._values
+        if kwargs:
+            values = dict(values)
+            values.update(kwargs)
+        return self._reduce(array, *args, **values)
+
 
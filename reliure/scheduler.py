@@ -0,0 +1,188 @@
+#-*- coding:utf-8 -*-
+""" :mod:`reliure.scheduler`
+==========================
+
+Coalesce concurrent plays of an :class:`.Engine` in batches
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import six
+from six.moves import queue
+
+from reliure.utils.cache import make_key
+
+
+class BatchScheduler(object):
+    """ Collect the play requests arriving in a short time window and run them
+    with one :func:`.Engine.play_batch`.
+
+    Blocks components that have a `batch_call` method are then called once
+    for all the requests of the window (see :func:`.Block.play_batch`). It
+    trades a bounded latency (`max_wait`) for throughput.
+
+    >>> from reliure.engine import Engine
+    >>> engine = Engine("op")
+    >>> engine.op.setup(in_name="in")
+    >>> engine.op.set(lambda x: x * 2)
+    >>> scheduler = BatchScheduler(engine, max_batch_size=16, max_wait=2)
+    >>> # it may be used (from many threads) as the engine
+    >>> scheduler.play(21)["op"]
+    42
+    >>> scheduler.meta.name
+    'engine:[op:[<lambda>]]'
+    >>> # or with futures
+    >>> futures = [scheduler.submit({"in": num}) for num in range(3)]
+    >>> [future.result()["op"] for future in futures]
+    [0, 2, 4]
+    >>> scheduler.close()
+
+    Requests are batched together only if they have the same configuration,
+    the same wanted outputs and the same inputs names. If a batch fails, its
+    requests are played one by one so that an invalid request does not make
+    the others fail.
+    """
+    def __init__(self, engine, max_batch_size=32, max_wait=5.):
+        """
+        :param engine: the :class:`.Engine` to play
+        :param max_batch_size: maximum number of requests in a batch
+        :type max_batch_size: int
+        :param max_wait: maximum time (in milliseconds) a request waits for
+            other requests
+        :type max_wait: float
+        """
+        self._logger = logging.getLogger("reliure.%s" % self.__class__.__name__)
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._local = threading.local()
+
+    @property
+    def meta(self):
+        """ :class:`.PlayMeta` of the last :func:`play` (made in the current
+        thread), note that it is the meta data of the whole batch.
+        """
+        return getattr(self._local, "meta", None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="reliure-batch-scheduler")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def close(self):
+        """ Stop the scheduler once all the submited requests are played
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def submit(self, inputs, config=None, outputs=None):
+        """ Submit a play request.
+
+        :param inputs: the inputs, either a dict of named inputs or the
+            input(s) of the first block (as for :func:`.Engine.play_batch`)
+        :param config: the engine configuration (see :func:`.Engine.play`)
+        :param outputs: the wanted outputs (see :func:`.Engine.play`)
+        :returns: a :class:`concurrent.futures.Future` of the results, its
+            `meta` attribute is setted with the :class:`.PlayMeta` of the batch
+        """
+        future = Future()
+        future.meta = None
+        self._start()
+        self._queue.put((inputs, config, outputs, future))
+        return future
+
+    def play(self, *inputs, **named_inputs):
+        """ Play a request and wait for its results, same usage than
+        :func:`.Engine.play`
+        """
+        config = named_inputs.pop("config", None)
+        outputs = named_inputs.pop("outputs", None)
+        if len(inputs) and len(named_inputs):
+            raise ValueError("Either `inputs` or `named_inputs` should be provided, not both !")
+        if not len(inputs):
+            inputs = named_inputs
+        elif len(inputs) == 1:
+            inputs = inputs[0]
+        future = self.submit(inputs, config=config, outputs=outputs)
+        try:
+            return future.result()
+        finally:
+            self._local.meta = future.meta
+
+    def _run(self):
+        """ Scheduler thread main loop
+        """
+        stop = False
+        while not stop:
+            request = self._queue.get()
+            if request is None:
+                break
+            batch = [request]
+            deadline = time.time() + self.max_wait / 1000.
+            while len(batch) < self.max_batch_size:
+                try:
+                    request = self._queue.get(timeout=max(deadline - time.time(), 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stop = True
+                    break
+                batch.append(request)
+            self._play(batch)
+
+    def _play(self, batch):
+        """ Play a batch of requests (grouped by configuration)
+        """
+        groups = OrderedDict()
+        for request in batch:
+            inputs, config, outputs, future = request
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                key = make_key(config, outputs, sorted(inputs) if isinstance(inputs, dict) else None)
+            except TypeError:
+                key = id(request)
+            groups.setdefault(key, []).append(request)
+        for requests in six.itervalues(groups):
+            self._play_group(requests)
+
+    def _play_group(self, requests):
+        """ Play some requests with the same configuration in one batch
+        """
+        _, config, outputs, _ = requests[0]
+        self._logger.debug("play a batch of %d requests" % len(requests))
+        # the meta is not setted if the play fails before running the blocks
+        self.engine.meta = None
+        try:
+            results = self.engine.play_batch([request[0] for request in requests],
+                                             config=config, outputs=outputs)
+        except Exception as error:
+            if len(requests) == 1:
+                requests[0][3].meta = self.engine.meta
+                requests[0][3].set_exception(error)
+            else:
+                # play the requests one by one
+                for request in requests:
+                    self._play_group([request])
+            return
+        meta = self.engine.meta
+        for request, result in zip(requests, results):
+            request[3].meta = meta
+            request[3].set_result(result)
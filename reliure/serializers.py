@@ -0,0 +1,172 @@
+#-*- coding:utf-8 -*-
+""" :mod:`reliure.serializers`
+============================
+
+Serializers of the HTTP responses (see :class:`.EngineView`), chosen
+according to the `Accept` header of the requests:
+
+>>> serializer = negotiate("application/msgpack;q=0.5, application/json", [JsonSerializer()])
+>>> serializer.content_type
+'application/json'
+>>> serializer.dumps({"results": {"scores": [0.5, 1]}})
+b'{"results":{"scores":[0.5,1]}}'
+
+:class:`JsonSerializer` uses `orjson <https://github.com/ijl/orjson>`_ if it
+is installed, and :class:`MsgpackSerializer` needs `msgpack
+<https://msgpack.org/>`_. NumPy arrays and scalars are serialized as lists and
+numbers.
+"""
+import json
+import decimal
+import datetime
+import uuid
+
+try:
+    import orjson
+except ImportError:     # optional
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:     # optional
+    msgpack = None
+
+from reliure.exceptions import ReliureError
+
+__all__ = ["Serializer", "JsonSerializer", "MsgpackSerializer", "default_serializers", "negotiate"]
+
+
+def to_builtin(obj):
+    """ Converts the values that are not natively serializable: NumPy
+    arrays and scalars (and others objects with a `tolist` method), dates,
+    sets, decimals and uuids.
+
+    >>> to_builtin(set([1]))
+    [1]
+    >>> to_builtin(datetime.date(2016, 12, 1))
+    '2016-12-01'
+
+    :raises TypeError: for other values
+    """
+    if hasattr(obj, "tolist"):
+        # numpy arrays and scalars
+        return obj.tolist()
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, (decimal.Decimal, uuid.UUID)):
+        return str(obj)
+    raise TypeError("Object of type %s is not serializable" % obj.__class__.__name__)
+
+
+class Serializer(object):
+    """ Base class of the serializers
+    """
+    #: content type of the serialized data
+    content_type = None
+    #: other content types accepted for this serializer
+    aliases = ()
+
+    def dumps(self, data):
+        """ Returns the serialized data (bytes)
+        """
+        raise NotImplementedError
+
+    def loads(self, data):
+        """ Returns the data from serialized bytes
+        """
+        raise NotImplementedError
+
+    def accepts(self, content_type):
+        """ Whether the serializer produces a content type
+        """
+        return content_type == self.content_type or content_type in self.aliases
+
+
+class JsonSerializer(Serializer):
+    """ Compact JSON, with `orjson` if it is installed (that serializes NumPy
+    arrays natively) else with the standard :mod:`json` module.
+    """
+    content_type = "application/json"
+
+    def __init__(self, use_orjson=True):
+        """
+        :param use_orjson: whether `orjson` is used (if it is installed)
+        """
+        self.use_orjson = use_orjson and orjson is not None
+
+    def dumps(self, data):
+        if self.use_orjson:
+            return orjson.dumps(data, default=to_builtin,
+                                option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+        return json.dumps(data, default=to_builtin, ensure_ascii=False,
+                          separators=(",", ":")).encode("utf8")
+
+    def loads(self, data):
+        if self.use_orjson:
+            return orjson.loads(data)
+        return json.loads(data.decode("utf8"))
+
+
+class MsgpackSerializer(Serializer):
+    """ MessagePack binary encoding (needs `msgpack`)
+    """
+    content_type = "application/msgpack"
+    aliases = ("application/x-msgpack",)
+
+    def __init__(self):
+        if msgpack is None:
+            raise ReliureError("msgpack is needed for MessagePack serialization (pip install msgpack)")
+
+    def dumps(self, data):
+        return msgpack.packb(data, default=to_builtin, use_bin_type=True)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+def default_serializers():
+    """ Returns the default serializers: JSON, and MessagePack if `msgpack` is
+    installed
+    """
+    serializers = [JsonSerializer()]
+    if msgpack is not None:
+        serializers.append(MsgpackSerializer())
+    return serializers
+
+
+def negotiate(accept, serializers):
+    """ Returns the serializer to use for a request according to its `Accept`
+    header (the first serializer by default)
+
+    >>> serializers = [JsonSerializer()]
+    >>> negotiate("text/html, */*;q=0.1", serializers).content_type
+    'application/json'
+    >>> negotiate(None, serializers).content_type
+    'application/json'
+
+    :param accept: the `Accept` header of the request (may be None)
+    :param serializers: the available serializers
+    """
+    ranges = []
+    for num, media_range in enumerate((accept or "").split(",")):
+        parts = [part.strip() for part in media_range.split(";")]
+        quality = 1.
+        for param in parts[1:]:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.
+        if parts[0] and quality > 0:
+            ranges.append((-quality, num, parts[0].lower()))
+    for _, _, content_type in sorted(ranges):
+        if content_type == "*/*":
+            return serializers[0]
+        for serializer in serializers:
+            if serializer.accepts(content_type) \
+                    or (content_type.endswith("/*")
+                        and serializer.content_type.startswith(content_type[:-1])):
+                return serializer
+    return serializers[0]
@@ -0,0 +1,223 @@
+#-*- coding:utf-8 -*-
+""" :mod:`reliure.sinks`
+======================
+
+Outputs sinks for offline runs (see :func:`.offline.run` and
+:func:`.offline.run_parallel`): the outputs are written as they are produced
+instead of being kept in memory.
+
+>>> import os, tempfile
+>>> path = os.path.join(tempfile.mkdtemp(), "out.jsonl")
+>>> with JsonLinesSink(path) as sink:
+...     sink.write([{"id": 1}, {"id": 2}])
+2
+>>> print(open(path).read().strip())
+{"id": 1}
+{"id": 2}
+"""
+import io
+import json
+import gzip
+
+
+class Sink(object):
+    """ Base class of the sinks.
+
+    A sink is opened, the outputs are given to :func:`write` (maybe many
+    times), and then it is closed. Sub classes implement :func:`_write` (and
+    usualy :func:`open` and :func:`close`).
+    """
+    #: whether the sink should be written by the workers of a
+    #: :class:`.ReliurePool` (else the outputs are sent to the parent process)
+    sharded = False
+
+    def __init__(self):
+        #: number of outputs written
+        self.count = 0
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def open(self, nshards=1):
+        """ Open the sink
+
+        :param nshards: number of shards (for the sharded sinks)
+        """
+        pass
+
+    def write(self, outputs):
+        """ Write some outputs, returns the number of outputs written
+
+        :param outputs: an iterable of outputs (it is consumed lazily)
+        """
+        count = 0
+        for output in outputs:
+            self._write(output)
+            count += 1
+        self.count += count
+        return count
+
+    def _write(self, output):
+        raise NotImplementedError
+
+    def flush(self):
+        """ Write the buffered outputs
+        """
+        pass
+
+    def close(self):
+        """ Close the sink (flush the buffered outputs)
+        """
+        pass
+
+
+class JsonLinesSink(Sink):
+    """ Writes the outputs in a file, one JSON document by line.
+
+    The lines are buffered and written by batches of `buffer_size`. If the
+    path ends with `.gz` (or if `compress="gzip"`) the file is gzip
+    compressed:
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "out.jsonl.gz")
+    >>> with JsonLinesSink(path) as sink:
+    ...     sink.write(range(3))
+    3
+    >>> gzip.open(path).read()
+    b'0\\n1\\n2\\n'
+
+    Any line oriented format may be written with an other `dumps` function
+    (that returns a line, without the end of line).
+    """
+    def __init__(self, path, compress=None, append=False, buffer_size=1000, dumps=None, compresslevel=6):
+        """
+        :param path: path of the file
+        :param compress: None or "gzip" (default from the path extension)
+        :param append: whether the outputs are appended to the file (else it
+            is overwritten)
+        :param buffer_size: number of lines written at once
+        :param dumps: function that serializes an output (default
+            :func:`json.dumps`)
+        :param compresslevel: gzip compression level
+        """
+        super(JsonLinesSink, self).__init__()
+        if compress is None and path.endswith(".gz"):
+            compress = "gzip"
+        if compress not in (None, "gzip"):
+            raise ValueError("Invalid compression '%s' (should be None or 'gzip')" % compress)
+        self.path = path
+        self.compress = compress
+        self.append = append
+        self.buffer_size = buffer_size
+        self.dumps = dumps or json.dumps
+        self.compresslevel = compresslevel
+        self._file = None
+        self._buffer = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_file"] = None
+        state["_buffer"] = []
+        return state
+
+    def open(self, nshards=1):
+        mode = "ab" if self.append else "wb"
+        if self.compress == "gzip":
+            self._file = gzip.open(self.path, mode, compresslevel=self.compresslevel)
+        else:
+            self._file = io.open(self.path, mode)
+        self._buffer = []
+
+    def _write(self, output):
+        self._buffer.append(self.dumps(output))
+        if len(self._buffer) >= self.buffer_size:
+            self._write_buffer()
+
+    def _write_buffer(self):
+        if self._buffer:
+            self._file.write((u"\n".join(self._buffer) + u"\n").encode("utf8"))
+            self._buffer = []
+
+    def flush(self):
+        self._write_buffer()
+        self._file.flush()
+
+    def close(self):
+        if self._file is None:
+            return
+        try:
+            self._write_buffer()
+        finally:
+            self._file.close()
+            self._file = None
+
+
+class ShardedSink(Sink):
+    """ Writes the outputs in many JSON lines files, one by worker of a
+    :class:`.ReliurePool`: each worker writes its outputs itself (they are not
+    sent to the parent process), the order of the outputs is then lost.
+
+    >>> import os, tempfile
+    >>> pattern = os.path.join(tempfile.mkdtemp(), "out-{shard:03d}.jsonl")
+    >>> sink = ShardedSink(pattern)
+    >>> os.path.basename(sink.path(2))
+    'out-002.jsonl'
+
+    Each worker appends the outputs of each chunk to its shard (the shards
+    are emptied by :func:`open`, unless `append` is True). Gzip compressed
+    shards (see :class:`JsonLinesSink`) are then made of one gzip member by
+    chunk, that is a valid gzip file.
+    """
+    sharded = True
+
+    def __init__(self, pattern, compress=None, append=False, buffer_size=1000, dumps=None, compresslevel=6):
+        """
+        :param pattern: path of the shards, formated with the shard number
+            `shard` (ex: "out-{shard:03d}.jsonl.gz")
+        :param compress: None or "gzip" (default from the path extension)
+        :param append: whether the outputs are appended to the existing
+            shards (to resume a run for ex.)
+        :param buffer_size: number of lines written at once
+        :param dumps: function that serializes an output (default
+            :func:`json.dumps`)
+        :param compresslevel: gzip compression level
+        """
+        super(ShardedSink, self).__init__()
+        if pattern.format(shard=0) == pattern.format(shard=1):
+            raise ValueError("The pattern should contain '{shard}'")
+        self.pattern = pattern
+        self.append = append
+        self._options = dict(compress=compress, buffer_size=buffer_size, dumps=dumps,
+                             compresslevel=compresslevel)
+
+    def path(self, shard):
+        """ Path of a shard
+        """
+        return self.pattern.format(shard=shard)
+
+    def open(self, nshards=1):
+        #: paths of the shards
+        self.paths = [self.path(shard) for shard in range(nshards)]
+        for path in self.paths:
+            io.open(path, "ab" if self.append else "wb").close()
+
+    def shard(self, shard):
+        """ Returns the :class:`JsonLinesSink` of a shard (in append mode)
+        """
+        return JsonLinesSink(self.path(shard), append=True, **self._options)
+
+    def write_shard(self, shard, outputs):
+        """ Write some outputs in a shard, returns the number of outputs
+        written
+        """
+        with self.shard(shard) as sink:
+            count = sink.write(outputs)
+        self.count += count
+        return count
+
+    def write(self, outputs):
+        return self.write_shard(0, outputs)
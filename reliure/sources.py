@@ -0,0 +1,136 @@
+#-*- coding:utf-8 -*-
+""" :mod:`reliure.sources`
+========================
+
+Inputs sources for offline runs (see :func:`.offline.run_parallel`): a big
+file is split in byte ranges that are read by the workers themselves, the
+parent process only hands out the offsets.
+
+>>> import os, tempfile
+>>> path = os.path.join(tempfile.mkdtemp(), "in.txt")
+>>> with open(path, "w") as infile:
+...     _ = infile.write("one\\ntwo\\nthree\\nfour\\n")
+>>> source = FileSource(path, split_size=6)
+>>> list(source)
+['one', 'two', 'three', 'four']
+>>> [split.read() for split in source.splits()]
+[['one', 'two'], ['three'], ['four']]
+"""
+import io
+import os
+import mmap
+
+
+#: memory maps opened by the current process (path -> mmap)
+_MMAPS = {}
+
+def _get_mmap(path):
+    """ Returns a (cached) read only memory map of a file
+    """
+    mapped = _MMAPS.get(path)
+    if mapped is None or mapped.closed:
+        with io.open(path, "rb") as infile:
+            mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        _MMAPS[path] = mapped
+    return mapped
+
+
+class FileSource(object):
+    """ A line oriented file (one record by line) split in byte ranges
+    aligned on the lines.
+
+    Each record is given to `parse` (default: decoded as a string, without
+    the end of line):
+
+    >>> import json, os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "in.jsonl")
+    >>> with open(path, "w") as infile:
+    ...     _ = infile.write('{"id": 1}\\n{"id": 2}\\n')
+    >>> [doc["id"] for doc in FileSource(path, parse=json.loads)]
+    [1, 2]
+
+    With `use_mmap=True` the ranges are read from a memory map of the file
+    (shared by the tasks of a worker) instead of file reads.
+    """
+    def __init__(self, path, split_size=2**20, parse=None, encoding="utf8", use_mmap=False):
+        """
+        :param path: path of the file
+        :param split_size: approximate size (in bytes) of the ranges
+        :param parse: function called on each record (a byte string, without
+            the end of line), default is to decode it
+        :param encoding: encoding of the records (for the default `parse`)
+        :param use_mmap: whether the file is memory mapped
+        """
+        if split_size < 1:
+            raise ValueError("split_size should be a positive integer")
+        self.path = path
+        self.split_size = split_size
+        self.parse = parse
+        self.encoding = encoding
+        self.use_mmap = use_mmap
+
+    def _records(self, data):
+        lines = data.split(b"\n")
+        if lines and not lines[-1]:
+            lines.pop()
+        if self.parse is not None:
+            return [self.parse(line) for line in lines]
+        return [line.decode(self.encoding) for line in lines]
+
+    def __iter__(self):
+        for split in self.splits():
+            for record in split.read():
+                yield record
+
+    def splits(self):
+        """ Yields the :class:`FileSplit` of the file, each one ends at the
+        end of a line (only some seeks are made)
+        """
+        size = os.path.getsize(self.path)
+        with io.open(self.path, "rb") as infile:
+            start = 0
+            while start < size:
+                end = start + self.split_size
+                if end >= size:
+                    end = size
+                else:
+                    # go to the end of the current line
+                    infile.seek(end - 1)
+                    infile.readline()
+                    end = min(infile.tell(), size)
+                yield FileSplit(self, start, end)
+                start = end
+
+    def read(self, start, end):
+        """ Returns the records between two offsets
+        """
+        if self.use_mmap:
+            data = _get_mmap(self.path)[start:end]
+        else:
+            with io.open(self.path, "rb") as infile:
+                infile.seek(start)
+                data = infile.read(end - start)
+        return self._records(data)
+
+
+class FileSplit(object):
+    """ A byte range of a :class:`FileSource`
+    """
+    def __init__(self, source, start, end):
+        self.source = source
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return "<FileSplit %s[%d:%d]>" % (self.source.path, self.start, self.end)
+
+    @property
+    def key(self):
+        """ Key of the range (for a :mod:`reliure.manifest`)
+        """
+        return "%s:%d:%d" % (self.source.path, self.start, self.end)
+
+    def read(self):
+        """ Returns the records of the range
+        """
+        return self.source.read(self.start, self.end)
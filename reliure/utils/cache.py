@@ -0,0 +1,204 @@
+#-*- coding:utf-8 -*-
+""" :mod:`reliure.utils.cache`
+============================
+
+Small in memory caches used by reliure (see :func:`.Block.setup`)
+"""
+import time
+import threading
+from collections import OrderedDict
+
+import six
+
+
+def make_key(*parts):
+    """ Build a hashable key from some values, lists, dicts and sets are
+    converted to hashable equivalents.
+
+    >>> make_key("comp", {"alpha": 2}, [12])
+    ('tuple', (('str', 'comp'), ('dict', ((('str', 'alpha'), ('int', 2)),)), ('list', (('int', 12),))))
+
+    The type of each value is part of the key, so values that are equal but
+    of different types have different keys:
+
+    >>> make_key(1) == make_key(True), make_key([1, 2]) == make_key((1, 2))
+    (False, False)
+
+    :raises TypeError: if a value can't be hashed
+    """
+    return _freeze(parts)
+
+def _freeze(value):
+    name = type(value).__name__
+    if isinstance(value, (list, tuple)):
+        return (name, tuple(_freeze(val) for val in value))
+    elif isinstance(value, dict):
+        return (name, tuple(sorted((_freeze(key), _freeze(val)) for key, val in six.iteritems(value))))
+    elif isinstance(value, (set, frozenset)):
+        return (name, frozenset(_freeze(val) for val in value))
+    hash(value)     # raises TypeError if not hashable
+    return (name, value)
+
+
+class LRU(object):
+    """ Thread safe "least recently used" cache, with an optional time to
+    live (in seconds).
+
+    >>> cache = LRU(maxsize=2)
+    >>> cache["a"] = 1
+    >>> cache["b"] = 2
+    >>> cache["a"]
+    1
+    >>> cache["c"] = 3      # "b" is the least recently used
+    >>> "b" in cache
+    False
+    >>> cache.get("b", 0)
+    0
+    >>> sorted(cache.stats().items())
+    [('hits', 1), ('maxsize', 2), ('misses', 1), ('size', 2)]
+
+    With a time to live, entries expire:
+
+    >>> cache = LRU(maxsize=10, ttl=0.01)
+    >>> cache["a"] = 1
+    >>> time.sleep(0.02)
+    >>> cache.get("a")
+
+    With a maximal size in bytes (the size of the values is given by
+    `sizeof`, default :func:`len`), the least recently used entries are
+    removed to keep the total size under `maxbytes`:
+
+    >>> cache = LRU(maxsize=None, maxbytes=10)
+    >>> cache["a"] = b"123456"
+    >>> cache["b"] = b"1234"
+    >>> cache["c"] = b"12"      # "a" is removed
+    >>> sorted(cache.keys()), cache.stats()["bytes"]
+    (['b', 'c'], 6)
+
+    .. note:: the cache content is not pickled (a copy of a cache is empty)
+    """
+    def __init__(self, maxsize=128, ttl=None, maxbytes=None, sizeof=len):
+        """
+        :param maxsize: maximal number of stored entries (no limit if None,
+            then `maxbytes` should be given)
+        :type maxsize: int
+        :param ttl: time to live of the entries (in seconds), no expiration if None
+        :type ttl: float
+        :param maxbytes: maximal total size of the stored values, no limit if
+            None
+        :type maxbytes: int
+        :param sizeof: function that returns the size of a value (used only
+            with `maxbytes`)
+        """
+        if maxsize is None and maxbytes is None:
+            raise ValueError("maxsize or maxbytes should be given")
+        if maxsize is not None and maxsize < 1:
+            raise ValueError("maxsize should be a positive integer")
+        if maxbytes is not None and maxbytes < 1:
+            raise ValueError("maxbytes should be a positive integer")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (expiration time, value, size)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_data"] = OrderedDict()
+        state["_bytes"] = 0
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def keys(self):
+        """ Returns the keys, from the least to the most recently used
+        """
+        with self._lock:
+            return list(self._data.keys())
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._lookup(key) is not None
+
+    def _lookup(self, key):
+        """ Returns the `(expiration, value, size)` entry or None (the lock
+        should be acquired)
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] < time.time():
+            self._remove(key)
+            return None
+        return entry
+
+    def _remove(self, key):
+        """ Remove an entry (the lock should be acquired)
+        """
+        self._bytes -= self._data.pop(key)[2]
+
+    def __getitem__(self, key):
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is None:
+                self.misses += 1
+                raise KeyError(key)
+            self.hits += 1
+            # move the entry at the end (most recently used)
+            del self._data[key]
+            self._data[key] = entry
+            return entry[1]
+
+    def get(self, key, default=None):
+        """ Returns the value stored for `key` or `default`
+        """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        expiration = None if self.ttl is None else time.time() + self.ttl
+        size = 0 if self.maxbytes is None else self.sizeof(value)
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            if self.maxbytes is not None and size > self.maxbytes:
+                return  # too big to be stored
+            self._data[key] = (expiration, value, size)
+            self._bytes += size
+            while (self.maxsize is not None and len(self._data) > self.maxsize) \
+                    or (self.maxbytes is not None and self._bytes > self.maxbytes):
+                self._bytes -= self._data.popitem(last=False)[1][2]
+
+    def clear(self):
+        """ Remove all the entries (hit and miss counters are kept)
+        """
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """ Returns a dict with the hit and miss counters (and the total size
+        of the values if `maxbytes` is given)
+        """
+        stats = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
+        if self.maxbytes is not None:
+            stats["bytes"] = self._bytes
+            stats["maxbytes"] = self.maxbytes
+        return stats
@@ -12,19 +12,28 @@ import logging
 import six
 
 from collections import OrderedDict
+from six.moves import collections_abc
 
 from flask import Flask, Blueprint
-from flask import abort, request, jsonify
+from flask import abort, request, jsonify, Response
 
 from reliure import Composable
 from reliure.types import GenericType, Text
-from reliure.exceptions import ReliurePlayError
-from reliure.engine import Engine, Block
+from reliure.exceptions import ReliurePlayError, ValidationError
+from reliure.engine import Engine, Block, PlayConfig
+from reliure.utils.cache import make_key
+from reliure.serializers import JsonSerializer, default_serializers, negotiate
 
 # for error code see http://fr.wikipedia.org/wiki/Liste_des_codes_HTTP#Erreur_du_client
 
 __all__ = ["app_routes", "EngineView", "ComponentView", "ReliureAPI", "RemoteApi"]
 
+#: content types of the streamed responses (see :func:`EngineView.stream`)
+STREAM_TYPES = OrderedDict([
+    ("ndjson", "application/x-ndjson"),
+    ("sse", "text/event-stream"),
+])
+
 def app_routes(app):
     """ list of route of an app
     """
@@ -70,6 +79,81 @@ class EngineView(object):
         self._inputs = OrderedDict()
         # default outputs
         self._outputs = OrderedDict()
+        # optional batch scheduler
+        self.scheduler = None
+        # optional responses cache
+        self.cache = None
+        # responses serializers (chosen with the Accept header)
+        self.serializers = default_serializers()
+
+    def set_scheduler(self, scheduler):
+        """ Play the engine through a :class:`.BatchScheduler`, concurrent
+        requests are then played by batches.
+
+        >>> from reliure.scheduler import BatchScheduler
+        >>> engine = Engine("op")
+        >>> engine.op.setup(in_name="in")
+        >>> engine.op.set(lambda x: x * 2)
+        >>> view = EngineView(engine)
+        >>> view.set_scheduler(BatchScheduler(engine, max_batch_size=64, max_wait=5))
+
+        :param scheduler: the :class:`.BatchScheduler` to use, or None to
+            play the engine directly
+        """
+        if scheduler is not None and scheduler.engine is not self.engine:
+            raise ValueError("The scheduler should be build over the view's engine")
+        self.scheduler = scheduler
+
+    def set_cache(self, cache):
+        """ Cache the responses of the plays: a request with the same inputs
+        (once parsed) and the same configuration than a previous one gets
+        the same serialized response, without playing the engine.
+
+        >>> from reliure.utils.cache import LRU
+        >>> engine = Engine("op")
+        >>> engine.op.setup(in_name="in")
+        >>> engine.op.set(lambda x: x * 2)
+        >>> view = EngineView(engine)
+        >>> view.add_input("in")
+        >>> view.add_output("op")
+        >>> view.set_cache(LRU(maxsize=None, maxbytes=2**20, ttl=60))
+        >>> response = view.play_cached({"in": "ab"}, {})
+        >>> json.loads(response.decode("utf8"))["results"]
+        {'op': 'abab'}
+        >>> view.play_cached({"in": "ab"}, {}) is response
+        True
+        >>> view.cache.stats()["hits"], view.cache.stats()["misses"]
+        (1, 1)
+
+        Plays that failed are not cached. The counters are also given by the
+        engine options (see :func:`options`).
+
+        :param cache: the :class:`.LRU` cache of the responses, or None to
+            remove it
+        """
+        self.cache = cache
+
+    def set_serializers(self, *serializers):
+        """ Set the serializers of the play responses, the one used is chosen
+        according to the `Accept` header of the request (the first one by
+        default), see :mod:`reliure.serializers`.
+
+        >>> from reliure.serializers import JsonSerializer
+        >>> view = EngineView(Engine("op"))
+        >>> view.set_serializers(JsonSerializer(use_orjson=False))
+        >>> view.serializer("application/msgpack").content_type
+        'application/json'
+        """
+        if not serializers:
+            raise ValueError("At least one serializer is needed")
+        self.serializers = list(serializers)
+
+    def serializer(self, accept=None):
+        """ Returns the serializer to use for a request
+
+        :param accept: the `Accept` header of the request
+        """
+        return negotiate(accept, self.serializers)
 
     def set_input_type(self, type_or_parse):
         """ Set an unique input type.
@@ -137,10 +221,13 @@ class EngineView(object):
         """
         self._short_routes = routes
 
-    def _config_from_url(self):
+    def _config_from_url(self, args=None):
         """ Manage block configuration from requests.args (url params)
         
         May be overriden
+
+        :param args: the url params (default to the current flask request
+            ones)
         """
         self._logger.warn("_config_from_url not yet implemented for EngineView")
         return {}
@@ -178,15 +265,56 @@ class EngineView(object):
         :param inputs_data: dict of input data
         :param options: engine/block configuration dict
         """
+        config, inputs = self.prepare_play(inputs_data, options)
+        return self._run(config, inputs)
+
+    def _run(self, config, inputs):
+        """ Play the engine with a configuration and parsed inputs, returns the
+        outputs (see :func:`format_outputs`)
+        """
+        player = self.engine if self.scheduler is None else self.scheduler
+        raw_res = None
+        try:
+            # only the blocks needed for the view outputs are run
+            raw_res = player.play(config=config, outputs=list(self._outputs), **inputs)
+        except ReliurePlayError as err:
+            # this is the Reliure error that we can handle
+            pass
+        return self.format_outputs(raw_res, player.meta)
+
+    def prepare_play(self, inputs_data, options):
+        """ Returns the play configuration and the parsed inputs from the
+        inputs data and options of a request (see :func:`run`)
+        """
         ### configure the engine
+        # note: the engine itself is not modified, so it may serve concurrent requests
         try:
-            self.engine.configure(options)
+            config = self.engine.play_config(options)
         except ValueError as err:
             raise
             abort(406, err)  # Not Acceptable
+        needed_inputs = self.engine.needed_inputs(config)
+        return config, self._parse_inputs(inputs_data, needed_inputs)
 
+    def prepare_batch(self, inputs_list, options):
+        """ Returns the play configuration and the list of the parsed inputs
+        of a batch request (see :func:`run_batch`), the engine is configured
+        once and all the inputs are validated before any play.
+        """
+        config = self.engine.play_config(options)
+        needed_inputs = self.engine.needed_inputs(config)
+        parsed = []
+        for inputs_data in inputs_list:
+            if not isinstance(inputs_data, dict):
+                raise ValueError("The batch inputs should be a list of objects")
+            parsed.append(self._parse_inputs(dict(inputs_data), needed_inputs))
+        return config, parsed
+
+    def _parse_inputs(self, inputs_data, needed_inputs):
+        """ Returns the parsed (and validated) inputs from the inputs data of
+        a request
+        """
         ### Check inputs
-        needed_inputs = self.engine.needed_inputs()
         # add default
         for inname in needed_inputs:
             #print(inname)
@@ -211,42 +339,202 @@ class EngineView(object):
             input_val = self._inputs[inname].parse(inputs_data[inname])
             self._inputs[inname].validate(input_val)
             inputs[inname] = input_val
-        #
-        ### run the engine
-        error = False # by default ok
+        return inputs
+
+    def run_batch(self, inputs_list, options):
+        """ Run the engine/block over a list of inputs data with the same
+        options (see :func:`run`)
+
+        >>> engine = Engine("op")
+        >>> engine.op.setup(in_name="in")
+        >>> engine.op.set(lambda x: x * 2)
+        >>> view = EngineView(engine)
+        >>> view.set_input_type(Text())
+        >>> view.add_output("op")
+        >>> outputs = view.run_batch([{"in": "a"}, {"in": "b"}], {})
+        >>> outputs["results"]
+        [{'op': 'aa'}, {'op': 'bb'}]
+
+        The engine is played once over the whole batch (see
+        :func:`.Engine.play_batch`), so the components that have a
+        `batch_call` method are called once. Meta data are aggregated for the
+        whole batch.
+
+        :param inputs_list: list of dict of input data
+        :param options: engine/block configuration dict
+        """
+        config, inputs_list = self.prepare_batch(inputs_list, options)
+        outputs = list(self._outputs)
+        raw_res = None
         try:
-            raw_res = self.engine.play(**inputs)
+            if isinstance(self.engine, Engine):
+                raw_res = self.engine.play_batch(inputs_list, config=config, outputs=outputs)
+            else:
+                # a block takes the inputs as columns
+                in_names = self.engine.needed_inputs(config)
+                columns = [[inputs[name] for inputs in inputs_list] for name in in_names]
+                block_res = self.engine.play_batch(*columns, config=config, outputs=outputs)
+                raw_res = [dict((name, column[num]) for name, column in six.iteritems(block_res))
+                           for num in range(len(inputs_list))]
         except ReliurePlayError as err:
-            # this is the Reliure error that we can handle
-            error = True
-        finally:
             pass
-        #
-        ### prepare outputs
+        return {
+            "results": None if raw_res is None else [self._serialize(res) for res in raw_res],
+            "meta": self.engine.meta.as_dict(),
+        }
+
+    def format_outputs(self, raw_res, meta):
+        """ Returns the response of a play (serialized results and meta data)
+
+        :param raw_res: the results of the play (None if it failed)
+        :param meta: the :class:`.PlayMeta` of the play
+        """
         outputs = {}
         results = {}
-        if not error:
-            # prepare the outputs
-            for out_name, raw_out in six.iteritems(raw_res):
-                if out_name not in self._outputs:
-                    continue
-                serializer = self._outputs[out_name]['serializer']
-                params = self._outputs[out_name].get('parameters', {})
-                # serialise output
-                if serializer is not None:
-                    results[out_name] = serializer.serialize(raw_res[out_name], **params)
-                else:
-                    results[out_name] = raw_res[out_name]
+        if raw_res is not None:
+            results = self._serialize(raw_res)
         ### prepare the retourning json
         # add the results
         outputs["results"] = results
         ### serialise play metadata
-        outputs['meta'] = self.engine.meta.as_dict()
+        outputs['meta'] = meta.as_dict()
         #note: meta contains the error (if any)
         return outputs
 
-    def options(self):
-        """ Engine options discover HTTP entry point
+    def stream(self, inputs_data, options, fmt="ndjson"):
+        """ Run the engine/block (see :func:`run`) and returns a generator of
+        the response chunks (bytes), the outputs that are iterators
+        (generators for ex.) are streamed item by item:
+
+        >>> engine = Engine("rank")
+        >>> engine.rank.setup(in_name="in")
+        >>> engine.rank.set(lambda text: (word for word in sorted(text.split())))
+        >>> view = EngineView(engine)
+        >>> view.set_input_type(Text())
+        >>> view.add_output("rank")
+        >>> chunks = list(view.stream({"in": "b c a"}, {}))
+        >>> for chunk in chunks[:-1]:
+        ...     print(chunk.decode("utf8").strip())
+        {"output":"rank","item":"a"}
+        {"output":"rank","item":"b"}
+        {"output":"rank","item":"c"}
+        >>> sorted(json.loads(chunks[-1].decode("utf8"))["meta"])
+        ['details', 'errors', 'name', 'time', 'warnings']
+
+        The other outputs are given in one chunk (`{"output": ..., "value":
+        ...}`), and the play meta data are in the last chunk. If a streamed
+        output fails, an `{"error": ...}` chunk is sent before the meta data.
+
+        The engine is played before this returns (so errors in the
+        configuration or in the inputs are raised), but the streamed outputs
+        are consumed while the response is sent.
+
+        .. note:: the serializer of a streamed output is called on each item
+
+        :param inputs_data: dict of input data
+        :param options: engine/block configuration dict
+        :param fmt: format of the chunks: "ndjson" (one JSON document by
+            line) or "sse" (server-sent events)
+        """
+        if fmt not in STREAM_TYPES:
+            raise ValueError("Invalid stream format '%s'" % fmt)
+        config, inputs = self.prepare_play(inputs_data, options)
+        player = self.engine if self.scheduler is None else self.scheduler
+        raw_res = None
+        try:
+            raw_res = player.play(config=config, outputs=list(self._outputs), **inputs)
+        except ReliurePlayError as err:
+            pass
+        return self.stream_outputs(raw_res, player.meta, fmt)
+
+    def stream_outputs(self, raw_res, meta, fmt="ndjson"):
+        """ Generator of the response chunks of a play (see :func:`stream`)
+
+        :param raw_res: the results of the play (None if it failed)
+        :param meta: the :class:`.PlayMeta` of the play
+        :param fmt: "ndjson" or "sse"
+        """
+        if raw_res is not None:
+            try:
+                for out_name, output in six.iteritems(self._outputs):
+                    if out_name not in raw_res:
+                        continue
+                    raw_out = raw_res[out_name]
+                    serializer = output['serializer']
+                    params = output.get('parameters', {})
+                    if isinstance(raw_out, collections_abc.Iterator):
+                        for item in raw_out:
+                            item = serializer.serialize(item, **params)
+                            yield _stream_chunk(fmt, "item", {"output": out_name, "item": item})
+                    else:
+                        value = serializer.serialize(raw_out, **params)
+                        yield _stream_chunk(fmt, "value", {"output": out_name, "value": value})
+            except Exception as err:
+                self._logger.error("error while streaming the outputs: %s" % err, exc_info=True)
+                yield _stream_chunk(fmt, "error", {"error": str(err)})
+        yield _stream_chunk(fmt, "meta", {"meta": meta.as_dict()})
+
+    def _serialize(self, raw_res):
+        """ Returns the serialized outputs of the view from the results of a
+        play
+        """
+        results = {}
+        for out_name, raw_out in six.iteritems(raw_res):
+            if out_name not in self._outputs:
+                continue
+            serializer = self._outputs[out_name]['serializer']
+            params = self._outputs[out_name].get('parameters', {})
+            # serialise output
+            if serializer is not None:
+                results[out_name] = serializer.serialize(raw_out, **params)
+            else:
+                results[out_name] = raw_out
+        return results
+
+    def play_cached(self, inputs_data, options, serializer=None):
+        """ Same as :func:`run` but returns the serialized response, from the
+        cache if any (see :func:`set_cache`)
+
+        :param serializer: the serializer of the response (default is the
+            first one of the view)
+        """
+        config, inputs = self.prepare_play(inputs_data, options)
+        key, response = self.cache_lookup(config, inputs, serializer)
+        if response is None:
+            response = self.cache_store(key, self._run(config, inputs), serializer)
+        return response
+
+    def cache_key(self, config, inputs):
+        """ Returns the key of a play in the responses cache
+
+        :raises TypeError: if the inputs can't be hashed
+        """
+        return (_freeze_config(config), make_key(inputs))
+
+    def cache_lookup(self, config, inputs, serializer=None):
+        """ Returns the cache key of a play and the cached response (None if
+        not found or not cached)
+        """
+        if self.cache is None:
+            return None, None
+        serializer = serializer or self.serializers[0]
+        try:
+            key = (serializer.content_type, self.cache_key(config, inputs))
+        except TypeError:
+            return None, None
+        return key, self.cache.get(key)
+
+    def cache_store(self, key, outputs, serializer=None):
+        """ Serializes the outputs of a play, and stores them in the cache
+        (if the play did not fail)
+        """
+        response = (serializer or self.serializers[0]).dumps(outputs)
+        if key is not None and self.cache is not None and not outputs["meta"]["errors"]:
+            self.cache[key] = response
+        return response
+
+    def options_dict(self):
+        """ Returns the description of the engine (see :func:`options`)
         """
         #configure engine with an empty dict to ensure default selection/options
         self.engine.configure({})
@@ -254,23 +542,103 @@ class EngineView(object):
         conf["returns"] = [oname for oname in six.iterkeys(self._outputs)]
         # Note: we overide args to only list the ones that are declared in this view
         conf["args"] = [iname for iname in six.iterkeys(self._inputs)]
-        return jsonify(conf)
+        if self.cache is not None:
+            conf["cache"] = self.cache.stats()
+        return conf
+
+    def options(self):
+        """ Engine options discover HTTP entry point
+        """
+        return jsonify(self.options_dict())
 
     def play(self):
         """ Main http entry point: run the engine
         """
         data, options = self.parse_request()
         #warning: 'data' are the raw data from the client, not the de-serialised ones
-        outputs = self.run(data, options)
-        return jsonify(outputs)
+        return self._play_response(data, options)
+
+    def _play_response(self, inputs_data, options):
+        """ Play the engine and returns the serialized response
+        """
+        serializer = self.serializer(request.headers.get("Accept"))
+        if self.cache is not None:
+            response = self.play_cached(inputs_data, options, serializer)
+        else:
+            response = serializer.dumps(self.run(inputs_data, options))
+        return Response(response, mimetype=serializer.content_type)
+
+    @staticmethod
+    def parse_batch(data):
+        """ Returns the inputs list and the options of a batch request data:
+        `{"inputs": [{...}, ...], "options": {...}}`
+        """
+        if not isinstance(data, dict) or not isinstance(data.get("inputs"), list):
+            raise ValueError("A batch request should be an object with a list of 'inputs'")
+        return data["inputs"], data.get("options", {})
+
+    def play_batch(self):
+        """ Batch http entry point: run the engine over a list of inputs
+        (JSON only)
+        """
+        try:
+            inputs_list, options = self.parse_batch(request.get_json(silent=True))
+        except ValueError as err:
+            abort(400, str(err))    # Bad Request
+        try:
+            outputs = self.run_batch(inputs_list, options)
+        except (ValueError, ValidationError) as err:
+            # invalid inputs or options
+            abort(400, str(err))
+        serializer = self.serializer(request.headers.get("Accept"))
+        return Response(serializer.dumps(outputs), mimetype=serializer.content_type)
+
+    def play_stream(self):
+        """ Streaming http entry point: run the engine and stream the outputs
+        (see :func:`stream`), as NDJSON or as server-sent events if the
+        request accepts `text/event-stream`
+        """
+        data, options = self.parse_request()
+        fmt = self.stream_format(request.headers.get("Accept", ""))
+        chunks = self.stream(data, options, fmt)
+        return Response(chunks, mimetype=STREAM_TYPES[fmt], headers=STREAM_HEADERS)
+
+    @staticmethod
+    def stream_format(accept):
+        """ Returns the stream format ("ndjson" or "sse") from the `Accept`
+        header of a request
+        """
+        return "sse" if STREAM_TYPES["sse"] in accept else "ndjson"
 
     def short_play(self, **kwargs):
         """ Main http entry point: run the engine
         """
         # options in URL arguments
         config = self._config_from_url()
-        outputs = self.run(kwargs, config)
-        return jsonify(outputs)
+        return self._play_response(kwargs, config)
+
+
+#: headers of the streamed responses (no caching nor buffering by proxies)
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+_STREAM_SERIALIZER = JsonSerializer()
+
+def _stream_chunk(fmt, event, data):
+    """ Returns a chunk of a streamed response (see :func:`EngineView.stream`)
+    """
+    data = _STREAM_SERIALIZER.dumps(data)
+    if fmt == "sse":
+        return b"event: " + event.encode("utf8") + b"\ndata: " + data + b"\n\n"
+    return data + b"\n"
+
+
+def _freeze_config(config):
+    """ Hashable version of a :class:`.PlayConfig` (the order of the
+    components matters, not the order of the options)
+    """
+    if isinstance(config, PlayConfig):
+        return tuple((name, _freeze_config(value)) for name, value in six.iteritems(config))
+    return make_key(config)
 
 
 class ComponentView(EngineView):
@@ -303,14 +671,16 @@ class ComponentView(EngineView):
         #XXX: attention il faut interdire les multi output
         super(ComponentView, self).add_output(out_name, type_or_serialize, **kwargs)
 
-    def _config_from_url(self):
+    def _config_from_url(self, args=None):
         """ Manage block configuration from requests.args (url params)
         """
         config = {
             "name": self._blk.name,
             "options": {}
         }
-        for key, value in six.iteritems(request.args):
+        if args is None:
+            args = request.args
+        for key, value in six.iteritems(args):
             if isinstance(value, list) and len(value) == 1:
                 config["options"][key] = value[0]
             else:
@@ -351,6 +721,8 @@ class ReliureAPI(Blueprint):
     - [GET] /api/: returns a json that desctibe your api routes
     - [GET] /api/egn: returns a json that desctibe your engine
     - [POST] /api/egn: run the engine itself
+    - [POST] /api/egn/play_batch: run the engine over a list of inputs
+    - [POST] /api/egn/play_stream: run the engine and stream its outputs
 
     To use the "POST" entry point you can do :
 
@@ -405,6 +777,8 @@ class ReliureAPI(Blueprint):
         # url
         self.add_url_rule('/%s/options' % url_prefix, '%s_options_OLD' % url_prefix, view.options, methods=["GET"])
         self.add_url_rule('/%s/play' % url_prefix, '%s_OLD' % url_prefix, view.play, methods=["POST"])
+        self.add_url_rule('/%s/play_batch' % url_prefix, '%s_play_batch' % url_prefix, view.play_batch, methods=["POST"])
+        self.add_url_rule('/%s/play_stream' % url_prefix, '%s_play_stream' % url_prefix, view.play_stream, methods=["POST"])
 
         # manage short route
         for route in view._short_routes:
@@ -512,21 +886,23 @@ class RemoteApi(Blueprint):
         path = path[len(prefix):]
         url = '%s%s'% ( self.url_root[:-1], path )
 
+        # the response is given as is (in the format negotiated by the remote api)
+        headers = {}
+        if "Accept" in request.headers:
+            headers["Accept"] = request.headers["Accept"]
         if request.method == 'GET':
-            resp = requests.get(url, params=request.args)
-            data = json.loads(resp.content)
+            resp = requests.get(url, params=request.args, headers=headers)
         elif request.method == 'POST':
             if request.headers['Content-Type'].startswith('application/json'):
-                # data in JSON
-                resp = requests.post(url, json=request.json)
-                data = request.json
+                # data in JSON, forwarded without decoding
+                headers["Content-Type"] = request.headers['Content-Type']
+                resp = requests.post(url, data=request.get_data(), headers=headers)
             else :
-                resp = requests.post(url, json=request.form)
-                data = request.form
-            data = json.loads(resp.content)
+                resp = requests.post(url, json=request.form, headers=headers)
         else:
             # method not allowed aborting
             abort(405) # XXX
 
-        return jsonify(data)
+        content_type = resp.headers.get("Content-Type", "application/json")
+        return Response(resp.content, status=resp.status_code, content_type=content_type)
 
@@ -25,6 +25,6 @@ setup(
         "Topic :: Scientific/Engineering",
         "Topic :: Software Development :: Libraries :: Application Frameworks",
     ],
-    install_requires=['six'],
+    install_requires=['six', 'futures; python_version < "3.0"'],
 )
 
@@ -0,0 +1,100 @@
+#-*- coding:utf-8 -*-
+import time
+import asyncio
+import unittest
+
+from reliure import Composable, Optionable
+from reliure.types import Numeric
+from reliure.pipeline import MapSeq
+from reliure.engine import Block, Engine
+from reliure.aio import is_async, call
+
+
+class AsyncMult(Optionable):
+    def __init__(self):
+        super(AsyncMult, self).__init__("amult")
+        self.add_option("factor", Numeric(default=5, vtype=int))
+
+    @Optionable.check
+    async def __call__(self, arg, factor=None):
+        await asyncio.sleep(0.01)
+        return arg * factor
+
+
+async def slow_double(arg):
+    await asyncio.sleep(0.05)
+    return arg * 2
+
+
+class TestAio(unittest.TestCase):
+
+    def test_is_async(self):
+        assert is_async(AsyncMult())
+        assert is_async(slow_double)
+        assert is_async(Composable(slow_double))
+        assert not is_async(Composable(len))
+        assert not is_async(Composable(len) | Composable(len))
+
+    def test_call(self):
+        pipeline = Composable(lambda x: x + 1) | AsyncMult() | Composable(lambda x: x - 1)
+        assert asyncio.run(call(pipeline, 1)) == 9
+        assert asyncio.run(call(pipeline, 1, factor=2)) == 3
+        with self.assertRaises(ValueError):
+            asyncio.run(call(pipeline, 1, other=2))
+        mapseq = MapSeq(slow_double, lambda x: x + 1, AsyncMult())
+        assert asyncio.run(call(mapseq, 3)) == [6, 4, 15]
+        # a sync component is run in an executor
+        assert asyncio.run(call(len, [1, 2])) == 2
+
+    def test_block(self):
+        block = Block("mult")
+        block.set(AsyncMult())
+        assert asyncio.run(block.play_async(2)) == {"mult": 10}
+        config = block.play_config([{"name": "amult", "options": {"factor": 3}}])
+        assert asyncio.run(block.play_async(2, config=config)) == {"mult": 6}
+        assert block.meta.name == "mult:[amult]"
+        # the component is not modified
+        assert block["amult"].get_option_value("factor") == 5
+
+    def test_engine(self):
+        engine = Engine("op1", "op2", "op3", "op4")
+        engine.op1.setup(in_name="in", out_name="left")
+        engine.op2.setup(in_name="in", out_name="right")
+        engine.op3.setup(in_name=["left", "right"], out_name="sum")
+        engine.op4.setup(in_name="in", out_name="other")
+        engine.op1.set(slow_double)
+        engine.op2.set(slow_double)
+        engine.op3.set(lambda x, y: x + y)
+        engine.op4.set(AsyncMult())
+        results = asyncio.run(engine.play_async(3))
+        assert dict(results) == {"in": 3, "left": 6, "right": 6, "sum": 12, "other": 15}
+        assert [meta.name for meta in engine.meta] == [
+            "op1:[slow_double]", "op2:[slow_double]", "op3:[<lambda>]", "op4:[amult]"
+        ]
+        # plays are concurrent
+        async def main():
+            return await asyncio.gather(*[engine.play_async(num) for num in range(20)])
+        start = time.time()
+        results = asyncio.run(main())
+        assert time.time() - start < 0.5
+        assert [res["sum"] for res in results] == [num * 4 for num in range(20)]
+        # outputs and configuration
+        config = {"op4": [{"name": "amult", "options": {"factor": 2}}]}
+        results = asyncio.run(engine.play_async(3, config=config, outputs=["other"]))
+        assert dict(results) == {"in": 3, "other": 6}
+
+    def test_engine_error(self):
+        async def fail(arg):
+            raise RuntimeError("failed")
+        engine = Engine("op1", "op2", "op3")
+        engine.op1.setup(in_name="in", out_name="middle")
+        engine.op2.setup(in_name="middle", out_name="out")
+        engine.op3.setup(in_name="in", out_name="other")
+        engine.op1.set(fail)
+        engine.op2.set(slow_double)
+        engine.op3.set(slow_double)
+        with self.assertRaises(RuntimeError):
+            asyncio.run(engine.play_async(1))
+        # op2 is not run, op3 is
+        assert [meta.name for meta in engine.meta] == ["op1:[fail]", "op3:[slow_double]"]
+        assert engine.meta.has_error
@@ -0,0 +1,276 @@
+#-*- coding:utf-8 -*-
+import time
+import json
+import asyncio
+import unittest
+
+from reliure.pipeline import Optionable
+from reliure.engine import Engine
+from reliure.types import Numeric, Text
+from reliure.utils.cache import LRU
+from reliure.web import EngineView, ComponentView
+from reliure.asgi import ReliureASGI
+from reliure.serializers import Serializer, JsonSerializer
+
+
+class OptProductEx(Optionable):
+    def __init__(self, name="mult_opt"):
+        super(OptProductEx, self).__init__(name)
+        self.add_option("factor", Numeric(default=5, help="multipliation factor", vtype=int))
+
+    def __call__(self, arg, factor=5):
+        return arg * factor
+
+
+async def slow_double(arg):
+    await asyncio.sleep(0.1)
+    return arg * 2
+
+
+async def request(app, method, path, query=b"", body=b"", content_type=None, accept=None, raw=False):
+    """ Send a request to an ASGI app, returns the status and the json data
+    (or the response messages if `raw`)
+    """
+    headers = [(b"host", b"testserver")]
+    if content_type is not None:
+        headers.append((b"content-type", content_type.encode("latin1")))
+    if accept is not None:
+        headers.append((b"accept", accept.encode("latin1")))
+    scope = {"type": "http", "method": method, "path": path, "query_string": query,
+             "headers": headers}
+    received = []
+    messages = [{"type": "http.request", "body": body}]
+    async def receive():
+        return messages.pop(0)
+    async def send(message):
+        received.append(message)
+    await app(scope, receive, send)
+    assert received[0]["type"] == "http.response.start"
+    if raw:
+        return received
+    return received[0]["status"], json.loads(received[1]["body"].decode("utf8"))
+
+
+def call(app, *args, **kwargs):
+    return asyncio.run(request(app, *args, **kwargs))
+
+
+class TestReliureASGI(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = Engine("op1", "op2")
+        self.engine.op1.setup(in_name="in")
+        self.engine.op2.setup(out_name="out")
+        self.engine.op1.set(OptProductEx())
+        foisdouze = OptProductEx("foisdouze")
+        foisdouze.force_option_value("factor", 12)
+        self.engine.op2.set(foisdouze, OptProductEx())
+
+        egn_view = EngineView(self.engine)
+        egn_view.set_input_type(Numeric(vtype=int, min=-5, max=5))
+        egn_view.add_output("out")
+
+        comp_view = ComponentView(OptProductEx())
+        comp_view.add_input("number", Numeric(vtype=int))
+        comp_view.play_route("n/<int:number>")
+
+        self.app = ReliureASGI("api")
+        self.app.register_view(egn_view, url_prefix="egn")
+        self.app.register_view(comp_view)
+
+    def tearDown(self):
+        self.app.close()
+
+    def test_routes(self):
+        status, data = call(self.app, "GET", "/api/")
+        assert status == 200
+        assert data["api"] == "api"
+        assert data["url_root"] == "http://testserver/"
+        paths = set(route["path"] for route in data["routes"])
+        assert paths == set(["/api/", "/api/egn", "/api/egn/options", "/api/egn/play",
+                             "/api/egn/play_batch", "/api/egn/play_stream", "/api/mult_opt",
+                             "/api/mult_opt/options", "/api/mult_opt/play",
+                             "/api/mult_opt/play_batch", "/api/mult_opt/play_stream",
+                             "/api/mult_opt/n/<int:number>"])
+
+    def test_options(self):
+        status, data = call(self.app, "GET", "/api/egn")
+        assert status == 200
+        assert data["args"] == ["in"]
+        assert data["returns"] == ["out"]
+        assert [block["name"] for block in data["blocks"]] == ["op1", "op2"]
+        assert call(self.app, "GET", "/api/egn/options")[1] == data
+
+    def test_play(self):
+        body = json.dumps({"in": 2, "options": {}}).encode("utf8")
+        status, data = call(self.app, "POST", "/api/egn", body=body, content_type="application/json")
+        assert status == 200
+        assert data["results"] == {"out": 2 * 5 * 12}
+        assert [block["name"] for block in data["meta"]["details"]] == ["op1:[mult_opt]", "op2:[foisdouze]"]
+        # with options
+        options = {"op2": [{"name": "mult_opt", "options": {"factor": 2}}]}
+        body = json.dumps({"in": 2, "options": options}).encode("utf8")
+        status, data = call(self.app, "POST", "/api/egn/play", body=body, content_type="application/json")
+        assert data["results"] == {"out": 2 * 5 * 2}
+        # form data
+        status, data = call(self.app, "POST", "/api/egn", body=b"in=3",
+                            content_type="application/x-www-form-urlencoded")
+        assert data["results"] == {"out": 3 * 5 * 12}
+
+    def test_play_errors(self):
+        body = json.dumps({"in": 20}).encode("utf8")
+        status, data = call(self.app, "POST", "/api/egn", body=body, content_type="application/json")
+        assert status == 400
+        status, data = call(self.app, "POST", "/api/egn", body=b"{", content_type="application/json")
+        assert status == 400
+        assert call(self.app, "GET", "/api/nope")[0] == 404
+        assert call(self.app, "PUT", "/api/egn")[0] == 405
+
+    def test_play_batch(self):
+        body = json.dumps({"inputs": [{"in": 1}, {"in": 2}], "options": {}}).encode("utf8")
+        status, data = call(self.app, "POST", "/api/egn/play_batch", body=body,
+                            content_type="application/json")
+        assert status == 200
+        assert data["results"] == [{"out": 1 * 5 * 12}, {"out": 2 * 5 * 12}]
+        body = json.dumps({"inputs": [{"number": 1}, {"number": 2}],
+                           "options": {"name": "mult_opt", "options": {"factor": 3}}}).encode("utf8")
+        status, data = call(self.app, "POST", "/api/mult_opt/play_batch", body=body,
+                            content_type="application/json")
+        assert data["results"] == [{"mult_opt": 3}, {"mult_opt": 6}]
+        # invalid batches
+        body = json.dumps({"inputs": [{"in": 1}, {"in": 20}]}).encode("utf8")
+        assert call(self.app, "POST", "/api/egn/play_batch", body=body)[0] == 400
+        assert call(self.app, "POST", "/api/egn/play_batch", body=b'[1, 2]')[0] == 400
+
+    def test_play_stream(self):
+        def rank(text):
+            for word in sorted(text.split()):
+                yield word
+        async def count(text):
+            return len(text.split())
+        engine = Engine("rank", "count")
+        engine.rank.setup(in_name="in")
+        engine.rank.set(rank)
+        engine.count.setup(in_name="in")
+        engine.count.set(count)
+        view = EngineView(engine, "rank")
+        view.set_input_type(Text())
+        view.add_output("rank")
+        view.add_output("count")
+        app = ReliureASGI("api")
+        app.register_view(view)
+        messages = asyncio.run(request(app, "POST", "/api/rank/play_stream", body=b'{"in": "b c a"}',
+                                       content_type="application/json", raw=True))
+        assert dict(messages[0]["headers"])[b"content-type"] == b"application/x-ndjson"
+        # one message by chunk
+        chunks = [json.loads(message["body"].decode("utf8")) for message in messages[1:-1]]
+        assert chunks[:-1] == [{"output": "rank", "item": "a"}, {"output": "rank", "item": "b"},
+                               {"output": "rank", "item": "c"}, {"output": "count", "value": 3}]
+        assert chunks[-1]["meta"]["name"] == "engine:[rank:[rank], count:[count]]"
+        assert not messages[-1].get("more_body", False)
+        # server-sent events
+        messages = asyncio.run(request(app, "POST", "/api/rank/play_stream", body=b'{"in": "b a"}',
+                                       content_type="application/json", accept="text/event-stream",
+                                       raw=True))
+        assert dict(messages[0]["headers"])[b"content-type"] == b"text/event-stream"
+        assert messages[1]["body"] == b'event: item\ndata: {"output":"rank","item":"a"}\n\n'
+
+    def test_short_play(self):
+        status, data = call(self.app, "GET", "/api/mult_opt/n/33")
+        assert status == 200
+        assert data["results"] == {"mult_opt": 33 * 5}
+        status, data = call(self.app, "GET", "/api/mult_opt/n/33", query=b"factor=2")
+        assert data["results"] == {"mult_opt": 33 * 2}
+
+    def test_async_engine(self):
+        engine = Engine("double")
+        engine.double.setup(in_name="in", out_name="out")
+        engine.double.set(slow_double)
+        view = EngineView(engine, "double")
+        view.set_input_type(Numeric(vtype=int))
+        view.add_output("out")
+        app = ReliureASGI("api", max_workers=2)
+        app.register_view(view)
+        assert app.is_async(view)
+
+        async def main():
+            plays = [request(app, "POST", "/api/double", body=json.dumps({"in": num}).encode("utf8"),
+                             content_type="application/json") for num in range(50)]
+            return await asyncio.gather(*plays)
+        start = time.time()
+        responses = asyncio.run(main())
+        # plays are not limited by the thread pool
+        assert time.time() - start < 1.
+        assert [data["results"]["out"] for _, data in responses] == [num * 2 for num in range(50)]
+        assert all(data["meta"]["details"][0]["name"] == "double:[slow_double]"
+                   for _, data in responses)
+
+    def test_cache(self):
+        calls = []
+        async def double(arg):
+            calls.append(arg)
+            return arg * 2
+        engine = Engine("double")
+        engine.double.setup(in_name="in", out_name="out")
+        engine.double.set(double)
+        view = EngineView(engine, "double")
+        view.set_input_type(Numeric(vtype=int))
+        view.add_output("out")
+        view.set_cache(LRU(maxsize=10))
+        app = ReliureASGI("api")
+        app.register_view(view)
+        for _ in range(3):
+            status, data = call(app, "POST", "/api/double", body=b'{"in": 4}',
+                                content_type="application/json")
+            assert data["results"] == {"out": 8}
+        assert calls == [4]
+        assert call(app, "GET", "/api/double")[1]["cache"]["hits"] == 2
+
+    def test_serializers(self):
+        class ReprSerializer(Serializer):
+            content_type = "text/x-repr"
+            def dumps(self, data):
+                return repr(data["results"]).encode("utf8")
+        view = ComponentView(OptProductEx())
+        view.add_input("number", Numeric(vtype=int))
+        view.set_serializers(JsonSerializer(), ReprSerializer())
+        app = ReliureASGI("api")
+        app.register_view(view)
+        scope_headers = {"content_type": "application/json", "accept": "text/x-repr"}
+        messages = asyncio.run(request(app, "POST", "/api/mult_opt", body=b'{"number": 2}',
+                                       raw=True, **scope_headers))
+        assert dict(messages[0]["headers"])[b"content-type"] == b"text/x-repr"
+        assert messages[1]["body"] == b"{'mult_opt': 10}"
+        app.close()
+
+    def test_sync_engine(self):
+        engine = Engine("wait")
+        engine.wait.setup(in_name="in", out_name="out")
+        engine.wait.set(lambda x: time.sleep(0.1) or x)
+        view = EngineView(engine, "wait")
+        view.set_input_type(Numeric(vtype=int))
+        view.add_output("out")
+        app = ReliureASGI("api", max_workers=4)
+        app.register_view(view)
+        assert not app.is_async(view)
+
+        async def main():
+            plays = [request(app, "POST", "/api/wait", body=json.dumps({"in": num}).encode("utf8"),
+                             content_type="application/json") for num in range(8)]
+            return await asyncio.gather(*plays)
+        start = time.time()
+        responses = asyncio.run(main())
+        # 4 plays at once
+        assert 0.2 <= time.time() - start < 0.6
+        assert [data["results"]["out"] for _, data in responses] == list(range(8))
+        app.close()
+
+    def test_lifespan(self):
+        messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+        sent = []
+        async def receive():
+            return messages.pop(0)
+        async def send(message):
+            sent.append(message["type"])
+        asyncio.run(self.app({"type": "lifespan"}, receive, send))
+        assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
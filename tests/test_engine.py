@@ -1,10 +1,13 @@
 #-*- coding:utf-8 -*-
+import pickle
 import unittest
+import threading
 
 from reliure import Composable, Optionable
 from reliure.exceptions import ReliureError
 from reliure.types import Numeric
 from reliure.engine import Block, Engine
+from reliure.utils.cache import LRU, make_key
 
 # We create some simple components used to test Block and Engine
 
@@ -580,3 +583,272 @@ class TestEngine(unittest.TestCase):
         assert res["middle"] == 50
         assert res["out"] == -48
 
+
+    def test_play_executor(self):
+        # two independent blocks should be run in the same time
+        # (each one waits for the other)
+        barrier = threading.Barrier(2, timeout=5)
+        def wait_and_mult(arg):
+            barrier.wait()
+            return arg * 5
+        def wait_and_add(arg):
+            barrier.wait()
+            return arg + 2
+        engine = Engine("op1", "op2", "op3")
+        engine.op1.set(wait_and_mult)
+        engine.op1.setup(in_name="in1", out_name="out1")
+        engine.op2.set(wait_and_add)
+        engine.op2.setup(in_name="in1", out_name="out2")
+        engine.op3.set(MinusTwoInputs())
+        engine.op3.setup(in_name=["out1", "out2"], out_name="out3")
+        engine.set_executor("thread", workers=2)
+        res = engine.play(3)
+        assert list(res.keys()) == ["in1", "out1", "out2", "out3"]
+        assert res["out3"] == (3*5) - (3+2)
+        assert [meta.name for meta in engine.meta] == [
+            "op1:[wait_and_mult]", "op2:[wait_and_add]", "op3:[minus_comp]"
+        ]
+
+    def test_play_executor_same_results(self):
+        engine = Engine("op1", "op2", "op3")
+        engine.op1.set(self.mult_opt)
+        engine.op2.set(self.plus_comp)
+        engine.op3.set(self.mult_opt)
+        engine.op3.setup(in_name="op1")
+        seq_res = engine.play(3)
+        seq_names = [meta.name for meta in engine.meta]
+        for executor in ["thread", "process"]:
+            engine.set_executor(executor, workers=2)
+            res = engine.play(3)
+            assert res == seq_res
+            assert [meta.name for meta in engine.meta] == seq_names
+        engine.set_executor(None)
+        assert engine.play(3) == seq_res
+
+    def test_play_executor_error(self):
+        def fail(arg):
+            raise RuntimeError("fail")
+        engine = Engine("op1", "op2", "op3")
+        engine.op1.set(self.mult_opt)
+        engine.op1.setup(in_name="in", out_name="out1")
+        engine.op2.set(fail)
+        engine.op2.setup(in_name="in", out_name="out2")
+        engine.op3.set(MinusTwoInputs())
+        engine.op3.setup(in_name=["out1", "out2"], out_name="out3")
+        engine.set_executor("thread")
+        with self.assertRaises(RuntimeError):
+            engine.play(3)
+        # the error is stored in the meta, op3 is not run
+        assert len(engine.meta.errors) == 1
+        assert [meta.name for meta in engine.meta] == ["op1:[mult_opt]", "op2:[fail]"]
+        with self.assertRaises(ValueError):
+            engine.set_executor("gpu")
+
+    def test_play_config(self):
+        engine = Engine("op1", "op2")
+        engine.set("op1", self.mult_opt, self.plus_comp)
+        engine.set("op2", self.plus_comp, self.max_comp)
+        engine.op2.setup(required=False)
+        config = engine.play_config({
+            "op1": {"name": "mult_opt", "options": {"factor": "3"}},
+            "op2": [{"name": "max20"}],
+        })
+        assert list(config["op1"].items()) == [("mult_opt", {"factor": 3})]
+        assert list(config["op2"].keys()) == ["max20"]
+        res = engine.play(10, config=config)
+        assert res["op2"] == 20
+        # raw config are also accepted
+        res = engine.play(4, config={"op1": {"name": "mult_opt", "options": {"factor": "3"}}})
+        assert "op2" not in res
+        assert res["op1"] == 12
+        # the engine is not modified
+        assert engine.op1.selected() == ["mult_opt"]
+        assert engine.op2.selected() == []
+        assert self.mult_opt.get_option_value("factor") == 5
+        assert engine.play(3)["op1"] == 15
+        # configuration errors are raised as for `configure`
+        with self.assertRaises(ValueError):
+            engine.play_config({"op1": {"name": "donotexist"}})
+        with self.assertRaises(ValueError):
+            engine.play_config({"op1": {"name": "mult_opt", "options": {"power": 2}}})
+        with self.assertRaises(ValueError):
+            engine.play_config({"op3": []})
+
+    def test_play_config_threads(self):
+        engine = Engine("op1")
+        engine.set("op1", self.mult_opt)
+        errors = []
+        def play(factor):
+            try:
+                config = {"op1": {"name": "mult_opt", "options": {"factor": factor}}}
+                for num in range(200):
+                    res = engine.play(num, config=config)
+                    assert res["op1"] == num * factor
+                    assert engine.meta.name == "engine:[op1:[mult_opt]]"
+            except Exception as err:
+                errors.append(err)
+        threads = [threading.Thread(target=play, args=(factor,)) for factor in range(1, 6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert errors == []
+
+    def test_pickle(self):
+        engine = Engine("op1", "op2")
+        engine.op1.setup(in_name="in", out_name="middle")
+        engine.op2.setup(in_name="middle", out_name="out")
+        engine.set("op1", OptProductEx())
+        engine.set("op2", CompAddTwoExample())
+        engine.set_executor("thread", workers=2)
+        engine.play(2)
+        copy = pickle.loads(pickle.dumps(engine))
+        assert copy.meta is None
+        assert copy.play(3)["out"] == 3 * 5 + 2
+        assert copy.meta.name == "engine:[op1:[mult_opt], op2:[plus_comp]]"
+        # the engine itself is unchanged
+        assert engine.play(3)["out"] == 3 * 5 + 2
+        engine.set_executor(None)
+
+    def test_play_outputs(self):
+        calls = []
+        def track(name, fct):
+            def tracked(*args):
+                calls.append(name)
+                return fct(*args)
+            return Composable(tracked, name=name)
+        engine = Engine("op1", "op2", "op3")
+        engine.op1.set(track("mult", lambda x: x * 5))
+        engine.op1.setup(in_name="in", out_name="out1")
+        engine.op2.set(track("plus", lambda x: x + 2))
+        engine.op2.setup(in_name="out1", out_name="out2")
+        engine.op3.set(track("minus", lambda x: x - 2))
+        engine.op3.setup(in_name="in", out_name="out3")
+        with self.assertRaises(ValueError):
+            engine.needed_blocks(["donotexist"])
+        for executor in [None, "thread"]:
+            engine.set_executor(executor)
+            del calls[:]
+            res = engine.play(3, outputs=["out1"])
+            assert dict(res) == {"in": 3, "out1": 15}
+            assert calls == ["mult"]
+            assert [meta.name for meta in engine.meta] == ["op1:[mult]"]
+            del calls[:]
+            res = engine.play(3, outputs=["out2", "out3"])
+            assert dict(res) == {"in": 3, "out1": 15, "out2": 17, "out3": 1}
+            assert sorted(calls) == ["minus", "mult", "plus"]
+            # inputs are always available
+            assert dict(engine.play(3, outputs=["in"])) == {"in": 3}
+
+    def test_block_cache(self):
+        calls = []
+        class CountingMult(OptProductEx):
+            def __call__(self, arg, factor=None):
+                calls.append(arg)
+                return super(CountingMult, self).__call__(arg, factor=factor)
+        engine = Engine("op1", "op2")
+        engine.set("op1", CountingMult(), cache=LRU(maxsize=10))
+        engine.set("op2", self.plus_comp)
+        assert engine.play(3)["op2"] == 17
+        assert engine.play(3)["op2"] == 17
+        assert calls == [3]
+        meta = engine.meta.as_dict()["details"]
+        assert meta[0]["details"][0]["cache"]["hit"] == True
+        assert "cache" not in meta[1]["details"][0]
+        # options are part of the key
+        config = {"op1": {"name": "mult_opt", "options": {"factor": 2}}}
+        assert engine.play(3, config=config)["op1"] == 6
+        assert engine.play(3, config=config)["op1"] == 6
+        assert calls == [3, 3]
+        # not hashable inputs are not cached
+        data = bytearray(b"a")
+        assert engine.play(data, outputs=["op1"])["op1"] == b"aaaaa"
+        assert engine.play(data, outputs=["op1"])["op1"] == b"aaaaa"
+        assert calls == [3, 3, data, data]
+        assert engine.meta.as_dict()["details"][0]["details"][0]["cache"]["hit"] == False
+        # cache can be removed
+        engine.op1.setup(cache=False)
+        engine.play(3)
+        assert calls == [3, 3, data, data, 3]
+
+    def test_block_cache_key_types(self):
+        # equal values of different types have different keys
+        block = Block("type")
+        block.set(lambda value: type(value).__name__)
+        block.setup(cache=LRU(maxsize=10))
+        for value, name in [(1, "int"), (True, "bool"), (1., "float"), ([1, 2], "list"),
+                            ((1, 2), "tuple"), ({1: 2}, "dict"), ([(1, 2)], "list"),
+                            (set([1]), "set"), (frozenset([1]), "frozenset")]:
+            assert block.play(value)["type"] == name
+            assert block.play(value)["type"] == name
+        assert make_key({1: "a"}) != make_key([(1, "a")])
+        assert make_key({True: 1}) != make_key({1: 1})
+
+    def test_block_cache_copy(self):
+        # the next components may modify the cached outputs
+        engine = Engine("tokenize", "first")
+        engine.tokenize.setup(in_name="in", out_name="toks", cache=LRU(maxsize=10))
+        engine.first.setup(in_name="toks", out_name="first")
+        engine.tokenize.set(lambda text: text.split())
+        engine.first.set(lambda toks: toks.pop(0))
+        results = [engine.play("a b c d") for _ in range(3)]
+        assert [res["first"] for res in results] == ["a", "a", "a"]
+        assert [res["toks"] for res in results] == [["b", "c", "d"]] * 3
+        assert engine.tokenize.cache.stats()["hits"] == 2
+        # outputs that can't be copied are not cached
+        engine.tokenize.set(lambda text: [threading.Lock()])
+        engine.first.set(len)
+        engine.play("a")
+        engine.play("a")
+        assert engine.tokenize.cache.stats()["hits"] == 2
+
+    def test_block_cache_iterator(self):
+        block = Block("foo")
+        block.set(lambda text: iter(text.split()))
+        block.setup(cache=LRU(maxsize=10))
+        assert list(block.play("a b")["foo"]) == ["a", "b"]
+        assert list(block.play("a b")["foo"]) == ["a", "b"]
+        assert len(block.cache) == 0
+
+    def test_play_batch(self):
+        batch_calls = []
+        class BatchMult(OptProductEx):
+            def batch_call(self, args, factor=None):
+                batch_calls.append(list(args))
+                return [arg * factor for arg in args]
+        batch_mult = BatchMult()
+        batch_mult.force_option_value("factor", 3)
+        engine = Engine("op1", "op2", "op3")
+        engine.set("op1", batch_mult)
+        engine.set("op2", self.plus_comp)
+        engine.set("op3", self.plus_comp | batch_mult)
+        results = engine.play_batch([1, 2, 3])
+        assert len(results) == 3
+        assert [dict(res) for res in results] == [dict(engine.play(num)) for num in [1, 2, 3]]
+        assert list(results[0].keys()) == ["input", "op1", "op2", "op3"]
+        # batch_call is called once for the batch (in op1 and in op3 pipeline)
+        assert batch_calls[:2] == [[1, 2, 3], [7, 10, 13]]
+        # meta are aggregated
+        engine.play_batch([1, 2, 3])
+        assert [meta.name for meta in engine.meta] == [
+            "op1:[mult_opt]", "op2:[plus_comp]", "op3:[plus_comp|mult_opt]"
+        ]
+        # config and outputs are managed as for play
+        config = {"op3": {"name": "plus_comp|mult_opt"}}
+        results = engine.play_batch([1, 2], config=config, outputs=["op1"])
+        assert [dict(res) for res in results] == [{"input": 1, "op1": 3}, {"input": 2, "op1": 6}]
+        assert engine.play_batch([]) == []
+        with self.assertRaises(ValueError):
+            engine.play_batch([{"input": 1}, {"other": 2}])
+
+    def test_play_batch_invalid_output(self):
+        class BadBatch(Composable):
+            def __call__(self, arg):
+                return arg
+            def batch_call(self, args):
+                return args[:1]
+        block = Block("foo")
+        block.set(BadBatch())
+        with self.assertRaises(ReliureError):
+            block.play_batch([1, 2])
+        assert block.meta.has_error
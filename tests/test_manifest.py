@@ -0,0 +1,57 @@
+#-*- coding:utf-8 -*-
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from reliure.manifest import content_key, FileManifest, SqliteManifest
+
+
+class TestManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def check_manifest(self, build):
+        manifest = build()
+        self.assertEqual(len(manifest), 0)
+        manifest.add(["a", "b", 12])
+        manifest.add([])
+        self.assertIn("a", manifest)
+        self.assertIn(12, manifest)
+        self.assertIn("12", manifest)
+        self.assertNotIn("c", manifest)
+        manifest.close()
+        # keys are persistent
+        with build() as manifest:
+            self.assertEqual(len(manifest), 3)
+            manifest.add(["a", "c"])
+            self.assertEqual(len(manifest), 4)
+            # used from an other thread
+            found = []
+            thread = threading.Thread(target=lambda: found.append("c" in manifest))
+            thread.start()
+            thread.join()
+            self.assertEqual(found, [True])
+
+    def test_file(self):
+        path = os.path.join(self.tmpdir, "manifest.txt")
+        self.check_manifest(lambda: FileManifest(path))
+        # an interrupted write is ignored
+        with open(path, "a") as mfile:
+            mfile.write("unfinished")
+        with FileManifest(path) as manifest:
+            self.assertNotIn("unfinished", manifest)
+
+    def test_sqlite(self):
+        path = os.path.join(self.tmpdir, "manifest.db")
+        self.check_manifest(lambda: SqliteManifest(path))
+
+    def test_content_key(self):
+        self.assertEqual(content_key({"a": 1, "b": [1, 2]}), content_key({"b": [1, 2], "a": 1}))
+        self.assertNotEqual(content_key({"a": 1}), content_key({"a": 2}))
+        self.assertEqual(len(content_key(b"bytes")), 40)
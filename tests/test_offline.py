@@ -0,0 +1,483 @@
+#-*- coding:utf-8 -*-
+import os
+import sys
+import time
+import json
+import random
+import shutil
+import tempfile
+import itertools
+import unittest
+import threading
+import multiprocessing
+
+from reliure.types import Numeric
+from reliure.pipeline import Composable, Optionable
+from reliure.exceptions import ReliureError
+from reliure.engine import Engine
+from reliure.offline import run, run_parallel, run_threaded, run_engine, PlayStats, ReliurePool
+from reliure.sinks import JsonLinesSink, ShardedSink
+from reliure.sources import FileSource
+from reliure.manifest import FileManifest, SqliteManifest
+
+
+@Composable
+def slow_square(values):
+    for value in values:
+        time.sleep(random.random() * 0.005)
+        yield value ** 2
+
+@Composable
+def fail_on_13(values):
+    for value in values:
+        if value == 13:
+            raise ValueError("13 !")
+        yield value
+
+@Composable
+def make_blobs(values):
+    for value in values:
+        yield {"id": value, "blob": bytes(bytearray([value]) * 2**17), "small": b"x"}
+
+@Composable
+def with_chunk_size(values):
+    values = list(values)
+    for value in values:
+        time.sleep(0.002)
+        yield value, len(values)
+
+class PowerAll(Optionable):
+    def __init__(self):
+        super(PowerAll, self).__init__("power")
+        self.add_option("alpha", Numeric(default=2))
+
+    @Optionable.check
+    def __call__(self, values, alpha=None):
+        return [value ** alpha for value in values]
+
+@Composable
+def stuck_on_1(values):
+    for value in values:
+        if value == 1:
+            time.sleep(60)
+        yield value
+
+@Composable
+def worker_pid(values):
+    for value in values:
+        yield os.getpid()
+
+class CrashOnce(Composable):
+    """ Kills its worker on 7, only the first time (a flag file is created)
+    """
+    def __init__(self, flag):
+        super(CrashOnce, self).__init__(name="crash_once")
+        self.flag = flag
+
+    def __call__(self, values):
+        for value in values:
+            if value == 7 and not os.path.exists(self.flag):
+                open(self.flag, "w").close()
+                os._exit(3)
+            yield value
+
+@Composable
+def crash_on_poison(values):
+    for value in values:
+        if value in (13, 14):
+            os._exit(1)
+        if value == 42:
+            raise ValueError("poison")
+        yield value
+
+class Fetcher(Composable):
+    """ Slow (I/O bound) component that records the instances used
+    """
+    instances = set()
+
+    def __call__(self, values):
+        for value in values:
+            time.sleep(0.01)
+            Fetcher.instances.add(id(self))
+            yield value * 2
+
+def inverse(values):
+    time.sleep(0.001)
+    return [1. / value for value in values]
+
+def make_engine():
+    engine = Engine("inverse", "power")
+    engine.inverse.setup(in_name="in", out_name="inv")
+    engine.inverse.set(inverse)
+    engine.power.setup(in_name="inv", out_name="out")
+    engine.power.set(PowerAll())
+    return engine
+
+def build_multiplier(factor):
+    time.sleep(0.01)     # load some heavy resources
+    return Composable(lambda values: (value * factor for value in values))
+
+def build_nothing():
+    raise IOError("resource not found")
+
+
+class TestRunParallel(unittest.TestCase):
+
+    def test_ordered(self):
+        res = run_parallel(slow_square, range(100), ncpu=3, chunksize=4)
+        self.assertEqual(list(res), run(slow_square, range(100)))
+
+    def test_unordered(self):
+        res = list(run_parallel(slow_square, range(100), ncpu=3, chunksize=4, ordered=False))
+        self.assertEqual(sorted(res), [value ** 2 for value in range(100)])
+
+    def test_lazy(self):
+        consumed = []
+        def inputs():
+            for value in itertools.count():
+                consumed.append(value)
+                yield value
+        res = run_parallel(slow_square, inputs(), ncpu=2, chunksize=5, inflight=4)
+        self.assertEqual(list(itertools.islice(res, 12)), [value ** 2 for value in range(12)])
+        # only a few chunks are read ahead
+        self.assertTrue(len(consumed) <= 5 * (4 + 4))
+        res.close()
+
+    def test_errors(self):
+        with self.assertRaises(ReliureError):
+            list(run_parallel(fail_on_13, range(50), ncpu=2, chunksize=3))
+        def inputs():
+            yield 1
+            raise RuntimeError("input error")
+        with self.assertRaises(RuntimeError):
+            list(run_parallel(slow_square, inputs(), ncpu=2, chunksize=1))
+
+    def test_pipeline_factory(self):
+        with self.assertLogs("reliure.ReliurePool", level="INFO") as logs:
+            res = run_parallel(None, range(10), ncpu=3, chunksize=2,
+                               pipeline_factory=build_multiplier, factory_args=(3,))
+            self.assertEqual(list(res), [value * 3 for value in range(10)])
+        started = [line for line in logs.output if "started in" in line]
+        self.assertEqual(len(started), 3)
+        with self.assertRaises(ReliureError):
+            list(run_parallel(None, range(10), pipeline_factory=build_nothing))
+        with self.assertRaises(ValueError):
+            list(run_parallel(slow_square, range(10), pipeline_factory=build_nothing))
+
+    @unittest.skipIf(sys.version_info < (3, 8), "needs python >= 3.8")
+    def test_shm_transport(self):
+        shm_before = set(os.listdir("/dev/shm")) if os.path.isdir("/dev/shm") else set()
+        res = list(run_parallel(make_blobs, range(10), ncpu=2, chunksize=3, transport="shm"))
+        self.assertEqual([out["id"] for out in res], list(range(10)))
+        for out in res:
+            # big buffers are given as memoryviews
+            self.assertIsInstance(out["blob"], memoryview)
+            self.assertEqual(out["blob"].nbytes, 2**17)
+            self.assertEqual(bytes(out["blob"][:2]), bytes(bytearray([out["id"]]) * 2))
+            self.assertEqual(out["small"], b"x")
+        del res, out
+        # shared memory blocks are freed
+        if os.path.isdir("/dev/shm"):
+            self.assertEqual(set(os.listdir("/dev/shm")) - shm_before, set())
+        with self.assertRaises(ValueError):
+            list(run_parallel(make_blobs, range(10), transport="pigeon"))
+
+    def test_adaptive(self):
+        res = list(run_parallel(with_chunk_size, range(200), ncpu=2, chunksize=10,
+                                adaptive=True, target_time=0.01))
+        self.assertEqual([value for value, _ in res], list(range(200)))
+        sizes = [size for _, size in res]
+        # chunks are smaller than the initial size, the last ones are split
+        self.assertEqual(sizes[0], 10)
+        self.assertTrue(max(sizes[100:]) < 10)
+        self.assertEqual(sizes[-1], 1)
+
+
+    def test_retries(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            flag = os.path.join(tmpdir, "crashed")
+            # without retries the crash is an error
+            with self.assertRaises(ReliureError):
+                list(run_parallel(CrashOnce(flag), range(20), ncpu=2, chunksize=3))
+            os.remove(flag)
+            res = list(run_parallel(CrashOnce(flag), range(20), ncpu=2, chunksize=3, retries=1))
+            self.assertEqual(res, list(range(20)))
+            self.assertTrue(os.path.exists(flag))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_quarantine(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, "quarantine.jsonl")
+            res = list(run_parallel(crash_on_poison, range(60), ncpu=2, chunksize=8,
+                                    retries=1, quarantine=path))
+            self.assertEqual(res, [val for val in range(60) if val not in (13, 14, 42)])
+            with open(path) as qfile:
+                bad = [json.loads(line) for line in qfile]
+            self.assertEqual(sorted(item["item"] for item in bad), [13, 14, 42])
+            self.assertIn("poison", [item["error"] for item in bad if item["item"] == 42][0])
+            # unordered
+            bad = []
+            res = run_parallel(crash_on_poison, range(60), ncpu=2, chunksize=8, ordered=False,
+                               quarantine=lambda item, error: bad.append(item))
+            self.assertEqual(sorted(res), [val for val in range(60) if val not in (13, 14, 42)])
+            self.assertEqual(sorted(bad), [13, 14, 42])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_sinks(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, "out.jsonl")
+            stats = run(slow_square, range(20), sink=JsonLinesSink(path))
+            self.assertEqual(stats["outputs"], 20)
+            with open(path) as jfile:
+                self.assertEqual([json.loads(line) for line in jfile], run(slow_square, range(20)))
+            # parallel run, written by the parent
+            stats = run_parallel(slow_square, range(100), ncpu=2, chunksize=7, sink=JsonLinesSink(path))
+            self.assertEqual((stats["inputs"], stats["outputs"], stats["chunks"]), (100, 100, 15))
+            with open(path) as jfile:
+                self.assertEqual([json.loads(line) for line in jfile], run(slow_square, range(100)))
+            # written by the workers
+            sink = ShardedSink(os.path.join(tmpdir, "out-{shard}.jsonl"))
+            stats = run_parallel(crash_on_poison, range(60), ncpu=3, chunksize=8, sink=sink,
+                                 quarantine=os.path.join(tmpdir, "bad.jsonl"))
+            self.assertEqual((stats["inputs"], stats["outputs"], stats["quarantined"]), (57, 57, 3))
+            self.assertEqual(len(sink.paths), 3)
+            outputs = []
+            for shard in sink.paths:
+                with open(shard) as jfile:
+                    outputs.extend(json.loads(line) for line in jfile)
+            self.assertEqual(sorted(outputs), [val for val in range(60) if val not in (13, 14, 42)])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_file_source(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, "in.txt")
+            with open(path, "w") as infile:
+                infile.write("".join("%d\n" % num for num in range(1000)))
+            for use_mmap in (False, True):
+                source = FileSource(path, split_size=100, parse=int, use_mmap=use_mmap)
+                res = list(run_parallel(slow_square, source, ncpu=3))
+                self.assertEqual(res, [num ** 2 for num in range(1000)])
+            # bad records are isolated
+            source = FileSource(path, split_size=100, parse=int)
+            bad = []
+            res = list(run_parallel(crash_on_poison, source, ncpu=2, quarantine=lambda item, error: bad.append(item)))
+            self.assertEqual(len(res), 997)
+            self.assertEqual(sorted(bad), [13, 14, 42])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_manifest(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, "out.jsonl")
+            manifest = FileManifest(os.path.join(tmpdir, "done.txt"))
+            docs = [{"id": num, "value": num} for num in range(100)]
+            square = Composable(lambda docs: ({"id": doc["id"], "value": doc["value"] ** 2} for doc in docs))
+            # a run that is stopped
+            res = run_parallel(square, docs, ncpu=2, chunksize=10, manifest=manifest)
+            self.assertEqual([out["id"] for out in itertools.islice(res, 35)], list(range(35)))
+            res.close()
+            # only the chunks whose results were consumed are recorded
+            self.assertEqual(len(manifest), 30)
+            # resume
+            stats = run_parallel(square, docs, ncpu=2, chunksize=10, manifest=manifest,
+                                 sink=JsonLinesSink(path))
+            self.assertEqual((stats["skipped"], stats["inputs"]), (30, 70))
+            with open(path) as jfile:
+                self.assertEqual([json.loads(line)["id"] for line in jfile], list(range(30, 100)))
+            # incremental: only the new and modified docs are processed
+            docs[5]["value"] = 50
+            docs.append({"id": 100, "value": 100})
+            res = list(run_parallel(square, docs, ncpu=2, manifest=manifest))
+            self.assertEqual(res, [{"id": 5, "value": 2500}, {"id": 100, "value": 10000}])
+            manifest.close()
+            # with ids and a file source
+            source_path = os.path.join(tmpdir, "in.txt")
+            with open(source_path, "w") as infile:
+                infile.write("".join("%d\n" % num for num in range(100)))
+            source = FileSource(source_path, split_size=50, parse=int)
+            with SqliteManifest(os.path.join(tmpdir, "done.db")) as manifest:
+                res = run_parallel(slow_square, source, ncpu=2, manifest=manifest)
+                self.assertEqual(list(itertools.islice(res, 25)), [num ** 2 for num in range(25)])
+                res.close()
+                self.assertTrue(len(manifest) >= 1)
+                res = list(run_parallel(slow_square, source, ncpu=2, manifest=manifest))
+                self.assertTrue(0 < len(res) < 100)
+                self.assertEqual(res, [num ** 2 for num in range(100 - len(res), 100)])
+                self.assertEqual(list(run_parallel(slow_square, source, ncpu=2, manifest=manifest)), [])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class TestRunThreaded(unittest.TestCase):
+
+    def test_threaded(self):
+        Fetcher.instances.clear()
+        start = time.time()
+        res = list(run_threaded(Fetcher(), range(100), nthreads=10, chunksize=5))
+        self.assertEqual(res, [value * 2 for value in range(100)])
+        # the waits are concurrent
+        self.assertTrue(time.time() - start < 0.5)
+        # each thread has its own copy of the pipeline
+        self.assertTrue(1 < len(Fetcher.instances) <= 10)
+        res = run_threaded(Fetcher(), range(100), nthreads=10, chunksize=5, ordered=False)
+        self.assertEqual(sorted(res), [value * 2 for value in range(100)])
+
+    def test_thread_safe(self):
+        Fetcher.instances.clear()
+        fetcher = Fetcher()
+        fetcher.thread_safe = True
+        pipeline = fetcher | Composable(lambda values: (value + 1 for value in values))
+        self.assertFalse(pipeline.thread_safe)
+        pipeline.items[1].thread_safe = True
+        self.assertTrue(pipeline.thread_safe)
+        res = list(run_threaded(pipeline, range(50), nthreads=5, chunksize=5))
+        self.assertEqual(res, [value * 2 + 1 for value in range(50)])
+        self.assertEqual(Fetcher.instances, set([id(fetcher)]))
+        # a pipeline may be declared thread safe as a whole
+        Fetcher.instances.clear()
+        pipeline = Fetcher() | Composable(lambda values: (value + 1 for value in values))
+        pipeline.thread_safe = True
+        res = list(run_threaded(pipeline, range(50), nthreads=5, chunksize=5))
+        self.assertEqual(res, [value * 2 + 1 for value in range(50)])
+        self.assertEqual(Fetcher.instances, set([id(pipeline.items[0])]))
+
+    def test_uncopyable(self):
+        fetcher = Fetcher()
+        fetcher.lock = threading.Lock()
+        with self.assertRaises(ReliureError):
+            list(run_threaded(fetcher, range(10), ncpu=2, chunksize=5))
+        fetcher.thread_safe = True
+        res = run_threaded(fetcher, range(10), ncpu=2, chunksize=5)
+        self.assertEqual(list(res), [value * 2 for value in range(10)])
+
+    def test_factory_errors_lazy(self):
+        res = run_threaded(None, range(10), nthreads=3, chunksize=2,
+                           pipeline_factory=build_multiplier, factory_args=(3,))
+        self.assertEqual(list(res), [value * 3 for value in range(10)])
+        with self.assertRaises(ValueError):
+            list(run_threaded(fail_on_13, range(50), nthreads=2, chunksize=3))
+        with self.assertRaises(ValueError):
+            list(run_threaded(fail_on_13, range(50), pipeline_factory=build_nothing))
+        consumed = []
+        def inputs():
+            for value in itertools.count():
+                consumed.append(value)
+                yield value
+        res = run_threaded(slow_square, inputs(), nthreads=2, chunksize=5, inflight=4)
+        self.assertEqual(list(itertools.islice(res, 12)), [value ** 2 for value in range(12)])
+        res.close()
+        self.assertTrue(len(consumed) <= 5 * (4 + 4))
+
+
+class TestRunEngine(unittest.TestCase):
+
+    def test_serial(self):
+        engine = make_engine()
+        config = {"power": [{"name": "power", "options": {"alpha": 1}}]}
+        stats = PlayStats()
+        res = list(run_engine(engine, ({"in": [num]} for num in range(1, 21)), config=config, stats=stats))
+        self.assertEqual([out["out"] for out in res], [[1. / num] for num in range(1, 21)])
+        result = stats.as_dict()
+        self.assertEqual((result["plays"], result["errors"]), (20, 0))
+        self.assertEqual(list(result["blocks"]), ["inverse:[inverse]", "power:[power]"])
+        block = result["blocks"]["inverse:[inverse]"]
+        self.assertEqual(block["count"], 20)
+        self.assertTrue(0.001 <= block["min"] <= block["p50"] <= block["p90"] <= block["p99"] <= block["max"])
+        self.assertAlmostEqual(block["mean"] * 20, block["total"])
+        # errors are counted
+        with self.assertRaises(TypeError):
+            list(run_engine(engine, ["a"], stats=stats))
+        self.assertEqual(stats.plays, 21)
+        self.assertEqual(stats.errors, 1)
+        # a play that fails before running the blocks is not counted
+        with self.assertRaises(ValueError):
+            list(run_engine(engine, [[1]], config={"nope": []}, stats=stats))
+        self.assertEqual(stats.plays, 21)
+        with self.assertRaises(ValueError):
+            list(run_engine(engine, [[1]], stats=stats, ncpu=2, sink=JsonLinesSink("out.jsonl")))
+
+    def test_parallel(self):
+        engine = make_engine()
+        stats = PlayStats(sample_size=10)
+        bad = []
+        inputs = [[num] for num in range(100)]
+        res = list(run_engine(engine, inputs, outputs=["inv"], stats=stats, ncpu=2, chunksize=10,
+                              quarantine=lambda item, error: bad.append(item)))
+        self.assertEqual([out["inv"] for out in res], [[1. / num] for num in range(1, 100)])
+        self.assertEqual(bad, [[0]])
+        result = stats.as_dict()
+        self.assertEqual(result["plays"], 99)
+        # only the needed blocks are played
+        self.assertEqual(list(result["blocks"]), ["inverse:[inverse]"])
+        self.assertEqual(len(stats._blocks["inverse:[inverse]"][6]), 10)
+
+    def test_parallel_spawn(self):
+        # the engine is pickled to be sent to the workers
+        start_method = multiprocessing.get_start_method(allow_none=True)
+        multiprocessing.set_start_method("spawn", force=True)
+        try:
+            engine = make_engine()
+            stats = PlayStats()
+            res = list(run_engine(engine, [[num] for num in range(1, 11)], stats=stats, ncpu=2,
+                                  chunksize=5))
+        finally:
+            multiprocessing.set_start_method(start_method, force=True)
+        self.assertEqual([out["out"] for out in res], [[(1. / num) ** 2] for num in range(1, 11)])
+        self.assertEqual(stats.plays, 10)
+
+
+class TestReliurePool(unittest.TestCase):
+
+    def test_many_runs(self):
+        with ReliurePool(None, ncpu=2, pipeline_factory=build_multiplier, factory_args=(2,)) as pool:
+            self.assertEqual(sorted(pool.startup_times), [0, 1])
+            for num in range(5):
+                self.assertEqual(pool.map(range(num * 10), chunksize=3), [val * 2 for val in range(num * 10)])
+            # a stopped run does not disturb the next ones
+            res = pool.run(range(1000), chunksize=1)
+            self.assertEqual(next(res), 0)
+            res.close()
+            self.assertEqual(pool.map(range(10)), [val * 2 for val in range(10)])
+        with self.assertRaises(ReliureError):
+            pool.map(range(10))
+
+    def test_options(self):
+        with ReliurePool(PowerAll(), ncpu=2) as pool:
+            self.assertEqual(pool.map(range(4)), [0, 1, 4, 9])
+            self.assertEqual(pool.map(range(4), options={"alpha": 3}), [0, 1, 8, 27])
+
+    def test_maxtasksperchild(self):
+        with ReliurePool(worker_pid, ncpu=2, maxtasksperchild=2) as pool:
+            pids = pool.map(range(20), chunksize=1)
+            # each worker has processed at most 2 chunks
+            self.assertTrue(len(set(pids)) >= 10)
+            self.assertTrue(max(pids.count(pid) for pid in set(pids)) <= 2)
+            self.assertEqual(pool.map(range(4), chunksize=1, ordered=False).__len__(), 4)
+
+    def test_close_stopped_run(self):
+        # the workers are blocked on big results that are not read anymore
+        pool = ReliurePool(make_blobs, ncpu=2)
+        res = pool.run(range(200), chunksize=1)
+        self.assertEqual(next(res)["id"], 0)
+        res.close()
+        start = time.time()
+        pool.close()
+        self.assertTrue(time.time() - start < 5)
+        self.assertFalse(any(worker.is_alive() for worker in pool._workers))
+        # a worker that does not stop is terminated
+        pool = ReliurePool(stuck_on_1, ncpu=2)
+        res = pool.run(range(2), chunksize=1, ordered=False)
+        self.assertEqual(next(res), 0)
+        res.close()
+        start = time.time()
+        pool.close(timeout=0.5)
+        self.assertTrue(time.time() - start < 5)
+        self.assertFalse(any(worker.is_alive() for worker in pool._workers))
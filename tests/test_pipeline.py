@@ -7,7 +7,7 @@ from reliure.exceptions import ValidationError
 from reliure.types import GenericType, Numeric, Text, Boolean
 from reliure.pipeline import Composable, Optionable
 from reliure.pipeline import OptionableSequence, Pipeline
-from reliure.pipeline import Map
+from reliure.pipeline import Map, MapSeq, MapReduce
 
 
 class TestComposable(unittest.TestCase):
@@ -75,6 +75,10 @@ class TestOptionable(unittest.TestCase):
         alpha, name = comp(alpha=2, name=u"deux")
         self.assertEqual(alpha, 2)
         self.assertEqual(name, u"deux")
+        # given values are not stored
+        self.assertEqual(comp.get_option_value("alpha"), 4)
+        alpha, name = comp()
+        self.assertEqual(alpha, 4)
         with self.assertRaises(ValueError):
             alpha, name = comp(beta=2)
         comp.force_option_value("alpha", 10)
@@ -295,6 +299,41 @@ class TestOptionableSequence(unittest.TestCase):
         )
 
 
+class TestCompiledSequence(unittest.TestCase):
+    def setUp(self):
+        opt = MyOptionable()
+        opt.force_option_value("name", u"deux")
+        self.pipeline = Pipeline(lambda x: x + 1, PowerBy(), Pipeline(lambda x: x - 1))
+        self.mapseq = MapSeq(opt, lambda: 3)
+        self.mapreduce = MapReduce(lambda array: sum(array), PowerBy(), lambda x: x + 1)
+
+    def testSameResults(self):
+        compiled = self.pipeline.compile()
+        self.assertEqual(compiled(2), self.pipeline(2))
+        self.assertEqual(compiled(2, alpha=2), self.pipeline(2, alpha=2))
+        compiled = self.mapseq.compile()
+        self.assertEqual(compiled(), self.mapseq())
+        self.assertEqual(compiled(alpha=8), [(8, u"deux"), 3])
+        compiled = self.mapreduce.compile()
+        self.assertEqual(compiled(2), self.mapreduce(2))
+        self.assertEqual(compiled(2, alpha=1), 5)
+
+    def testOptions(self):
+        compiled = self.mapseq.compile()
+        with self.assertRaises(ValueError):
+            compiled(beta=2)
+        with self.assertRaises(ValueError):
+            compiled(name=u"un")    # hidden
+        with self.assertRaises(ValidationError):
+            compiled(alpha=42)
+        # the components are not modified
+        compiled(alpha=8)
+        self.assertEqual(self.mapseq.get_option_value("alpha"), 4)
+        # and are frozen
+        self.mapseq.set_option_value("alpha", 2)
+        self.assertEqual(compiled(), [(4, u"deux"), 3])
+
+
 class PowerBy(Optionable):
     def __init__(self):
         super(PowerBy, self).__init__("testOptionableName")
@@ -315,3 +354,34 @@ def testMap():
     values = list(process(range(5), alpha=3))
     assert values == [0, 1, 8, 27, 64]
 
+
+def testMapParallel():
+    """ Test Map component with executors
+    """
+    for executor in ("thread", "process"):
+        process = Map(PowerBy(), executor=executor, workers=2, chunksize=3)
+        values = list(process(range(10), alpha=2))
+        assert values == [0, 1, 4, 9, 16, 25, 36, 49, 64, 81]
+        process.close()
+    # unordered
+    process = Map(PowerBy(), executor="thread", workers=3, ordered=False)
+    assert sorted(process(range(10))) == [val**4 for val in range(10)]
+    process.close()
+
+
+def testMapParallelLazy():
+    """ Test that a parallel Map consumes its inputs lazily
+    """
+    import itertools
+    consumed = []
+    def inputs():
+        for val in itertools.count():
+            consumed.append(val)
+            yield val
+    process = Map(PowerBy(), executor="thread", workers=2, chunksize=2, inflight=2)
+    values = process(inputs(), alpha=1)
+    assert list(itertools.islice(values, 3)) == [0, 1, 2]
+    # at most 'inflight' chunks ahead
+    assert len(consumed) <= 2 * 3 + 1
+    values.close()
+    process.close()
@@ -0,0 +1,88 @@
+#-*- coding:utf-8 -*-
+import unittest
+import threading
+
+from reliure import Composable
+from reliure.engine import Engine
+from reliure.scheduler import BatchScheduler
+
+
+class BatchDouble(Composable):
+    def __init__(self):
+        super(BatchDouble, self).__init__(name="double")
+        self.batches = []
+
+    def __call__(self, arg):
+        return arg * 2
+
+    def batch_call(self, args):
+        self.batches.append(list(args))
+        return [arg * 2 for arg in args]
+
+
+class TestBatchScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.double = BatchDouble()
+        self.engine = Engine("op1", "op2")
+        self.engine.op1.setup(in_name="in")
+        self.engine.op1.set(self.double)
+        self.engine.op2.setup(in_name="op1")
+        self.engine.op2.set(lambda x: 10 // x)
+
+    def test_coalesce(self):
+        # a long window: the batch is played when it is full
+        with BatchScheduler(self.engine, max_batch_size=4, max_wait=10000) as scheduler:
+            futures = [scheduler.submit({"in": num}) for num in range(1, 5)]
+            results = [future.result(timeout=5) for future in futures]
+        assert [res["op1"] for res in results] == [2, 4, 6, 8]
+        assert [res["op2"] for res in results] == [5, 2, 1, 1]
+        assert self.double.batches == [[1, 2, 3, 4]]
+        assert futures[0].meta.name == "engine:[op1:[double], op2:[<lambda>]]"
+
+    def test_play_threads(self):
+        scheduler = BatchScheduler(self.engine, max_batch_size=8, max_wait=50)
+        results = {}
+        def play(num):
+            results[num] = scheduler.play(**{"in": num})["op1"]
+            assert scheduler.meta is not None
+        threads = [threading.Thread(target=play, args=(num,)) for num in range(1, 9)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        scheduler.close()
+        assert results == dict((num, num * 2) for num in range(1, 9))
+        # less batches than requests
+        assert sum(len(batch) for batch in self.double.batches) == 8
+        assert len(self.double.batches) < 8
+
+    def test_groups(self):
+        with BatchScheduler(self.engine, max_batch_size=3, max_wait=10000) as scheduler:
+            futures = [
+                scheduler.submit({"in": 1}),
+                scheduler.submit({"in": 2}, outputs=["op1"]),
+                scheduler.submit({"in": 3}),
+            ]
+            results = [future.result(timeout=5) for future in futures]
+        assert "op2" not in results[1]
+        assert results[2]["op2"] == 1
+        # one batch by (config, outputs)
+        assert self.double.batches == [[1, 3], [2]]
+
+    def test_error(self):
+        with BatchScheduler(self.engine, max_batch_size=3, max_wait=10000) as scheduler:
+            futures = [scheduler.submit({"in": num}) for num in (1, 0, 2)]
+            # op2 fails for 0, others requests are played anyway
+            assert futures[0].result(timeout=5)["op2"] == 5
+            with self.assertRaises(ZeroDivisionError):
+                futures[1].result(timeout=5)
+            assert futures[1].meta.has_error
+            assert futures[2].result(timeout=5)["op2"] == 2
+        # an invalid configuration does not get the meta of a previous batch
+        with BatchScheduler(self.engine, max_batch_size=1) as scheduler:
+            assert scheduler.submit({"in": 1}).result(timeout=5)["op2"] == 5
+            future = scheduler.submit({"in": 1}, config={"nope": []})
+            with self.assertRaises(ValueError):
+                future.result(timeout=5)
+            assert future.meta is None
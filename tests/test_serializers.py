@@ -0,0 +1,125 @@
+#-*- coding:utf-8 -*-
+import json
+import datetime
+import unittest
+
+from flask import Flask
+
+from reliure.engine import Engine
+from reliure.types import Numeric
+from reliure.exceptions import ReliureError
+from reliure.utils.cache import LRU
+from reliure.web import ReliureAPI, EngineView
+from reliure import serializers
+from reliure.serializers import Serializer, JsonSerializer, MsgpackSerializer, negotiate
+
+
+class FakeArray(object):
+    """ Behaves as a numpy array for the serializers
+    """
+    def __init__(self, values):
+        self.values = values
+
+    def tolist(self):
+        return list(self.values)
+
+
+class ReprSerializer(Serializer):
+    content_type = "text/x-repr"
+
+    def dumps(self, data):
+        return repr(data["results"]).encode("utf8")
+
+
+class TestSerializers(unittest.TestCase):
+
+    def test_json(self):
+        serializer = JsonSerializer(use_orjson=False)
+        data = {"scores": FakeArray([0.5, 2]), "day": datetime.date(2016, 12, 1), "text": u"été"}
+        dumped = serializer.dumps(data)
+        assert isinstance(dumped, bytes)
+        assert serializer.loads(dumped) == {"scores": [0.5, 2], "day": "2016-12-01", "text": u"été"}
+        with self.assertRaises(TypeError):
+            serializer.dumps({"obj": object()})
+
+    @unittest.skipIf(serializers.orjson is None, "orjson is not installed")
+    def test_orjson(self):
+        serializer = JsonSerializer()
+        assert serializer.use_orjson
+        assert serializer.loads(serializer.dumps({"scores": FakeArray([1, 2])})) == {"scores": [1, 2]}
+
+    @unittest.skipIf(serializers.msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        serializer = MsgpackSerializer()
+        data = {"scores": FakeArray([0.5, 2]), "name": u"été"}
+        assert serializer.loads(serializer.dumps(data)) == {"scores": [0.5, 2], "name": u"été"}
+
+    @unittest.skipIf(serializers.msgpack is not None, "msgpack is installed")
+    def test_msgpack_missing(self):
+        with self.assertRaises(ReliureError):
+            MsgpackSerializer()
+
+    def test_negotiate(self):
+        json_ser, repr_ser = JsonSerializer(), ReprSerializer()
+        available = [json_ser, repr_ser]
+        assert negotiate(None, available) is json_ser
+        assert negotiate("", available) is json_ser
+        assert negotiate("text/x-repr", available) is repr_ser
+        assert negotiate("text/*", available) is repr_ser
+        assert negotiate("image/png", available) is json_ser
+        # quality values
+        assert negotiate("text/x-repr;q=0.5, application/json", available) is json_ser
+        assert negotiate("application/json;q=0.2, text/x-repr;q=0.9", available) is repr_ser
+        assert negotiate("text/x-repr;q=0, */*", available) is json_ser
+        assert negotiate("text/x-repr;q=oops, application/json;q=0.1", available) is json_ser
+
+
+class TestViewSerializers(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = 0
+        def mult(value):
+            self.calls += 1
+            return value * 2
+        engine = Engine("mult")
+        engine.mult.setup(in_name="in")
+        engine.mult.set(mult)
+        self.view = EngineView(engine, "mult")
+        self.view.set_input_type(Numeric(vtype=int))
+        self.view.add_output("mult")
+        self.view.set_serializers(JsonSerializer(), ReprSerializer())
+
+        api = ReliureAPI()
+        api.register_view(self.view)
+        app = Flask(__name__)
+        app.config['TESTING'] = True
+        app.register_blueprint(api, url_prefix="/api")
+        self.app = app.test_client()
+
+    def play(self, accept=None):
+        headers = {"Accept": accept} if accept else {}
+        return self.app.post('api/mult', data=json.dumps({"in": 4}), headers=headers,
+                             content_type='application/json')
+
+    def test_accept(self):
+        resp = self.play()
+        assert resp.content_type == "application/json"
+        assert json.loads(resp.data.decode("utf-8"))["results"] == {"mult": 8}
+        resp = self.play("text/x-repr, application/json;q=0.5")
+        assert resp.content_type.startswith("text/x-repr")
+        assert resp.data == b"{'mult': 8}"
+        resp = self.app.post('api/mult/play_batch', data=json.dumps({"inputs": [{"in": 1}]}),
+                             headers={"Accept": "text/x-repr"}, content_type='application/json')
+        assert resp.content_type.startswith("text/x-repr")
+
+    def test_cache(self):
+        self.view.set_cache(LRU(maxsize=10))
+        assert self.play().content_type == "application/json"
+        assert self.play("text/x-repr").data == b"{'mult': 8}"
+        assert self.play().content_type == "application/json"
+        # one play by format
+        assert self.calls == 2
+
+    def test_set_serializers(self):
+        with self.assertRaises(ValueError):
+            self.view.set_serializers()
@@ -0,0 +1,73 @@
+#-*- coding:utf-8 -*-
+import os
+import gzip
+import json
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from reliure.sinks import JsonLinesSink, ShardedSink
+
+
+class TestSinks(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_jsonlines(self):
+        path = os.path.join(self.tmpdir, "out.jsonl")
+        sink = JsonLinesSink(path, buffer_size=3)
+        with sink:
+            self.assertEqual(sink.write({"id": num} for num in range(5)), 5)
+            # the lines are written by batches
+            self.assertEqual(len(sink._buffer), 2)
+            self.assertEqual(sink.write([{"id": 5, "text": u"été"}]), 1)
+        self.assertEqual(sink.count, 6)
+        with open(path, "rb") as jfile:
+            lines = [json.loads(line.decode("utf8")) for line in jfile]
+        self.assertEqual([line["id"] for line in lines], list(range(6)))
+        self.assertEqual(lines[-1]["text"], u"été")
+        # append
+        with JsonLinesSink(path, append=True, dumps=str) as sink:
+            sink.write(["plain"])
+        self.assertEqual(open(path).readlines()[-1], "plain\n")
+        with self.assertRaises(ValueError):
+            JsonLinesSink(path, compress="zip")
+
+    def test_gzip(self):
+        path = os.path.join(self.tmpdir, "out.jsonl.gz")
+        with JsonLinesSink(path) as sink:
+            sink.write(range(1000))
+        with gzip.open(path) as gfile:
+            self.assertEqual([int(line) for line in gfile], list(range(1000)))
+        # the file is not opened in the pickled sink
+        with JsonLinesSink(path, append=True) as sink:
+            sink = pickle.loads(pickle.dumps(sink))
+            sink.open()
+            sink.write([1000])
+            sink.close()
+        with gzip.open(path) as gfile:
+            self.assertEqual(len(gfile.readlines()), 1001)
+
+    def test_sharded(self):
+        pattern = os.path.join(self.tmpdir, "out-{shard}.jsonl.gz")
+        sink = ShardedSink(pattern, buffer_size=2)
+        sink.open(nshards=3)
+        self.assertEqual(sink.write_shard(1, range(3)), 3)
+        self.assertEqual(sink.write_shard(1, range(3, 5)), 2)
+        sink.close()
+        self.assertEqual([os.path.exists(path) for path in sink.paths], [True] * 3)
+        with gzip.open(sink.path(1)) as gfile:
+            self.assertEqual([int(line) for line in gfile], list(range(5)))
+        with gzip.open(sink.path(0)) as gfile:
+            self.assertEqual(gfile.read(), b"")
+        # shards are emptied when the sink is opened again
+        sink.open(nshards=3)
+        with gzip.open(sink.path(1)) as gfile:
+            self.assertEqual(gfile.read(), b"")
+        with self.assertRaises(ValueError):
+            ShardedSink(os.path.join(self.tmpdir, "out.jsonl"))
@@ -0,0 +1,51 @@
+#-*- coding:utf-8 -*-
+import os
+import json
+import shutil
+import pickle
+import tempfile
+import unittest
+
+from reliure.sources import FileSource, FileSplit
+
+
+class TestFileSource(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "in.jsonl")
+        with open(self.path, "w") as infile:
+            for num in range(100):
+                infile.write(json.dumps({"id": num, "text": "x" * (num % 13)}) + "\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_splits(self):
+        for split_size in (1, 10, 64, 1000, 10**6):
+            for use_mmap in (False, True):
+                source = FileSource(self.path, split_size=split_size, parse=json.loads, use_mmap=use_mmap)
+                splits = list(source.splits())
+                # contiguous ranges, on lines boundaries
+                self.assertEqual(splits[0].start, 0)
+                self.assertEqual(splits[-1].end, os.path.getsize(self.path))
+                for prev, split in zip(splits, splits[1:]):
+                    self.assertEqual(prev.end, split.start)
+                records = [record for split in splits for record in split.read()]
+                self.assertEqual([record["id"] for record in records], list(range(100)))
+                self.assertEqual(list(source), records)
+        with self.assertRaises(ValueError):
+            FileSource(self.path, split_size=0)
+
+    def test_no_final_newline(self):
+        path = os.path.join(self.tmpdir, "in.txt")
+        with open(path, "w") as infile:
+            infile.write(u"a\nbb\n\nccc")
+        source = FileSource(path, split_size=2)
+        self.assertEqual(list(source), ["a", "bb", "", "ccc"])
+
+    def test_pickle(self):
+        split = next(FileSource(self.path, split_size=100, use_mmap=True).splits())
+        split = pickle.loads(pickle.dumps(split))
+        self.assertIsInstance(split, FileSplit)
+        self.assertEqual(split.read(), list(FileSource(self.path))[:len(split.read())])
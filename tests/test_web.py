@@ -9,9 +9,10 @@ from flask import Flask, request
 
 from reliure.pipeline import Optionable
 from reliure.engine import Engine
-from reliure.types import Numeric
+from reliure.types import Numeric, Text
 from reliure.exceptions import ValidationError
 
+from reliure.utils.cache import LRU
 from reliure.web import ReliureAPI, EngineView, ComponentView
 
 class OptProductEx(Optionable):
@@ -234,6 +235,37 @@ class TestReliureAPIMultiInputs(unittest.TestCase):
         #TODO: test error when wrong input
 
 
+class TestReliureAPIOutputs(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = Engine("op1", "op2")
+        self.engine.op1.setup(in_name="in", out_name="middle")
+        self.engine.op2.setup(in_name="middle", out_name="out")
+        self.engine.op1.set(OptProductEx())
+        def fail(middle):
+            raise RuntimeError("op2 should not be run")
+        self.engine.op2.set(fail)
+
+        egn_view = EngineView(self.engine, name="my_egn")
+        egn_view.set_input_type(Numeric(vtype=int))
+        egn_view.add_output("middle")
+
+        api = ReliureAPI()
+        api.register_view(egn_view)
+
+        app = Flask(__name__)
+        app.config['TESTING'] = True
+        app.register_blueprint(api, url_prefix="/api")
+        self.app = app.test_client()
+
+    def test_play_only_needed(self):
+        json_data = json.dumps({'in': 2})
+        resp = self.app.post('api/my_egn', data=json_data, content_type='application/json')
+        resp_data = json.loads(resp.data.decode("utf-8"))
+        assert resp_data["results"] == {"middle": 10}
+        assert len(resp_data["meta"]["details"]) == 1
+
+
 class TestReliureAPIWithBlock(unittest.TestCase):
     maxDiff = None
 
@@ -373,3 +405,188 @@ class TestComponentView(unittest.TestCase):
         assert results == {"value": 33*5}
 
 
+
+
+class CountingMult(OptProductEx):
+    def __init__(self):
+        super(CountingMult, self).__init__()
+        self.calls = 0
+
+    def __call__(self, arg, factor=5):
+        self.calls += 1
+        return arg * factor
+
+
+class TestReliureAPICache(unittest.TestCase):
+
+    def setUp(self):
+        self.comp = CountingMult()
+        self.view = ComponentView(self.comp)
+        self.view.add_input("number", Numeric(vtype=int))
+        self.view.play_route("n/<number>")
+        self.view.set_cache(LRU(maxsize=None, maxbytes=2**16))
+
+        api = ReliureAPI()
+        api.register_view(self.view)
+        app = Flask(__name__)
+        app.config['TESTING'] = True
+        app.register_blueprint(api, url_prefix="/api")
+        self.app = app.test_client()
+
+    def play(self, number, factor):
+        rdata = {"number": number, "options": {"name": "mult_opt", "options": {"factor": factor}}}
+        resp = self.app.post('api/mult_opt', data=json.dumps(rdata), content_type='application/json')
+        assert resp.content_type == "application/json"
+        return json.loads(resp.data.decode("utf-8"))["results"]["mult_opt"]
+
+    def test_cache(self):
+        assert self.play(3, 2) == 6
+        # inputs are compared once parsed
+        assert self.play("3", 2) == 6
+        assert self.comp.calls == 1
+        # an other configuration
+        assert self.play(3, 4) == 12
+        assert self.comp.calls == 2
+        # the short route shares the cache
+        resp = self.app.get('api/mult_opt/n/3?factor=2')
+        assert json.loads(resp.data.decode("utf-8"))["results"] == {"mult_opt": 6}
+        assert self.comp.calls == 2
+        stats = json.loads(self.app.get('api/mult_opt').data.decode("utf-8"))["cache"]
+        assert stats["hits"] == 2
+        assert stats["misses"] == 2
+        assert stats["size"] == 2
+        assert 0 < stats["bytes"] <= stats["maxbytes"]
+
+    def test_cache_errors(self):
+        def fail(number):
+            raise ValueError("no way")
+        view = ComponentView(fail)
+        view.add_input("number", Numeric(vtype=int))
+        view.set_cache(LRU(maxsize=10))
+        with self.assertRaises(ValueError):
+            view.play_cached({"number": 2}, {})
+        assert len(view.cache) == 0
+
+
+class BatchMult(OptProductEx):
+    def __init__(self):
+        super(BatchMult, self).__init__()
+        self.batches = []
+
+    def batch_call(self, args, factor=5):
+        self.batches.append(len(args))
+        return [arg * factor for arg in args]
+
+
+class TestReliureAPIBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.comp = BatchMult()
+        self.engine = Engine("op1", "op2")
+        self.engine.op1.setup(in_name="in", out_name="middle")
+        self.engine.op2.setup(in_name="middle", out_name="out")
+        self.engine.op1.set(self.comp)
+        self.engine.op2.set(OptProductEx())
+        egn_view = EngineView(self.engine, "egn")
+        egn_view.set_input_type(Numeric(vtype=int, min=-5, max=5))
+        egn_view.add_output("out")
+
+        comp_view = ComponentView(OptProductEx())
+        comp_view.add_input("number", Numeric(vtype=int))
+
+        api = ReliureAPI()
+        api.register_view(egn_view)
+        api.register_view(comp_view)
+        app = Flask(__name__)
+        app.config['TESTING'] = True
+        app.register_blueprint(api, url_prefix="/api")
+        self.app = app.test_client()
+
+    def post(self, path, rdata):
+        return self.app.post(path, data=json.dumps(rdata), content_type='application/json')
+
+    def test_play_batch(self):
+        rdata = {
+            "inputs": [{"in": num} for num in range(-5, 6)],
+            "options": {"op2": [{"name": "mult_opt", "options": {"factor": 2}}]},
+        }
+        resp = self.post('api/egn/play_batch', rdata)
+        assert resp.status_code == 200
+        data = json.loads(resp.data.decode("utf-8"))
+        assert data["results"] == [{"out": num * 5 * 2} for num in range(-5, 6)]
+        # the component is called once for the batch
+        assert self.comp.batches == [11]
+        assert [meta["name"] for meta in data["meta"]["details"]] == ["op1:[mult_opt]", "op2:[mult_opt]"]
+
+    def test_play_batch_component(self):
+        resp = self.post('api/mult_opt/play_batch', {"inputs": [{"number": 1}, {"number": "2"}]})
+        data = json.loads(resp.data.decode("utf-8"))
+        assert data["results"] == [{"mult_opt": 5}, {"mult_opt": 10}]
+        resp = self.post('api/mult_opt/play_batch', {"inputs": []})
+        assert json.loads(resp.data.decode("utf-8"))["results"] == []
+
+    def test_play_batch_invalid(self):
+        # all the inputs are validated before playing
+        resp = self.post('api/egn/play_batch', {"inputs": [{"in": 1}, {"in": 12}]})
+        assert resp.status_code == 400
+        assert self.comp.batches == []
+        resp = self.post('api/egn/play_batch', {"inputs": [{"in": 1}, 2]})
+        assert resp.status_code == 400
+        resp = self.post('api/egn/play_batch', {"in": 1})
+        assert resp.status_code == 400
+        resp = self.app.post('api/egn/play_batch', data={"in": 1})
+        assert resp.status_code == 400
+
+
+class TestReliureAPIStream(unittest.TestCase):
+
+    def setUp(self):
+        def rank(text):
+            for word in sorted(text.split()):
+                if word == "fail":
+                    raise ValueError("failed")
+                yield word
+        engine = Engine("rank", "count")
+        engine.rank.setup(in_name="in")
+        engine.rank.set(rank)
+        engine.count.setup(in_name="in")
+        engine.count.set(lambda text: len(text.split()))
+        view = EngineView(engine, "rank")
+        view.set_input_type(Text())
+        view.add_output("rank", lambda word: word.upper())
+        view.add_output("count")
+
+        api = ReliureAPI()
+        api.register_view(view)
+        app = Flask(__name__)
+        app.config['TESTING'] = True
+        app.register_blueprint(api, url_prefix="/api")
+        self.app = app.test_client()
+
+    def test_play_stream(self):
+        resp = self.app.post('api/rank/play_stream', data=json.dumps({"in": "b c a"}),
+                             content_type='application/json')
+        assert resp.content_type == "application/x-ndjson"
+        assert resp.headers["Cache-Control"] == "no-cache"
+        chunks = [json.loads(line) for line in resp.data.decode("utf-8").splitlines()]
+        # the serializer is called on each item
+        assert chunks[:-1] == [{"output": "rank", "item": "A"}, {"output": "rank", "item": "B"},
+                               {"output": "rank", "item": "C"}, {"output": "count", "value": 3}]
+        assert chunks[-1]["meta"]["name"] == "engine:[rank:[rank], count:[<lambda>]]"
+
+    def test_play_stream_sse(self):
+        resp = self.app.post('api/rank/play_stream', data={"in": "b a"},
+                             headers={"Accept": "text/event-stream"})
+        assert resp.content_type.startswith("text/event-stream")
+        events = resp.data.decode("utf-8").split("\n\n")
+        assert events[0] == 'event: item\ndata: {"output":"rank","item":"A"}'
+        assert events[2] == 'event: value\ndata: {"output":"count","value":2}'
+        assert events[3].startswith('event: meta\ndata: {"meta":')
+
+    def test_play_stream_error(self):
+        resp = self.app.post('api/rank/play_stream', data=json.dumps({"in": "b fail a"}),
+                             content_type='application/json')
+        chunks = [json.loads(line) for line in resp.data.decode("utf-8").splitlines()]
+        assert chunks[0] == {"output": "rank", "item": "A"}
+        assert chunks[2] == {"error": "failed"}
+        assert "meta" in chunks[3]